@@ -0,0 +1,101 @@
+import json
+import mmap
+import struct
+import pygame
+
+
+class TextureAtlas:
+    MAGIC = b"MGAT\x01"
+    # the length of the JSON index which follows the magic, mapping each name to [offset, width, height]
+    HEADER = struct.Struct("<I")
+    # the byte order pygame uses for 32 bit surfaces with alpha on little endian machines, which is also what
+    # convert_alpha() gives on the usual displays
+    PIXEL_FORMAT = "BGRA"
+    PIXEL_MASKS = (0xff0000, 0xff00, 0xff)
+    # pixel data starts on a cache line
+    ALIGNMENT = 64
+
+    def __init__(self, path):
+        self.path = path
+
+        # the file is mapped rather than read, so nothing is decoded and only the pages of the textures which are
+        # drawn are ever touched. Copy on write, since pygame surfaces are writable.
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic_size = len(TextureAtlas.MAGIC)
+
+        if self.__map[:magic_size] != TextureAtlas.MAGIC:
+            raise ValueError(f"{path} is not a texture atlas")
+
+        index_size = TextureAtlas.HEADER.unpack_from(self.__map, magic_size)[0]
+        index_start = magic_size + TextureAtlas.HEADER.size
+
+        self.__index = json.loads(self.__map[index_start:index_start + index_size])
+        self.__view = memoryview(self.__map)
+
+    @staticmethod
+    def load(path):
+        # None when there is no usable atlas, so that callers can fall back to the source images
+        try:
+            return TextureAtlas(path)
+        except (OSError, ValueError):
+            return None
+
+    def __contains__(self, name):
+        return name in self.__index
+
+    def names(self):
+        return list(self.__index)
+
+    def texture(self, name):
+        offset, w, h = self.__index[name]
+
+        surface = pygame.image.frombuffer(self.__view[offset:offset + w * h * 4], (w, h), TextureAtlas.PIXEL_FORMAT)
+
+        # the surface shares its pixels with the file, unless the display wants them in some other order
+        display = pygame.display.get_surface()
+        if display is not None and display.get_masks()[:3] != TextureAtlas.PIXEL_MASKS:
+            surface = surface.convert_alpha()
+
+        return surface
+
+    @staticmethod
+    def write(path, textures):
+        # textures maps names to surfaces
+        index = {}
+        pixels = []
+        offset = 0
+
+        for name, surface in textures.items():
+            data = pygame.image.tobytes(surface, TextureAtlas.PIXEL_FORMAT)
+            padding = -len(data) % TextureAtlas.ALIGNMENT
+
+            index[name] = [offset, surface.get_width(), surface.get_height()]
+            pixels.append(data + bytes(padding))
+            offset += len(data) + padding
+
+        # offsets are made absolute once the size of the index is known, with the index padded so that the pixel
+        # data is still aligned. The offsets only grow as the index does, so this settles after a step or two.
+        header_size = len(TextureAtlas.MAGIC) + TextureAtlas.HEADER.size
+        index_size = 0
+
+        while True:
+            absolute = {name: [o + header_size + index_size, w, h] for name, (o, w, h) in index.items()}
+            index_bytes = json.dumps(absolute).encode("utf-8")
+
+            needed = len(index_bytes) - (header_size + len(index_bytes)) % -TextureAtlas.ALIGNMENT
+            if needed <= index_size:
+                break
+
+            index_size = needed
+
+        index_bytes = index_bytes.ljust(index_size)
+
+        with open(path, "wb") as f:
+            f.write(TextureAtlas.MAGIC)
+            f.write(TextureAtlas.HEADER.pack(index_size))
+            f.write(index_bytes)
+
+            for data in pixels:
+                f.write(data)
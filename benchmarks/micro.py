@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import time
+import timeit
+
+# the rules live on the pygame view, so it needs a window even though nothing is drawn
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from message import Message, MessageStream
+from instructions import Instruction, parse_instruction
+from model import Deck, Card
+from server import Server
+from mongoose import Mongoose
+from server_connection import ServerConnection
+
+
+def protocol_benchmarks():
+    chat = Message.new_send_message(b"u_message:'Player Alice mongoosed Bob!'")
+    frame = chat.encode()
+    frames = frame * 16
+
+    deck_message = "g_send:" + ":".join(f"'{s}-{v}'" for s in range(4) for v in range(1, 14))
+
+    return {
+        "message.encode": chat.encode,
+        "message.decode": lambda: Message.new_recv_message().decode(frame),
+        "message_stream.feed_16_frames": lambda: MessageStream().feed(frames),
+        "parse_instruction.place": lambda: parse_instruction("g_place:'12':'17'"),
+        "parse_instruction.chat": lambda: parse_instruction("u_message:'Player Alice mongoosed Bob!'"),
+        "parse_instruction.send_deck": lambda: parse_instruction(deck_message),
+    }
+
+
+def server_benchmarks():
+    # chat is not rate limited here, so that every message goes all the way through to the send queue
+    server = Server(("127.0.0.1", 0), verbose=False, rate_limits={Instruction.Update.CHAT_MESSAGE: None})
+    client = ("127.0.0.1", 0)
+    # the server only decodes messages from clients it has accepted. Nothing is ever flushed to the socket.
+    server.accept_new_client(socket.socketpair()[0], client)
+
+    def decode_chat():
+        server.decode_instruction(client, "u_message:'hello'")
+
+    return {
+        "server.decode_instruction.chat": decode_chat,
+    }
+
+
+def deck_benchmarks():
+    rng = random.Random(0)
+
+    deck = Deck.full()
+    deck.shuffle()
+    card = Card("Spades", 1)
+
+    shuffle_deck = Deck(list(deck.cards))
+
+    def top_round_trip():
+        deck.add_card_to_top(card)
+        deck.take_top()
+
+    def bottom_round_trip():
+        deck.add_card_to_bottom(card)
+        deck.take_bottom()
+
+    def shuffle():
+        rng.shuffle(shuffle_deck.cards)
+
+    return {
+        "deck.top_round_trip": top_round_trip,
+        "deck.bottom_round_trip": bottom_round_trip,
+        "deck.top": deck.top,
+        # what the server pays to deal each new game
+        "deck.full": Deck.full,
+        "deck.full.3_decks": lambda: Deck.full(3),
+        "deck.deal_4": lambda: deck.deal(4),
+        "deck.deal_8": lambda: deck.deal(8),
+        "deck.shuffle": shuffle,
+    }
+
+
+def mid_game():
+    # four players a few rounds in: part-built center piles, something on every face up pile
+    random.seed(0)
+
+    deck = Deck.full()
+    deck.shuffle()
+
+    local, _ = socket.socketpair()
+    game = Mongoose(ServerConnection(local, idle_timeout=None), deck)
+    game.setup_game(0, [["A", 0], ["B", 1], ["C", 2], ["D", 3]])
+
+    for pile, suit, values in zip(game.center_piles, ["Spades", "Hearts", "Clubs", "Diamonds"],
+                                  [range(4, 11), range(6, 9), range(7, 8), []]):
+        pile.cards = [Card(suit, v) for v in sorted(values, reverse=True)]
+
+    game.index_center()
+
+    for player, values in zip(game.players, [(2, 9), (5, 12), (3,), (13, 1, 4)]):
+        player.face_up.cards = [Card("Diamonds", v) for v in values]
+
+    return game
+
+
+def rules_benchmarks():
+    game = mid_game()
+
+    spades_pile = game.center_piles[0]
+    held = Card("Spades", 11)
+
+    # is_valid_center_move reads the card currently held by the local player
+    game._Mongoose__holding_card = held
+
+    player = game.players[1]
+    pickup_move = [player.face_up.top(), player.face_up, None]
+    complete_move = [Card("Hearts", 9), player.face_down, game.center_piles[1]]
+    own_pile_move = [Card("Hearts", 2), player.face_down, player.face_up]
+
+    return {
+        "mongoose.is_valid_center_move": lambda: game.is_valid_center_move(spades_pile),
+        "mongoose.is_valid_center_move.empty": lambda: game.is_valid_center_move(game.center_piles[3]),
+        "mongoose.check_move.pickup": lambda: game.check_move(pickup_move, player),
+        "mongoose.check_move.to_center": lambda: game.check_move(complete_move, player),
+        "mongoose.check_move.to_own_pile": lambda: game.check_move(own_pile_move, player),
+        "mongoose.check_for_auto_mongoose": lambda: game.check_for_auto_mongoose(held, spades_pile),
+    }
+
+
+SUITES = {
+    "protocol": protocol_benchmarks,
+    "server": server_benchmarks,
+    "deck": deck_benchmarks,
+    "rules": rules_benchmarks,
+}
+
+
+def measure(fn, repeat, min_time):
+    timer = timeit.Timer(fn)
+
+    # pick a loop count that runs for at least min_time, then take several samples of that
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+
+    samples = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_ns": min(samples) * 1e9,
+        "median_ns": statistics.median(samples) * 1e9,
+        "stdev_ns": statistics.stdev(samples) * 1e9 if len(samples) > 1 else 0.0,
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    print(f"\nCompared with {baseline_path} (min time, lower is better):")
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = result["min_ns"] / baseline[name]["min_ns"]
+        print(f"  {name:<40} {ratio:6.2f}x {'slower' if ratio > 1 else 'faster'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the protocol, model and rules hot paths.")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("-c", "--compare", help="compare against a JSON file from an earlier run")
+    parser.add_argument("-f", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per sample")
+    args = parser.parse_args()
+
+    results = {}
+
+    for suite in SUITES.values():
+        for name, fn in suite().items():
+            if args.filter not in name:
+                continue
+
+            result = measure(fn, args.repeat, args.min_time)
+            results[name] = result
+
+            print(f"{name:<40} {result['min_ns']:10.0f} ns  (median {result['median_ns']:.0f} ns, "
+                  f"stdev {result['stdev_ns']:.0f} ns)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "timestamp": time.time(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
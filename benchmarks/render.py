@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import time
+
+# everything is drawn into an offscreen window, so this runs without a display or a GPU
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+from model import Deck, Card, SUITS
+from button import Button
+from mongoose import Mongoose
+from server_connection import ServerConnection
+from textures import CardTextures
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "render_budgets.json")
+
+PLAYER_COUNTS = (2, 4, 8, 12)
+WINDOW_SIZES = ((800, 600), (1280, 720), (1920, 1080), (2560, 1440))
+
+
+def new_game(n_players, window_size):
+    random.seed(0)
+
+    # buttons register themselves globally, so those of the last game are dropped first
+    Button.REGISTERED_BUTTONS.clear()
+
+    deck = Deck.full()
+    deck.shuffle()
+
+    # nothing is ever sent, but the game needs a connection
+    local, peer = socket.socketpair()
+    game = Mongoose(ServerConnection(local, idle_timeout=None), deck, screen_size=window_size)
+    game.setup_game(0, [[f"Player {i}", i] for i in range(n_players)])
+
+    # a few rounds in, with something on every face up pile
+    for player in game.players:
+        for _ in range(3):
+            player.face_up.add_card_to_top(player.face_down.take_top())
+
+    return game, peer
+
+
+def full_piles(game):
+    for pile, suit in zip(game.center_piles, SUITS):
+        pile.cards = [Card(suit, v) for v in range(13, 0, -1)]
+
+    game.index_center()
+
+
+def held_card(game):
+    # held over the second center pile, so that its highlight and those of every hand are drawn
+    game._Mongoose__holding_card = Card("Spades", 11)
+    game._Mongoose__mouse_pos = (int(0.54 * game.screen_size[0]), int(0.5 * game.screen_size[1]))
+
+
+def busy_chat(game):
+    feed = game._Mongoose__feed
+
+    for i in range(200):
+        feed.add_line(f"Player {i % game.n_players} mongoosed Player {(i + 1) % game.n_players}!")
+
+
+def everything(game):
+    full_piles(game)
+    held_card(game)
+    busy_chat(game)
+
+
+SCENARIOS = {
+    "table": lambda game: None,
+    "full_piles": full_piles,
+    "held_card": held_card,
+    "busy_chat": busy_chat,
+    "everything": everything,
+}
+
+
+def measure(game, frames):
+    def frame():
+        start = time.perf_counter()
+        game.render()
+        pygame.display.flip()
+        return time.perf_counter() - start
+
+    # the scaled textures for this window size are built in the background, and the frames which come before them
+    # are not what is being measured
+    deadline = time.perf_counter() + 5
+
+    while not CardTextures.pyramid.ready(game.screen_size[0]) and time.perf_counter() < deadline:
+        frame()
+        time.sleep(0.01)
+
+    for _ in range(5):
+        frame()
+
+    samples = sorted(frame() for _ in range(frames))
+
+    return {
+        "frames": frames,
+        "mean_ms": statistics.mean(samples) * 1e3,
+        "p95_ms": samples[int(0.95 * (len(samples) - 1))] * 1e3,
+        "max_ms": samples[-1] * 1e3,
+    }
+
+
+def check_budgets(results, budgets_path):
+    # returns the names of the cases over budget
+    with open(budgets_path) as f:
+        budgets = json.load(f)
+
+    over = []
+
+    print(f"\nCompared with the budgets in {budgets_path} (p95 frame time):")
+
+    for name, result in results.items():
+        if name not in budgets:
+            continue
+
+        budget = budgets[name]
+        ok = result["p95_ms"] <= budget
+
+        if not ok:
+            over.append(name)
+
+        print(f"  {name:<40} {result['p95_ms']:7.2f}ms of {budget:7.2f}ms  {'ok' if ok else 'OVER BUDGET'}")
+
+    return over
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the game headlessly through scripted table states and "
+                                                 "check the frame times against stored budgets.")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("-f", "--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--frames", type=int, default=60, help="frames measured per case")
+    parser.add_argument("--budgets", default=BUDGETS_PATH)
+    parser.add_argument("--write-budgets", type=float, metavar="HEADROOM",
+                        help="store this many times each p95 as the new budgets, rather than checking them")
+    args = parser.parse_args()
+
+    results = {}
+
+    for n_players in PLAYER_COUNTS:
+        for window_size in WINDOW_SIZES:
+            for scenario, setup in SCENARIOS.items():
+                name = f"{scenario}/{n_players}p/{window_size[0]}x{window_size[1]}"
+
+                if args.filter not in name:
+                    continue
+
+                game, peer = new_game(n_players, window_size)
+                setup(game)
+
+                result = measure(game, args.frames)
+                results[name] = result
+
+                game.connection.close()
+                peer.close()
+
+                print(f"{name:<40} mean {result['mean_ms']:7.2f}ms  p95 {result['p95_ms']:7.2f}ms  "
+                      f"max {result['max_ms']:7.2f}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "timestamp": time.time(),
+                "python": sys.version,
+                "platform": platform.platform(),
+                "results": results,
+            }, f, indent=2)
+
+    if args.write_budgets is not None:
+        budgets = {name: round(result["p95_ms"] * args.write_budgets, 2) for name, result in results.items()}
+
+        with open(args.budgets, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+        print(f"\nBudgets written to {args.budgets}.")
+        return 0
+
+    if not os.path.exists(args.budgets):
+        return 0
+
+    return 1 if check_budgets(results, args.budgets) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
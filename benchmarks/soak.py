@@ -0,0 +1,136 @@
+import argparse
+import gc
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+from message import Message
+from instructions import Instruction
+from server import Server
+
+
+def scrape(port):
+    gauges = {}
+
+    for line in urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=30).read().decode().splitlines():
+        if line.startswith("mongoose_") and "{" not in line:
+            name, value = line.split()
+            gauges[name] = float(value)
+
+    return gauges
+
+
+def send(s, message):
+    s.sendall(Message.new_send_message(message.encode("utf-8")).encode())
+
+
+def run_cycle(port, cycle, connections, table_size):
+    # a quarter quit properly, a quarter are seated at a table and drop out of the game mid-way, a quarter are
+    # seated and just close the connection, and the rest go silent without closing anything, which only the idle
+    # timeout can clean up after
+    sockets = []
+
+    for i in range(connections):
+        s = socket.create_connection(("127.0.0.1", port))
+        sockets.append(s)
+
+        if i % 4 != 3:
+            send(s, f"{Instruction.SET_PROPERTY}:'name':'soak{cycle}-{i}'")
+
+    # long enough for the tables to be dealt
+    time.sleep(0.2)
+
+    for i, s in enumerate(sockets):
+        if i % 4 == 0:
+            send(s, Instruction.Update.QUIT_GAME)
+            s.close()
+        elif i % 4 == 1:
+            send(s, f"{Instruction.Update.CHAT_MESSAGE}:'bye'")
+            s.close()
+        elif i % 4 == 2:
+            s.close()
+
+    return [s for i, s in enumerate(sockets) if i % 4 == 3]
+
+
+def wait_until_empty(port, timeout):
+    deadline = time.perf_counter() + timeout
+
+    while time.perf_counter() < deadline:
+        gauges = scrape(port)
+
+        if not gauges["mongoose_connected_clients"] and not gauges["mongoose_games_running"] and \
+                not gauges["mongoose_queue_length"]:
+            return gauges
+
+        time.sleep(0.1)
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect and drop thousands of clients in every way they can go, "
+                                                 "and check that the server's memory stays flat.")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=200, help="connections per cycle")
+    parser.add_argument("--table-size", type=int, default=4)
+    parser.add_argument("--idle-timeout", type=float, default=1.0)
+    parser.add_argument("--settle-timeout", type=float, default=60.0,
+                        help="seconds each cycle has to clean up after itself")
+    parser.add_argument("--warmup", type=int, default=3, help="cycles before the baseline is taken")
+    parser.add_argument("--max-growth", type=float, default=256.0,
+                        help="KiB of growth after the warm-up allowed before the run fails")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+
+    server = Server(("127.0.0.1", 0), verbose=False, metrics_port=0, table_size=args.table_size,
+                    max_queue_wait=None, idle_timeout=args.idle_timeout)
+    port = server.sock.getsockname()[1]
+    metrics_port = server.metrics_sock.getsockname()[1]
+
+    server_t = threading.Thread(target=server.start_server, kwargs={"console": False}, daemon=True)
+    server_t.start()
+
+    baseline = None
+    memory = 0
+
+    for cycle in range(args.cycles):
+        silent = run_cycle(port, cycle, args.connections, args.table_size)
+
+        gauges = wait_until_empty(metrics_port, args.idle_timeout + args.settle_timeout)
+
+        for s in silent:
+            s.close()
+
+        if gauges is None:
+            print(f"cycle {cycle}: the server still has connections or games after {args.settle_timeout}s")
+            return 1
+
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0] / 1024
+
+        if cycle + 1 == args.warmup:
+            baseline = memory
+
+        print(f"cycle {cycle:3}: {memory:9.1f}KiB traced, "
+              f"{gauges['mongoose_accepted_connections_total']:.0f} connections so far, "
+              f"{gauges['mongoose_timed_out_connections_total']:.0f} timed out")
+
+    server.stop_server()
+    server_t.join(5)
+
+    if baseline is None:
+        return 0
+
+    growth = memory - baseline
+    print(f"Growth after warm-up: {growth:.1f}KiB over {(args.cycles - args.warmup) * args.connections} connections")
+
+    return 0 if growth <= args.max_growth else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
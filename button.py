@@ -102,23 +102,26 @@ class Button:
         # draw the text
         self.__text.render(render_target, self.center)
 
-    def update_state(self, screen_size, mouse_pos, mouse_pressed):
+    def contains(self, screen_size, pos):
         sc_s_x = (self.center[0] - self.size[0] / 2) * screen_size[0]
         sc_s_y = (self.center[1] - self.size[1] / 2) * screen_size[1]
         sc_e_x = (self.center[0] + self.size[0] / 2) * screen_size[0]
         sc_e_y = (self.center[1] + self.size[1] / 2) * screen_size[1]
-        if sc_s_x <= mouse_pos[0] <= sc_e_x and sc_s_y <= mouse_pos[1] <= sc_e_y:
-            if mouse_pressed[0]:
-                if self.__state != Button.State.PRESSED:
-                    self.on_press()
-                self.__state = Button.State.PRESSED
-            else:
-                self.__state = Button.State.HOVER
-        else:
-            if mouse_pressed[0] and self.__state == Button.State.PRESSED:
+        return sc_s_x <= pos[0] <= sc_e_x and sc_s_y <= pos[1] <= sc_e_y
+
+    def update(self, screen_size, event):
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            if self.contains(screen_size, event.pos):
                 self.__state = Button.State.PRESSED
-            else:
-                self.__state = Button.State.DEFAULT
+                self.on_press()
+
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+            self.__state = Button.State.HOVER if self.contains(screen_size, event.pos) else Button.State.DEFAULT
+
+        elif event.type == pygame.MOUSEMOTION:
+            # a pressed button stays pressed until the mouse is released, even if dragged off
+            if self.__state != Button.State.PRESSED:
+                self.__state = Button.State.HOVER if self.contains(screen_size, event.pos) else Button.State.DEFAULT
 
     def subscribe_event(self, event):
         self.__event_callbacks.append(event)
@@ -133,6 +136,6 @@ class Button:
             b.render(render_target)
 
     @staticmethod
-    def update_all(group, screen_size, mouse_pos, mouse_pressed):
+    def update_all(group, screen_size, event):
         for b in Button.REGISTERED_BUTTONS[group]:
-            b.update_state(screen_size, mouse_pos, mouse_pressed)
+            b.update(screen_size, event)
@@ -1,15 +1,491 @@
-import socket
+import argparse
+import asyncio
+import random
+import statistics
+import subprocess
+import sys
+import os
+import threading
+import time
+import urllib.request
+import server as mongoose_server
+from loopback import open_loopback_connection
 from message import Message
+from instructions import Instruction, parse_instruction
+from model import GameState
+from prediction import Prediction
+from spectators import SpectatorFanout
 
-IP = "localhost"
-PORT = 1234
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect((IP, PORT))
+class LoadStats:
+    def __init__(self):
+        self.games = 0
+        self.abandoned_games = 0
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.errors = 0
+        # how long the server took to answer each of the bots' moves
+        self.latencies = []
 
-message = Message.new_recv_message()
+        # the bots' own moves which had to be made again after someone else's overtook them, and those the server
+        # turned down
+        self.rollbacks = 0
+        self.rejected_moves = 0
+        self.desyncs = 0
+        # tables sent to bots whose copy the server found had drifted from its own
+        self.resyncs = 0
 
-while True:
-    buffer = s.recv(1024)
-    if message.decode(buffer):
-        print(message.message.decode("utf-8"))
\ No newline at end of file
+        self.spectator_messages = 0
+        self.spectator_bytes = 0
+        self.spectator_snapshots = 0
+
+    def report(self, elapsed, server_cpu=None, queue_wait=None, combined_cpu=False):
+        lines = [f"Ran for {elapsed:.1f}s",
+                 f"  games/sec:    {self.games / elapsed:.3f} ({self.games} games, {self.abandoned_games} abandoned)",
+                 f"  messages/sec: {(self.messages_sent + self.messages_received) / elapsed:.1f} "
+                 f"({self.messages_sent} sent, {self.messages_received} received)"]
+
+        if len(self.latencies) >= 2:
+            percentiles = statistics.quantiles(self.latencies, n=100)
+            lines.append(f"  response:     p50={percentiles[49] * 1e3:.2f}ms p99={percentiles[98] * 1e3:.2f}ms "
+                         f"({len(self.latencies)} moves)")
+        else:
+            lines.append("  response:     not enough samples")
+
+        if self.spectator_bytes:
+            lines.append(f"  spectators:   {self.spectator_messages} messages in {self.spectator_bytes / 1024:.0f}KiB, "
+                         f"{self.spectator_snapshots} snapshots")
+
+        lines.append(f"  prediction:   {self.rollbacks} rollbacks, {self.rejected_moves} rejected moves, "
+                     f"{self.desyncs} desyncs, {self.resyncs} resyncs")
+
+        if queue_wait is not None:
+            lines.append(f"  queue wait:   {queue_wait * 1e3:.1f}ms mean")
+
+        # when the server runs in the same process as the bots, there is no telling their CPU time apart
+        if server_cpu is not None and combined_cpu:
+            lines.append(f"  combined CPU: {server_cpu / elapsed * 100:.1f}% (server and bots)")
+        elif server_cpu is not None:
+            lines.append(f"  server CPU:   {server_cpu / elapsed * 100:.1f}%")
+
+        lines.append(f"  errors:       {self.errors}")
+
+        return "\n".join(lines)
+
+
+class Bot:
+    def __init__(self, bot_id, stats, chat_interval=5.0, mongoose_chance=0.02, move_delay=0.0, max_turns=2000,
+                 stall_timeout=10.0, latency=0.0):
+        self.bot_id = bot_id
+        self.name = f"bot{bot_id}"
+        self.stats = stats
+
+        self.chat_interval = chat_interval
+        self.mongoose_chance = mongoose_chance
+        self.move_delay = move_delay
+        # bots can end up passing cards around forever, so a game is abandoned after this many turns
+        self.max_turns = max_turns
+        # ...or if nothing happens on the table for this long, e.g. because another bot gave up
+        self.stall_timeout = stall_timeout
+        # how long everything the bot sends takes to reach the server, on top of the real network
+        self.latency = latency
+
+        self.joined = asyncio.Event()
+        self.started = asyncio.Event()
+
+        self.__writer = None
+        self.__deck = None
+        self.__n_center_piles = GameState.N_CENTER_PILES
+        # the table as the bot sees it, with its own moves made straight away, and what the server has confirmed
+        self.__state = None
+        self.__prediction = None
+        self.__player = -1
+        self.__awaiting_echo = False
+
+        # send times of moves the server has still to accept or turn down, by sequence number
+        self.__pending_moves = {}
+        self.__chat_seq = 0
+
+    async def play_game(self, connect):
+        reader, self.__writer = await connect()
+
+        self.send(f"{Instruction.SET_PROPERTY}:'name':'{self.name}'")
+        self.joined.set()
+
+        chat_task = asyncio.create_task(self.chat_loop()) if self.chat_interval else None
+
+        last_progress = time.perf_counter()
+
+        try:
+            while not self.game_over() and (self.__state is None or self.__state.turn < self.max_turns):
+                header = await asyncio.wait_for(reader.readexactly(Message.HEADER_SIZE), self.stall_timeout)
+                size = int.from_bytes(header, "little")
+                frame = await reader.readexactly(Message.frame_size(size) - Message.HEADER_SIZE)
+
+                self.stats.messages_received += 1
+
+                message = frame[:size].decode("utf-8")
+
+                if not self.handle_message(message):
+                    break
+
+                if not message.startswith((Instruction.Update.CHAT_MESSAGE, Instruction.Update.PING)):
+                    last_progress = time.perf_counter()
+                elif time.perf_counter() - last_progress > self.stall_timeout:
+                    break
+
+                if self.move_delay:
+                    await asyncio.sleep(self.move_delay)
+
+                self.play_turn()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            if chat_task is not None:
+                chat_task.cancel()
+
+            self.send(Instruction.Update.QUIT_GAME)
+            self.__writer.close()
+
+            if self.__prediction is not None:
+                self.stats.rollbacks += self.__prediction.rollbacks
+                self.stats.rejected_moves += self.__prediction.rejected
+                self.stats.desyncs += self.__prediction.desyncs
+
+    def game_over(self):
+        return self.__state is not None and self.__state.game_over()
+
+    async def chat_loop(self):
+        while True:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.chat_interval)
+
+            self.__chat_seq += 1
+            self.send(f"{Instruction.Update.CHAT_MESSAGE}:'{self.name} #{self.__chat_seq}'")
+
+    def send(self, message):
+        if self.__writer.is_closing():
+            return
+
+        data = Message.new_send_message(message.encode("utf-8")).encode()
+
+        if self.latency:
+            asyncio.get_running_loop().call_later(self.latency, self.write, data)
+        else:
+            self.__writer.write(data)
+
+        self.stats.messages_sent += 1
+
+    def write(self, data):
+        if not self.__writer.is_closing():
+            self.__writer.write(data)
+
+    def move(self, instruction, *operands):
+        # the move is made on the bot's own table straight away, and sent with a sequence number so that the server
+        # says whether it was made there too, and the hash of the table after it so that the server can tell if the
+        # bot's table has drifted from its own
+        operands = [str(o) for o in operands]
+        seq = self.__prediction.predict(instruction, operands)
+
+        self.__pending_moves[seq] = time.perf_counter()
+        self.send(self.__prediction.move_message(instruction, operands, seq))
+
+    def handle_message(self, message):
+        # returns False when the bot cannot carry on with this game
+        instruction, operands = parse_instruction(message)
+
+        try:
+            if instruction == Instruction.Update.PING:
+                self.send(f"{Instruction.Update.PONG}:'{operands[0]}'")
+
+            elif instruction == Instruction.Update.GAME_RUNNING:
+                return False
+
+            elif instruction == Instruction.Game.TABLE:
+                self.__n_center_piles = int(operands[1])
+
+            elif instruction == Instruction.Game.SEND_DECK:
+                self.__deck = GameState.decode_deck(operands)
+
+            elif instruction == Instruction.START_GAME:
+                self.__player = int(operands[0])
+                self.__prediction = Prediction(GameState(self.__deck, len(operands[1:]) // 2, self.__n_center_piles))
+                self.__state = self.__prediction.view
+                self.started.set()
+
+            elif self.__state is None:
+                pass
+
+            elif instruction in (Instruction.Game.ACK, Instruction.Game.REJECT):
+                answer = self.__prediction.confirm if instruction == Instruction.Game.ACK else self.__prediction.reject
+                seq = int(operands[0])
+
+                sent_at = self.__pending_moves.pop(seq, None)
+                if sent_at is not None:
+                    self.stats.latencies.append(time.perf_counter() - sent_at)
+
+                if answer(seq):
+                    self.__state = self.__prediction.view
+
+            elif instruction in GameState.MOVES or instruction == Instruction.Game.SYNC_STATE:
+                if self.__prediction.apply_remote(instruction, operands):
+                    self.__state = self.__prediction.view
+
+                # the server only sends the bot the whole table when the bot's copy has drifted from its own
+                if instruction == Instruction.Game.SYNC_STATE:
+                    self.stats.resyncs += 1
+
+                if instruction == Instruction.Game.MOVE_ENDED:
+                    self.maybe_call_mongoose()
+                elif instruction in (Instruction.Game.CALL_MONGOOSE, Instruction.Game.FLIP_DECK):
+                    self.__awaiting_echo = False
+
+        except (IndexError, ValueError, AttributeError):
+            # the bot's view of the table has drifted from everyone else's; give up on this game
+            self.stats.errors += 1
+            return False
+
+        return True
+
+    def maybe_call_mongoose(self):
+        # now and again, accuse whoever just moved. This is only done at the start of the bot's own move,
+        # when it has nothing in flight, as the cards it passes would otherwise race its own pickups.
+        if self.__state.current_player() == self.__player and random.random() < self.mongoose_chance:
+            target = (self.__state.turn + self.__state.n_players - 1) % self.__state.n_players
+            self.__awaiting_echo = True
+            self.__prediction.expect_echo(Instruction.Game.CALL_MONGOOSE, [target, 0])
+            self.send(f"{Instruction.Game.CALL_MONGOOSE}:'{target}':'0'")
+
+    def play_turn(self):
+        state = self.__state
+
+        while state is not None and state.current_player() == self.__player and not self.__awaiting_echo and \
+                not self.__prediction.full():
+            p = self.__player
+            held = state.held[p]
+
+            if held is not None:
+                target = state.best_target(held, p)
+                self.move(Instruction.Game.PLACE_CARD, state.held_from[p], target)
+
+                # placing on your own face up pile ends the move
+                if target == 2 * p + 1:
+                    self.move(Instruction.Game.MOVE_ENDED)
+
+            elif state.face_up(p) and state.best_target(state.face_up(p)[-1], p) != 2 * p + 1:
+                self.pick_up(2 * p + 1)
+
+            elif state.face_down(p):
+                self.pick_up(2 * p)
+
+            elif state.face_up(p):
+                self.__awaiting_echo = True
+                self.send(f"{Instruction.Game.FLIP_DECK}:'{p}'")
+
+            else:
+                self.move(Instruction.Game.MOVE_ENDED)
+
+    def pick_up(self, deck_id):
+        self.move(Instruction.Game.PICKUP_CARD, deck_id)
+
+
+class Spectator:
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def watch(self, connect):
+        reader, writer = await connect()
+
+        role = f"{Instruction.SET_PROPERTY}:'role':'{SpectatorFanout.ROLE}'"
+        writer.write(Message.new_send_message(role.encode("utf-8")).encode())
+
+        try:
+            while True:
+                header = await reader.readexactly(Message.HEADER_SIZE)
+                size = int.from_bytes(header, "little")
+                frame = await reader.readexactly(Message.frame_size(size) - Message.HEADER_SIZE)
+
+                # spectators are sent batches, with one instruction per line
+                lines = frame[:size].decode("utf-8").split("\n")
+
+                self.stats.spectator_bytes += len(header) + len(frame)
+                self.stats.spectator_messages += len(lines)
+
+                if lines[0].startswith(Instruction.Spectate.SNAPSHOT):
+                    self.stats.spectator_snapshots += 1
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+
+def scrape_metric(metrics_url, name):
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=2) as response:
+            for line in response.read().decode("utf-8").splitlines():
+                if line.startswith(name + " "):
+                    return float(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+async def run_load(args):
+    stats = LoadStats()
+    server = None
+
+    local_server = None
+
+    if args.transport == "loopback":
+        # the server runs in a thread of this process, and the bots talk to it with no sockets in between
+        local_server = mongoose_server.Server((args.host, args.port), verbose=False, metrics_port=args.metrics_port,
+                                              replay_dir=args.replay_dir, table_size=args.bots,
+                                              max_queue_wait=args.queue_wait)
+        server = threading.Thread(target=local_server.start_server, kwargs={"console": False}, daemon=True)
+        server.start()
+
+    elif args.spawn_server:
+        # run the server in its own process; its matchmaking seats each batch of bots at a table of their own
+        server = subprocess.Popen(
+            [sys.executable, "-c",
+             f"import server; server.Server(('{args.host}', {args.port}), verbose=False, "
+             f"metrics_port={args.metrics_port}, replay_dir={args.replay_dir!r}, table_size={args.bots}, "
+             f"max_queue_wait={args.queue_wait}, unix_path={args.unix_path!r}).start_server()"],
+            stdin=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        await asyncio.sleep(1)
+
+    async def connect():
+        if local_server is not None:
+            return await open_loopback_connection(local_server)
+        if args.transport == "unix":
+            return await asyncio.open_unix_connection(args.unix_path)
+        return await asyncio.open_connection(args.host, args.port)
+
+    metrics_url = f"http://127.0.0.1:{args.metrics_port}/metrics" if args.metrics_port else None
+
+    connect_limit = asyncio.Semaphore(args.connect_concurrency)
+
+    async def run_bot(bot):
+        async with connect_limit:
+            task = asyncio.create_task(bot.play_game(connect))
+            await bot.joined.wait()
+        try:
+            await task
+        except OSError:
+            stats.errors += 1
+
+    next_id = 0
+
+    async def run_table():
+        # keeps a table's worth of bots in the queue for the length of the test
+        nonlocal next_id
+
+        while time.perf_counter() - start_time < args.duration:
+            bots = [Bot(next_id + i, stats, args.chat_interval, args.mongoose_chance, args.move_delay, args.max_turns,
+                        args.stall_timeout, args.latency)
+                    for i in range(args.bots)]
+            next_id += args.bots
+
+            players = asyncio.gather(*[run_bot(bot) for bot in bots])
+
+            # spectators join once the game is under way, so each of them starts from a snapshot
+            spectators = []
+
+            if args.spectators:
+                started = asyncio.create_task(bots[0].started.wait())
+                await asyncio.wait([started, players], return_when=asyncio.FIRST_COMPLETED)
+                started.cancel()
+
+                spectators = [asyncio.create_task(Spectator(stats).watch(connect))
+                              for _ in range(args.spectators)]
+
+            await players
+
+            for spectator in spectators:
+                spectator.cancel()
+            await asyncio.gather(*spectators, return_exceptions=True)
+
+            if any(bot.game_over() for bot in bots):
+                stats.games += 1
+            else:
+                stats.abandoned_games += 1
+
+    start_cpu = scrape_metric(metrics_url, "process_cpu_seconds_total") if metrics_url else None
+    start_time = time.perf_counter()
+
+    try:
+        await asyncio.gather(*[run_table() for _ in range(args.tables)])
+    finally:
+        elapsed = time.perf_counter() - start_time
+
+        end_cpu = scrape_metric(metrics_url, "process_cpu_seconds_total") if metrics_url else None
+        server_cpu = end_cpu - start_cpu if start_cpu is not None and end_cpu is not None else None
+
+        wait_total = scrape_metric(metrics_url, "mongoose_queue_wait_seconds_sum") if metrics_url else None
+        wait_count = scrape_metric(metrics_url, "mongoose_queue_wait_seconds_count") if metrics_url else None
+        queue_wait = wait_total / wait_count if wait_total is not None and wait_count else None
+
+        if local_server is not None:
+            local_server.stop_server()
+            server.join(5)
+
+        elif server is not None:
+            server.stdin.write(b"q\n")
+            server.stdin.flush()
+            server.wait(5)
+
+    print(stats.report(elapsed, server_cpu, queue_wait, combined_cpu=local_server is not None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a Mongoose server with scripted bot clients.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="the server's metrics port, used to report its CPU usage")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="start a server for the test, with tables the size of --bots")
+    parser.add_argument("--transport", choices=("tcp", "unix", "loopback"), default="tcp",
+                        help="how the bots connect: over TCP, to --unix-path, or to a server run in this process")
+    parser.add_argument("--unix-path", default=None, help="a Unix socket for the bots to connect to, or for the "
+                                                          "spawned server to listen on as well")
+    parser.add_argument("--replay-dir", default=None, help="have the spawned server record every game here")
+    parser.add_argument("--bots", type=int, default=4, help="bots per game")
+    parser.add_argument("--tables", type=int, default=1, help="games to keep running at once")
+    parser.add_argument("--queue-wait", type=float, default=30.0,
+                        help="seconds before the spawned server starts a table that is not full")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to keep starting new games for")
+    parser.add_argument("--spectators", type=int, default=0, help="spectators watching each game")
+    parser.add_argument("--chat-interval", type=float, default=5.0, help="mean seconds between chat messages")
+    parser.add_argument("--mongoose-chance", type=float, default=0.02,
+                        help="chance of calling mongoose on each move by another player")
+    parser.add_argument("--move-delay", type=float, default=0.0, help="seconds each bot waits before acting")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to everything each bot sends, to play as if over a slow link")
+    parser.add_argument("--max-turns", type=int, default=2000, help="turns after which a game is abandoned")
+    parser.add_argument("--stall-timeout", type=float, default=10.0,
+                        help="seconds without a move after which a bot leaves its game")
+    parser.add_argument("--connect-concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.transport == "unix" and args.unix_path is None:
+        parser.error("--transport unix needs a --unix-path")
+
+    if args.spawn_server and args.metrics_port is None:
+        args.metrics_port = args.port + 1
+
+    try:
+        import resource
+
+        # every bot needs its own socket, which soon runs past the usual default of 1024 descriptors
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+    asyncio.run(run_load(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import time
+from collections import deque
+import pygame
+
+
+class FrameProfiler:
+    TOGGLE_KEY = pygame.K_F3
+    HISTORY = 240
+    # how often (in s) the figures on the overlay are recalculated
+    REFRESH_INTERVAL = 0.25
+    FRAME_BUDGET = 1 / 60
+
+    BACKGROUND_COLOUR = (0, 0, 0, 170)
+    TEXT_COLOUR = (255, 255, 255)
+    GRAPH_COLOUR = (66, 245, 99)
+    GRAPH_OVER_BUDGET_COLOUR = (245, 66, 81)
+    BUDGET_LINE_COLOUR = (235, 213, 52)
+    FONT_SIZE = 18
+    GRAPH_HEIGHT = 60
+
+    def __init__(self):
+        self.enabled = False
+
+        # each entry is (frame time, {phase: time spent in that phase during the frame})
+        self.__frames = deque(maxlen=FrameProfiler.HISTORY)
+        self.__phases = {}
+        self.__frame_start = None
+        self.__last_mark = None
+
+        self.__font = None
+        self.__lines = []
+        self.__last_refresh = 0.0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.__frames.clear()
+        self.__lines = []
+        self.__frame_start = None
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+
+        if self.__frame_start is not None:
+            self.__frames.append((now - self.__frame_start, self.__phases))
+
+        self.__phases = {}
+        self.__frame_start = now
+        self.__last_mark = now
+
+    def mark(self, phase):
+        # charges everything since the previous mark to phase
+        if not self.enabled or self.__frame_start is None:
+            return
+
+        now = time.perf_counter()
+        self.__phases[phase] = self.__phases.get(phase, 0.0) + now - self.__last_mark
+        self.__last_mark = now
+
+    def refresh(self):
+        frame_times = sorted(f[0] for f in self.__frames)
+
+        phase_times = {}
+        for _, phases in self.__frames:
+            for phase, t in phases.items():
+                phase_times.setdefault(phase, []).append(t)
+
+        self.__lines = [f"{'frame':<22}{percentile(frame_times, 50) * 1e3:7.2f}"
+                        f"{percentile(frame_times, 99) * 1e3:7.2f}  ms p50/p99"]
+
+        for phase in sorted(phase_times):
+            times = sorted(phase_times[phase])
+            self.__lines.append(f"{phase:<22}{percentile(times, 50) * 1e3:7.2f}{percentile(times, 99) * 1e3:7.2f}")
+
+    def render(self, render_target):
+        if not self.enabled:
+            return
+
+        if self.__font is None:
+            self.__font = pygame.font.Font(None, FrameProfiler.FONT_SIZE)
+
+        now = time.perf_counter()
+        if now - self.__last_refresh >= FrameProfiler.REFRESH_INTERVAL:
+            self.refresh()
+            self.__last_refresh = now
+
+        line_height = self.__font.get_linesize()
+        width = FrameProfiler.HISTORY + 20
+        height = line_height * len(self.__lines) + FrameProfiler.GRAPH_HEIGHT + 20
+
+        panel = pygame.Surface((width, height), pygame.SRCALPHA)
+        panel.fill(FrameProfiler.BACKGROUND_COLOUR)
+
+        y = 5
+        for line in self.__lines:
+            panel.blit(self.__font.render(line, True, FrameProfiler.TEXT_COLOUR), (10, y))
+            y += line_height
+
+        # frame time graph, scaled so that twice the budget fills the graph
+        graph_bottom = height - 10
+        scale = FrameProfiler.GRAPH_HEIGHT / (2 * FrameProfiler.FRAME_BUDGET)
+
+        for x, (frame_time, _) in enumerate(self.__frames):
+            bar = min(FrameProfiler.GRAPH_HEIGHT, int(frame_time * scale))
+            col = FrameProfiler.GRAPH_COLOUR if frame_time <= FrameProfiler.FRAME_BUDGET else \
+                FrameProfiler.GRAPH_OVER_BUDGET_COLOUR
+            pygame.draw.line(panel, col, (10 + x, graph_bottom), (10 + x, graph_bottom - bar))
+
+        budget_y = graph_bottom - int(FrameProfiler.FRAME_BUDGET * scale)
+        pygame.draw.line(panel, FrameProfiler.BUDGET_LINE_COLOUR, (10, budget_y), (width - 10, budget_y))
+
+        render_target.blit(panel, (render_target.get_width() - width - 10, 10))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
@@ -0,0 +1,65 @@
+import time
+import select
+import pygame
+
+
+class FrameScheduler:
+    DEFAULT_MAX_FPS = 60
+    DEFAULT_IDLE_FPS = 4
+    # how long (in s) to keep rendering at the full rate after the last interaction
+    ACTIVE_PERIOD = 0.5
+    # how often (in s) the window event queue is checked while blocked waiting on sockets
+    EVENT_CHECK_INTERVAL = 0.02
+
+    def __init__(self, max_fps=DEFAULT_MAX_FPS, idle_fps=DEFAULT_IDLE_FPS):
+        # an idle_fps of 0 blocks until a window event or readable socket, however long that takes
+        self.max_fps = max_fps
+        self.idle_fps = idle_fps
+
+        self.__clock = pygame.time.Clock()
+
+        # pygame's own ticks only run once everything has been initialised with pygame.init()
+        self.__last_activity = time.perf_counter()
+        self.__redraw_requested = True
+
+    def mark_active(self):
+        self.__last_activity = time.perf_counter()
+        self.__redraw_requested = True
+
+    def request_redraw(self):
+        self.__redraw_requested = True
+
+    def is_active(self):
+        return time.perf_counter() - self.__last_activity < FrameScheduler.ACTIVE_PERIOD
+
+    def should_render(self):
+        render = self.__redraw_requested or self.is_active()
+        self.__redraw_requested = False
+        return render
+
+    def tick(self, wait_sockets=()):
+        if self.__redraw_requested or self.is_active():
+            return self.__clock.tick(self.max_fps)
+
+        deadline = time.perf_counter() + 1 / self.idle_fps if self.idle_fps else None
+
+        # idle, so sleep until there is input, network traffic or the next idle frame is due
+        while not pygame.event.peek():
+            timeout = FrameScheduler.EVENT_CHECK_INTERVAL
+
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    # refresh the screen at the idle rate in case anything changed off the main thread
+                    self.__redraw_requested = True
+                    break
+                timeout = min(timeout, remaining)
+
+            if wait_sockets:
+                readable, _, _ = select.select(wait_sockets, [], [], timeout)
+                if readable:
+                    break
+            else:
+                time.sleep(timeout)
+
+        return self.__clock.tick()
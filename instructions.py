@@ -7,11 +7,58 @@ class Instruction:
         GAME_RUNNING = "u_running"
         QUIT_GAME = "u_quit"
         CHAT_MESSAGE = "u_message"
+        PING = "u_ping"
+        PONG = "u_pong"
 
     class Game:
         PICKUP_CARD = "g_pickup"
         PLACE_CARD = "g_place"
         SEND_DECK = "g_send"
+        # the number of decks shuffled together and the number of center piles, sent before the deck
+        TABLE = "g_table"
         MOVE_ENDED = "g_ended"
         CALL_MONGOOSE = "g_mongoose"
         FLIP_DECK = "g_flip"
+        SYNC_STATE = "g_sync"
+        # the server's answer to a move sent with a sequence number, which it has either made or thrown away
+        ACK = "g_ack"
+        REJECT = "g_reject"
+
+    class Spectate:
+        SNAPSHOT = "s_snapshot"
+
+
+def instruction_opcodes():
+    # every opcode in the protocol, so that anything else a client sends can be told apart
+    opcodes = set()
+
+    for group in (Instruction, Instruction.Update, Instruction.Game, Instruction.Spectate):
+        opcodes.update(v for k, v in vars(group).items() if k.isupper() and isinstance(v, str))
+
+    return frozenset(opcodes)
+
+
+def parse_instruction(message):
+    operands = []
+
+    if ":" in message:
+        instruction, operand = message.split(":", 1)
+
+        in_string = False
+        cur_operand = ""
+
+        for c in operand:
+            if c == "'":
+                in_string = not in_string
+            else:
+                if in_string:
+                    cur_operand += c
+                elif c == ":":
+                    operands.append(cur_operand)
+                    cur_operand = ""
+
+        operands.append(cur_operand)
+    else:
+        instruction = message
+
+    return instruction, operands
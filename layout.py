@@ -0,0 +1,136 @@
+from functools import lru_cache
+from math import sin, cos, pi
+
+
+class Seat:
+    # every region is (center x, center y, width, height) as fractions of the window, the same as point_in_region takes
+    def __init__(self, center, size, hand_height, card_height, name_height):
+        self.center = center
+        # the width of the hand
+        self.size = size
+        self.card_size = size * TableLayout.CARD_SCALE
+
+        cx, cy = center
+
+        self.bounds = (cx, cy, size, hand_height)
+        self.face_down = (cx - size / 4, cy, self.card_size, card_height)
+        self.face_up = (cx + size / 4, cy, self.card_size, card_height)
+
+        self.name_center = (cx, cy + hand_height / 2 + name_height / 2)
+
+        # the hand and the name underneath it, which is what must not overlap anything else
+        self.footprint = (cx, cy + name_height / 2, size, hand_height + name_height)
+
+    def pile_center(self, pile):
+        return self.face_down[:2] if pile == 0 else self.face_up[:2]
+
+
+class TableLayout:
+    # the hand of each player, as a fraction of the window width, on tables small enough for it to fit
+    HAND_SIZE = 0.15
+    # hands are shrunk by this much at a time until they fit, but never below MIN_HAND_SIZE
+    HAND_SHRINK = 0.9
+    MIN_HAND_SIZE = 0.04
+    # how far the hands sit from the center of the window, as long as they don't overlap
+    SPREAD_RADIUS = 0.35
+    MARGIN = 0.01
+
+    HAND_BOUND_ASPECT_RATIO = 1.41
+    # the size of each card relative to the hand
+    CARD_SCALE = 0.46
+    CARD_SIZE = 0.07
+    CARD_ASPECT_RATIO = 500 / 726
+    CARD_STACK_SIZE = 0.02
+    # the tallest a center pile gets, from ace to king
+    MAX_PILE_CARDS = 13
+    CENTER_PILE_SPACING = 0.08
+    # the widest the row of center piles gets; past that, the piles are drawn closer together and smaller
+    MAX_CENTER_WIDTH = 0.48
+    # the height in pixels of a player's name
+    NAME_HEIGHT = 24
+
+    MONGOOSE_BUTTON = ((0.9, 0.9), (0.1, 0.08))
+    FLIP_BUTTON = ((0.5, 0.7), (0.08, 0.06))
+
+    def __init__(self, n_players, n_center_piles, screen_size):
+        self.n_players = n_players
+        self.screen_size = screen_size
+        self.aspect_ratio = screen_size[0] / screen_size[1]
+
+        self.center_pile_spacing = min(TableLayout.CENTER_PILE_SPACING, TableLayout.MAX_CENTER_WIDTH / n_center_piles)
+        self.center_card_size = TableLayout.CARD_SIZE * self.center_pile_spacing / TableLayout.CENTER_PILE_SPACING
+        self.card_height = self.card_height_for(self.center_card_size)
+
+        self.center_piles = [(0.5 - (i - (n_center_piles - 1) / 2) * self.center_pile_spacing, 0.5)
+                             for i in range(n_center_piles)]
+
+        # seats are in screen order, with the local player at the bottom
+        self.seats = self.__arrange()
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def get(n_players, n_center_piles, screen_size):
+        # laid out once per table and window size, rather than every time something is drawn or clicked
+        return TableLayout(n_players, n_center_piles, tuple(screen_size))
+
+    def card_height_for(self, card_size):
+        return card_size * self.aspect_ratio / TableLayout.CARD_ASPECT_RATIO
+
+    def center_pile_region(self, i, n_cards):
+        cx, cy = self.center_piles[i]
+        return cx, cy, self.center_card_size, self.card_height + TableLayout.CARD_STACK_SIZE * max(n_cards - 1, 0)
+
+    def obstacles(self):
+        # everything other than the hands which is always on the table: the center piles at their tallest and the
+        # buttons. The chat feed and turn label are drawn over the table rather than taking space from it.
+        piles = (0.5, 0.5, self.center_pile_spacing * (len(self.center_piles) - 1) + self.center_card_size,
+                 self.center_pile_region(0, TableLayout.MAX_PILE_CARDS)[3])
+
+        return [piles] + [center + size for center, size in (TableLayout.MONGOOSE_BUTTON, TableLayout.FLIP_BUTTON)]
+
+    def __arrange(self):
+        obstacles = self.obstacles()
+        name_height = TableLayout.NAME_HEIGHT / self.screen_size[1]
+
+        size = TableLayout.HAND_SIZE
+
+        while True:
+            hand_height = size * self.aspect_ratio / TableLayout.HAND_BOUND_ASPECT_RATIO
+            card_height = self.card_height_for(size * TableLayout.CARD_SCALE)
+
+            # the furthest out the hands can go while staying in the window
+            max_rx = 0.5 - size / 2 - TableLayout.MARGIN
+            max_ry = 0.5 - hand_height / 2 - name_height - TableLayout.MARGIN
+
+            # the usual spread is kept where it works, and the hands only move out to the edges of the window when
+            # it doesn't
+            for rx, ry in ((min(TableLayout.SPREAD_RADIUS, max_rx), min(TableLayout.SPREAD_RADIUS, max_ry)),
+                           (max_rx, max_ry)):
+                seats = [Seat(self.__seat_center(i, rx, ry), size, hand_height, card_height, name_height)
+                         for i in range(self.n_players)]
+
+                if not self.__overlapping([seat.footprint for seat in seats], obstacles):
+                    return seats
+
+            # past this the cards are too small to play with, so the hands are left overlapping
+            if size * TableLayout.HAND_SHRINK < TableLayout.MIN_HAND_SIZE:
+                return seats
+
+            size *= TableLayout.HAND_SHRINK
+
+    def __seat_center(self, screen_index, rx, ry):
+        theta = screen_index * 2 * pi / self.n_players
+        return 0.5 + sin(theta) * rx, 0.5 + cos(theta) * ry
+
+    @staticmethod
+    def __overlapping(footprints, obstacles):
+        for i, a in enumerate(footprints):
+            for b in footprints[i + 1:] + obstacles:
+                if TableLayout.overlap(a, b):
+                    return True
+
+        return False
+
+    @staticmethod
+    def overlap(a, b):
+        return abs(a[0] - b[0]) * 2 < a[2] + b[2] and abs(a[1] - b[1]) * 2 < a[3] + b[3]
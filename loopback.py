@@ -0,0 +1,100 @@
+import asyncio
+from collections import deque
+
+
+class LoopbackSocket:
+    # the server's end of a connection to a client in the same process. It stands in for a client socket in the
+    # server loop, with no socket underneath: what the client writes is queued here for the server to read, and what
+    # the server sends is handed straight to the client.
+    def __init__(self, deliver, ready):
+        # deliver is called from the server thread with each chunk sent, and with b"" once the server closes the
+        # connection. ready is the server's queue of loopback connections with something to read.
+        self.__deliver = deliver
+        self.__ready = ready
+        self.__inbound = deque()
+        self.__hung_up = False
+        self.__closed = False
+
+    def write(self, data):
+        # called by the client
+        self.__inbound.append(data)
+        self.__ready.append(self)
+
+    def hang_up(self):
+        # called by the client; the server reads the end of the stream once everything before it has been read
+        self.__hung_up = True
+        self.__ready.append(self)
+
+    def recv(self, size):
+        # everything written so far comes back at once, so that the server never has to be told twice
+        if self.__inbound:
+            chunks = []
+
+            while self.__inbound:
+                chunks.append(self.__inbound.popleft())
+
+            return b"".join(chunks)
+
+        if self.__hung_up:
+            return b""
+
+        raise BlockingIOError
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def sendall(self, data):
+        if self.__closed:
+            raise BrokenPipeError("The loopback connection is closed")
+
+        self.__deliver(data)
+
+    def settimeout(self, timeout):
+        pass
+
+    def setblocking(self, flag):
+        pass
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            self.__deliver(b"")
+
+
+class LoopbackWriter:
+    # enough of an asyncio StreamWriter for the bots
+    def __init__(self, sock):
+        self.__sock = sock
+        self.__closing = False
+
+    def write(self, data):
+        if not self.__closing:
+            self.__sock.write(bytes(data))
+
+    def is_closing(self):
+        return self.__closing
+
+    def close(self):
+        if not self.__closing:
+            self.__closing = True
+            self.__sock.hang_up()
+
+
+async def open_loopback_connection(server):
+    # the same (reader, writer) pair as asyncio.open_connection, connected to a server running in another thread of
+    # this process
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+
+    def deliver(data):
+        try:
+            if data:
+                loop.call_soon_threadsafe(reader.feed_data, data)
+            else:
+                loop.call_soon_threadsafe(reader.feed_eof)
+        except RuntimeError:
+            # the client's event loop has already gone
+            pass
+
+    return reader, LoopbackWriter(server.connect_loopback(deliver))
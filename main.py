@@ -4,10 +4,10 @@ from title_screen import TitleScreen
 
 def main():
     t_screen = TitleScreen()
-    active_id, players, client_socket, deck = t_screen.run()
+    active_id, players, connection, deck, n_center_piles = t_screen.run()
 
-    game = Mongoose(client_socket, deck)
-    game.setup_game(active_id, players)
+    game = Mongoose(connection, deck)
+    game.setup_game(active_id, players, n_center_piles)
 
     game.run()
 
@@ -0,0 +1,77 @@
+import time
+from collections import deque
+from metrics import LatencyHistogram
+
+
+class MatchmakingQueue:
+    def __init__(self, table_size=4, min_table_size=2, max_wait=30.0, wait_times=None):
+        self.table_size = table_size
+        # once the longest waiting player has waited max_wait seconds, a table is started with whoever is waiting,
+        # as long as there are at least min_table_size of them. A max_wait of None only ever starts full tables.
+        self.min_table_size = min_table_size
+        self.max_wait = max_wait
+
+        # players in the order they joined. Leaving only removes a player from __waiting, and the stale entry is
+        # skipped once it reaches the front, so every operation is O(1) (amortised) however long the queue gets.
+        self.__queue = deque()
+        self.__waiting = {}
+
+        self.wait_times = LatencyHistogram() if wait_times is None else wait_times
+
+    def __len__(self):
+        return len(self.__waiting)
+
+    def __contains__(self, client):
+        return client in self.__waiting
+
+    def add(self, client, now=None):
+        now = time.perf_counter() if now is None else now
+
+        self.__waiting[client] = now
+        self.__queue.append((now, client))
+
+    def remove(self, client):
+        self.__waiting.pop(client, None)
+
+        # stale entries are only dropped at the front, so the queue is compacted if players keep leaving from
+        # behind one who is stuck waiting
+        if len(self.__queue) > 2 * len(self.__waiting) + 64:
+            self.__queue = deque(e for e in self.__queue if self.__waiting.get(e[1]) == e[0])
+
+    def __is_live(self, entry):
+        return self.__waiting.get(entry[1]) == entry[0]
+
+    def oldest_wait(self, now=None):
+        now = time.perf_counter() if now is None else now
+
+        while self.__queue and not self.__is_live(self.__queue[0]):
+            self.__queue.popleft()
+
+        return now - self.__queue[0][0] if self.__queue else 0.0
+
+    def ready(self, now=None):
+        # how many players should be seated at a new table right now, or 0 to keep waiting
+        if len(self) >= self.table_size:
+            return self.table_size
+
+        if self.max_wait is not None and len(self) >= self.min_table_size and self.oldest_wait(now) >= self.max_wait:
+            return len(self)
+
+        return 0
+
+    def take(self, n, now=None):
+        # removes and returns up to n of the longest waiting players
+        now = time.perf_counter() if now is None else now
+        clients = []
+
+        while self.__queue and len(clients) < n:
+            entry = self.__queue.popleft()
+
+            if not self.__is_live(entry):
+                continue
+
+            del self.__waiting[entry[1]]
+            self.wait_times.record(now - entry[0])
+            clients.append(entry[1])
+
+        return clients
@@ -16,9 +16,15 @@ class Message:
     def new_recv_message():
         return Message()
 
+    @staticmethod
+    def frame_size(size):
+        # every message is padded out to a whole number of blocks on the wire
+        n_blocks = size // Message.BUFFER_SIZE + 1
+        padding_size = (n_blocks * Message.BUFFER_SIZE - size - Message.HEADER_SIZE) % Message.BUFFER_SIZE
+        return Message.HEADER_SIZE + size + padding_size
+
     def encode(self):
-        n_blocks = self.size // Message.BUFFER_SIZE + 1
-        padding_size = (n_blocks * Message.BUFFER_SIZE - self.size - Message.HEADER_SIZE) % Message.BUFFER_SIZE
+        padding_size = Message.frame_size(self.size) - self.size - Message.HEADER_SIZE
         return self.size.to_bytes(Message.HEADER_SIZE, "little") + self.message + b"0" * padding_size
 
     def decode(self, buffer):
@@ -44,3 +50,30 @@ class Message:
 
     def __repr__(self):
         return self.__str__()
+
+
+class MessageStream:
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def feed(self, data):
+        # returns every message completed by data, keeping any partial frame for the next call
+        self.__buffer += data
+
+        messages = []
+        offset = 0
+
+        while len(self.__buffer) - offset >= Message.HEADER_SIZE:
+            size = int.from_bytes(self.__buffer[offset:offset + Message.HEADER_SIZE], "little")
+            frame_size = Message.frame_size(size)
+
+            if len(self.__buffer) - offset < frame_size:
+                break
+
+            start = offset + Message.HEADER_SIZE
+            messages.append(Message(bytes(self.__buffer[start:start + size]), size))
+            offset += frame_size
+
+        del self.__buffer[:offset]
+
+        return messages
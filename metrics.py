@@ -0,0 +1,166 @@
+import bisect
+import time
+
+
+def format_duration(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+
+class LatencyHistogram:
+    # upper bounds of each bucket, in seconds; anything slower lands in a final overflow bucket
+    BUCKETS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4,
+               1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.counts = [0] * (len(LatencyHistogram.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(LatencyHistogram.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        # returns the upper bound of the bucket holding the p-th percentile, so it is never an underestimate
+        if not self.count:
+            return 0.0
+
+        target = p / 100 * self.count
+        seen = 0
+
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return LatencyHistogram.BUCKETS[i] if i < len(LatencyHistogram.BUCKETS) else self.max
+
+        return self.max
+
+    def summary(self):
+        return f"n={self.count} mean={format_duration(self.mean())} p50<={format_duration(self.percentile(50))} " \
+               f"p99<={format_duration(self.percentile(99))} max={format_duration(self.max)}"
+
+
+class MovingAverage:
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = sample
+        else:
+            self.value += self.alpha * (sample - self.value)
+
+        return self.value
+
+
+class ServerMetrics:
+    def __init__(self):
+        # per-instruction counters; plain dict updates so that counting costs next to nothing in the server loop
+        self.messages_in = {}
+        self.bytes_in = {}
+        self.messages_out = {}
+        self.bytes_out = {}
+
+        self.accepted_connections = 0
+        # players dropped for not answering pings
+        self.timed_out_connections = 0
+        # moves which did not fit the server's copy of the table, and so were not passed on
+        self.rejected_moves = 0
+        # tables sent to a single client whose copy had drifted from the server's
+        self.resyncs = 0
+        # messages thrown away unread for going over their rate limit, by instruction
+        self.dropped_messages = {}
+        # messages which made no sense, e.g. with the wrong number of operands, and were thrown away, by instruction
+        self.malformed_messages = {}
+        # chat which was never sent to a client who had fallen too far behind, by instruction
+        self.shed_messages = {}
+
+        self.loop_time = LatencyHistogram()
+        # how long players spent in the matchmaking queue before being seated
+        self.queue_wait = LatencyHistogram()
+
+    def count_in(self, instruction, n_bytes):
+        self.messages_in[instruction] = self.messages_in.get(instruction, 0) + 1
+        self.bytes_in[instruction] = self.bytes_in.get(instruction, 0) + n_bytes
+
+    def count_out(self, instruction, n_bytes):
+        self.messages_out[instruction] = self.messages_out.get(instruction, 0) + 1
+        self.bytes_out[instruction] = self.bytes_out.get(instruction, 0) + n_bytes
+
+    def count_dropped(self, instruction):
+        self.dropped_messages[instruction] = self.dropped_messages.get(instruction, 0) + 1
+
+    def count_malformed(self, instruction):
+        self.malformed_messages[instruction] = self.malformed_messages.get(instruction, 0) + 1
+
+    def count_shed(self, instruction):
+        self.shed_messages[instruction] = self.shed_messages.get(instruction, 0) + 1
+
+    def render(self, gauges):
+        # gauges are sampled by the caller at scrape time, so nothing extra is tracked for them in the loop
+        lines = []
+
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        lines.append("# TYPE process_cpu_seconds_total counter")
+        lines.append(f"process_cpu_seconds_total {time.process_time()}")
+
+        lines.append("# TYPE mongoose_accepted_connections_total counter")
+        lines.append(f"mongoose_accepted_connections_total {self.accepted_connections}")
+
+        lines.append("# TYPE mongoose_timed_out_connections_total counter")
+        lines.append(f"mongoose_timed_out_connections_total {self.timed_out_connections}")
+
+        lines.append("# TYPE mongoose_rejected_moves_total counter")
+        lines.append(f"mongoose_rejected_moves_total {self.rejected_moves}")
+
+        lines.append("# TYPE mongoose_resyncs_total counter")
+        lines.append(f"mongoose_resyncs_total {self.resyncs}")
+
+        for name, counter in (("mongoose_messages_in_total", self.messages_in),
+                              ("mongoose_bytes_in_total", self.bytes_in),
+                              ("mongoose_messages_out_total", self.messages_out),
+                              ("mongoose_bytes_out_total", self.bytes_out),
+                              ("mongoose_dropped_messages_total", self.dropped_messages),
+                              ("mongoose_malformed_messages_total", self.malformed_messages),
+                              ("mongoose_shed_messages_total", self.shed_messages)):
+            lines.append(f"# TYPE {name} counter")
+            for instruction in sorted(counter):
+                lines.append(f'{name}{{opcode="{instruction}"}} {counter[instruction]}')
+
+        lines.append("# TYPE mongoose_loop_iteration_seconds histogram")
+        lines.extend(prometheus_histogram("mongoose_loop_iteration_seconds", self.loop_time))
+
+        lines.append("# TYPE mongoose_queue_wait_seconds histogram")
+        lines.extend(prometheus_histogram("mongoose_queue_wait_seconds", self.queue_wait))
+
+        return "\n".join(lines) + "\n"
+
+
+def prometheus_histogram(name, histogram):
+    lines = []
+    cumulative = 0
+
+    for bound, n in zip(LatencyHistogram.BUCKETS, histogram.counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+
+    lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum {histogram.total}")
+    lines.append(f"{name}_count {histogram.count}")
+
+    return lines
@@ -0,0 +1,3 @@
+from model.game_state import GameState, SUITS
+from model.cards import Card, Deck
+from model.center_piles import CenterPiles
@@ -1,54 +1,13 @@
 import random
-import os
-import pygame
-
-
-def load_texture(tex_name, resource):
-    assert (os.path.exists(os.path.join(resource, tex_name)))
-    texture = pygame.image.load(os.path.join(resource, tex_name))
-
-    return texture
-
-
-def resize_texture(texture, target_width):
-    _, _, w, h = texture.get_rect()
-    s_factor = target_width / w
-
-    resized = pygame.transform.scale(texture, (int(w * s_factor), int(h * s_factor)))
-
-    return resized
-
-
-def rescale_back(texture):
-    _, _, w, h = texture.get_rect()
-    return pygame.transform.scale(texture, (w, int(w * 726 / 500)))
+from model.game_state import SUITS
 
 
 class Card:
-    RES_LOCATION = "./res/textures/cards"
-    # TODO: make this more flexible
-    CARD_BACK_TEXTURE = rescale_back(load_texture("card_back.png", RES_LOCATION))
-
-    def __init__(self, suit, value):
+    def __init__(self, suit, value, deck=0):
         self.suit = suit
         self.value = value
-
-        self.__texture_name = self.__str__().replace(" ", "_").lower() + ".png"
-        self.texture = load_texture(self.__texture_name, Card.RES_LOCATION)
-
-        _, _, w, h = self.texture.get_rect()
-        self.__aspect_ratio = w / h
-
-    def render(self, render_target, center, size, face=True):
-        screen_size = render_target.get_size()
-        sc_w = int(screen_size[0] * size)
-        sc_h = int(sc_w / self.__aspect_ratio)
-        sc_s_x = screen_size[0] * center[0] - sc_w / 2
-        sc_s_y = screen_size[1] * center[1] - sc_h / 2
-
-        target_texture = resize_texture(self.texture if face else Card.CARD_BACK_TEXTURE, sc_w)
-
-        render_target.blit(target_texture, (sc_s_x, sc_s_y))
+        # which of the decks in play the card came from, so that two copies of a card can be told apart
+        self.deck = deck
 
     def __str__(self):
         val = ""
@@ -79,15 +38,16 @@ class Deck:
         return Deck([])
 
     @staticmethod
-    def full():
-        return Deck(Deck.get_all_cards())
+    def full(n_decks=1):
+        return Deck(Deck.get_all_cards(n_decks))
 
     @staticmethod
-    def get_all_cards():
+    def get_all_cards(n_decks=1):
         cards = []
-        for suit in ["Spades", "Diamonds", "Clubs", "Hearts"]:
-            for value in range(1, 14):
-                cards.append(Card(suit, value))
+        for deck in range(n_decks):
+            for suit in SUITS:
+                for value in range(1, 14):
+                    cards.append(Card(suit, value, deck))
 
         return cards
 
@@ -0,0 +1,72 @@
+class CenterPiles:
+    # the card which starts a center pile
+    STARTING_VALUE = 7
+
+    def __init__(self, deck_ids):
+        # which cards each center pile will take, kept up to date as cards are placed, so that finding where a card
+        # can go is a lookup however many decks and piles there are. Cards are (suit, value) here; the deck a card
+        # came from makes no difference to where it can go.
+        self.__ends = {deck_id: None for deck_id in deck_ids}
+        self.__empty = set(deck_ids)
+        # (suit, value): the deck ids of the piles that card would extend
+        self.__accepts = {}
+
+    def __contains__(self, deck_id):
+        return deck_id in self.__ends
+
+    def ends(self, deck_id):
+        # (suit, lowest value, highest value) of a pile, or None if it is empty
+        return self.__ends[deck_id]
+
+    def accepts(self, deck_id, suit, value):
+        ends = self.__ends[deck_id]
+
+        if ends is None:
+            return value == CenterPiles.STARTING_VALUE
+
+        return suit == ends[0] and value in (ends[1] - 1, ends[2] + 1)
+
+    def extends(self, suit, value):
+        # the piles already started which the card can be placed on
+        return self.__accepts.get((suit, value), set())
+
+    def targets(self, suit, value):
+        # every pile the card can be placed on
+        if value == CenterPiles.STARTING_VALUE:
+            return self.extends(suit, value) | self.__empty
+
+        return self.extends(suit, value)
+
+    def placed(self, deck_id, suit, value):
+        # only valid moves are indexed; a card of the wrong suit is handed back before it is placed
+        ends = self.__ends[deck_id]
+
+        if ends is None:
+            self.__empty.discard(deck_id)
+            self.__set_ends(deck_id, (suit, value, value))
+        else:
+            self.__set_ends(deck_id, (ends[0], min(ends[1], value), max(ends[2], value)))
+
+    def reset(self, deck_id, cards):
+        # for when a whole pile is replaced, such as on a resync
+        self.__set_ends(deck_id, None)
+        self.__empty.add(deck_id)
+
+        for suit, value in cards:
+            self.placed(deck_id, suit, value)
+
+    def __set_ends(self, deck_id, ends):
+        old = self.__ends[deck_id]
+
+        if old is not None:
+            for key in ((old[0], old[1] - 1), (old[0], old[2] + 1)):
+                self.__accepts[key].discard(deck_id)
+
+                if not self.__accepts[key]:
+                    del self.__accepts[key]
+
+        self.__ends[deck_id] = ends
+
+        if ends is not None:
+            for key in ((ends[0], ends[1] - 1), (ends[0], ends[2] + 1)):
+                self.__accepts.setdefault(key, set()).add(deck_id)
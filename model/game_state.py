@@ -0,0 +1,264 @@
+from instructions import Instruction
+from model.center_piles import CenterPiles
+from model.state_hash import StateHash
+
+SUITS = ("Spades", "Diamonds", "Clubs", "Hearts")
+
+
+class GameState:
+    # the default for a table with one deck, which has a pile for each of its sevens
+    N_CENTER_PILES = 4
+    # past this many players, another deck is shuffled in so that everyone still has a decent hand
+    PLAYERS_PER_DECK = 6
+
+    # the instructions which change the state of the table
+    MOVES = (Instruction.Game.PICKUP_CARD, Instruction.Game.PLACE_CARD, Instruction.Game.MOVE_ENDED,
+             Instruction.Game.CALL_MONGOOSE, Instruction.Game.FLIP_DECK)
+    # the operands each move takes. A client can send a sequence number after them to have the move acknowledged.
+    MOVE_OPERANDS = {Instruction.Game.PICKUP_CARD: 1, Instruction.Game.PLACE_CARD: 2, Instruction.Game.MOVE_ENDED: 0,
+                     Instruction.Game.CALL_MONGOOSE: 2, Instruction.Game.FLIP_DECK: 1}
+
+    def __init__(self, cards, n_players, n_center_piles=N_CENTER_PILES):
+        # cards are (suit, value, deck) triples in the order they were sent with g_send. Decks are indexed by their
+        # protocol deck id, and each is a list with its top card last so that moves at the top are O(1).
+        self.n_players = n_players
+        self.n_center_piles = n_center_piles
+
+        self.decks = []
+
+        for p in range(n_players):
+            self.decks.append(cards[p::n_players][::-1])
+            self.decks.append([])
+
+        for _ in range(n_center_piles):
+            self.decks.append([])
+
+        self.center = CenterPiles(self.center_pile_ids())
+        # kept up to date with every card that moves, so that two copies of the table can be compared cheaply
+        self.table_hash = StateHash(self.decks)
+
+        # the card each player has picked up but not yet placed, and the deck it came from
+        self.held = [None] * n_players
+        self.held_from = [None] * n_players
+
+        self.turn = 0
+
+    @staticmethod
+    def decks_for(n_players):
+        return max(1, -(-n_players // GameState.PLAYERS_PER_DECK))
+
+    @staticmethod
+    def center_piles_for(n_decks):
+        return GameState.N_CENTER_PILES * n_decks
+
+    @staticmethod
+    def from_dict(data):
+        # the number of center piles is whatever is left over after each player's two decks
+        state = GameState([], data["n_players"], len(data["decks"]) - 2 * data["n_players"])
+        state.decks = [[tuple(card) for card in deck] for deck in data["decks"]]
+        state.index_center()
+        state.table_hash.reset(state.decks)
+        state.held = [None if card is None else tuple(card) for card in data["held"]]
+        state.held_from = data.get("held_from", [None] * state.n_players)
+        state.turn = data["turn"]
+        return state
+
+    def to_dict(self):
+        # a copy, so that it can be serialised elsewhere while the game carries on
+        return {"n_players": self.n_players, "decks": [list(deck) for deck in self.decks], "held": list(self.held),
+                "held_from": list(self.held_from), "turn": self.turn}
+
+    @staticmethod
+    def decode_deck(operands):
+        return [GameState.decode_card(card) for card in operands]
+
+    @staticmethod
+    def decode_card(card):
+        # "suit-value", or "suit-value-deck" for any deck after the first
+        s, v, *d = card.split("-")
+        return SUITS[int(s)], int(v), int(d[0]) if d else 0
+
+    @staticmethod
+    def encode_card(card):
+        # the deck is left off for the first one, so a game with a single deck is sent exactly as it always was
+        encoded = f"{SUITS.index(card[0])}-{card[1]}"
+        return f"{encoded}-{card[2]}" if len(card) > 2 and card[2] else encoded
+
+    def sync_operands(self):
+        # the whole table as g_sync operands: the turn, then each deck from the bottom up, then what each player
+        # is holding along with the deck it came from
+        operands = [str(self.turn)]
+        operands.extend(" ".join(map(GameState.encode_card, deck)) for deck in self.decks)
+        operands.extend("" if card is None else f"{deck_id} {GameState.encode_card(card)}"
+                        for card, deck_id in zip(self.held, self.held_from))
+        return operands
+
+    def public_operands(self):
+        # what anyone watching the table can see: how many cards are face down, but not which
+        operands = []
+
+        for p in range(self.n_players):
+            held = self.held[p]
+            operands.append(str(len(self.face_down(p))))
+            operands.append(" ".join(map(GameState.encode_card, self.face_up(p))))
+            operands.append("" if held is None else f"{self.held_from[p]} {GameState.encode_card(held)}")
+
+        operands.extend(" ".join(map(GameState.encode_card, self.decks[deck_id])) for deck_id in self.center_pile_ids())
+        return operands
+
+    def apply_sync(self, operands):
+        self.turn = int(operands[0])
+        self.decks = [GameState.decode_deck(deck.split()) for deck in operands[1:len(self.decks) + 1]]
+        self.index_center()
+        self.table_hash.reset(self.decks)
+
+        for p, held in enumerate(operands[len(self.decks) + 1:]):
+            if held:
+                deck_id, card = held.split()
+                self.held[p], self.held_from[p] = GameState.decode_card(card), int(deck_id)
+            else:
+                self.held[p], self.held_from[p] = None, None
+
+    def face_down(self, player):
+        return self.decks[2 * player]
+
+    def face_up(self, player):
+        return self.decks[2 * player + 1]
+
+    def center_pile_ids(self):
+        return range(2 * self.n_players, 2 * self.n_players + self.n_center_piles)
+
+    def index_center(self):
+        # after the decks have been replaced wholesale
+        for deck_id in self.center_pile_ids():
+            self.center.reset(deck_id, (card[:2] for card in self.decks[deck_id]))
+
+    def current_player(self):
+        return self.turn % self.n_players
+
+    def state_hash(self):
+        return self.table_hash.value(self.turn, self.held, self.held_from)
+
+    def has_finished(self, player):
+        return not self.face_down(player) and not self.face_up(player) and self.held[player] is None
+
+    def game_over(self):
+        return sum(not self.has_finished(p) for p in range(self.n_players)) <= 1
+
+    def pickup(self, deck_id):
+        if not 0 <= deck_id < 2 * self.n_players or self.held[deck_id // 2] is not None:
+            raise ValueError(f"Cannot pick up from deck {deck_id}")
+
+        card = self.held[deck_id // 2] = self.decks[deck_id].pop()
+        self.held_from[deck_id // 2] = deck_id
+
+        self.table_hash.popped_top(deck_id, card, len(self.decks[deck_id]))
+
+    def place(self, src_deck_id, dst_deck_id):
+        # like every move, it is checked in full before anything changes, so a move which fails never happened
+        if not 0 <= src_deck_id < 2 * self.n_players or not 0 <= dst_deck_id < len(self.decks):
+            raise ValueError(f"Cannot place from deck {src_deck_id} onto deck {dst_deck_id}")
+
+        player = src_deck_id // 2
+        card = self.held[player]
+
+        if card is None:
+            raise ValueError(f"Player {player} is not holding a card")
+        dst = self.decks[dst_deck_id]
+
+        self.held[player] = None
+        self.held_from[player] = None
+
+        dst.append(card)
+        self.table_hash.pushed_top(dst_deck_id, card, len(dst) - 1)
+
+        # center piles are kept sorted, so their minimum and maximum are at either end. A valid move only ever
+        # extends the run, so the card is already in place unless it went below the bottom.
+        if dst_deck_id in self.center:
+            self.center.placed(dst_deck_id, card[0], card[1])
+
+            if len(dst) > 1 and card[1] < dst[-2][1]:
+                if card[1] <= dst[0][1]:
+                    dst.insert(0, dst.pop())
+                    self.table_hash.popped_top(dst_deck_id, card, len(dst) - 1)
+                    self.table_hash.pushed_bottom(dst_deck_id, card, len(dst) - 1)
+                else:
+                    dst.sort(key=lambda c: c[1])
+                    self.table_hash.rehash(dst_deck_id, dst)
+
+    def return_held(self, player):
+        # puts back a card that was picked up by a player who has since dropped out
+        if self.held[player] is not None:
+            deck = self.decks[self.held_from[player]]
+            deck.append(self.held[player])
+            self.table_hash.pushed_top(self.held_from[player], self.held[player], len(deck) - 1)
+            self.held[player] = None
+            self.held_from[player] = None
+
+    def next_turn(self):
+        for _ in range(self.n_players):
+            self.turn += 1
+            if not self.has_finished(self.current_player()):
+                return
+
+    def mongoose(self, target, skip_turn):
+        if not 0 <= target < self.n_players:
+            raise ValueError(f"Cannot call mongoose on player {target}")
+
+        for p in range(self.n_players):
+            if p != target and self.face_down(p):
+                card = self.face_down(p).pop(0)
+                self.table_hash.popped_bottom(2 * p, card, len(self.face_down(p)))
+                self.table_hash.pushed_bottom(2 * target, card, len(self.face_down(target)))
+                self.face_down(target).insert(0, card)
+
+        if skip_turn:
+            self.next_turn()
+
+    def flip(self, player):
+        if not 0 <= player < self.n_players:
+            raise ValueError(f"Cannot flip the deck of player {player}")
+
+        self.decks[2 * player] = self.face_up(player)[::-1]
+        self.decks[2 * player + 1] = []
+        self.table_hash.turned_over(2 * player + 1, 2 * player)
+
+    def apply_instruction(self, instruction, operands):
+        # applies a game instruction as every client does; anything else is left alone
+        if instruction == Instruction.Game.PICKUP_CARD:
+            self.pickup(int(operands[0]))
+
+        elif instruction == Instruction.Game.PLACE_CARD:
+            self.place(int(operands[0]), int(operands[1]))
+
+        elif instruction == Instruction.Game.MOVE_ENDED:
+            self.next_turn()
+
+        elif instruction == Instruction.Game.CALL_MONGOOSE:
+            self.mongoose(int(operands[0]), bool(int(operands[1])))
+
+        elif instruction == Instruction.Game.FLIP_DECK:
+            self.flip(int(operands[0]))
+
+        elif instruction == Instruction.Game.SYNC_STATE:
+            self.apply_sync(operands)
+
+    def can_place_in_center(self, card, deck_id):
+        return self.center.accepts(deck_id, card[0], card[1])
+
+    def can_place_on_player(self, card, player):
+        pile = self.face_up(player)
+        return bool(pile) and pile[-1][1] + 1 == card[1]
+
+    def best_target(self, card, player):
+        # the deck id a card should be placed on, falling back to the player's own face up pile
+        targets = self.center.targets(card[0], card[1])
+
+        if targets:
+            return min(targets)
+
+        for p in range(self.n_players):
+            if p != player and self.can_place_on_player(card, p):
+                return 2 * p + 1
+
+        return 2 * player + 1
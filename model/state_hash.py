@@ -0,0 +1,97 @@
+import random
+from functools import lru_cache
+
+# arithmetic is modulo a Mersenne prime, which keeps every hash within 61 bits
+MODULUS = (1 << 61) - 1
+
+
+@lru_cache(maxsize=None)
+def key(*parts):
+    # the same on every client and on the server, as a string seed does not depend on the hash seed of the process.
+    # Keys are only ever made for the cards, decks and players in play, so there are few of them.
+    return random.Random(":".join(map(str, parts))).randrange(1, MODULUS)
+
+
+BASE = key("base")
+INVERSE_BASE = pow(BASE, MODULUS - 2, MODULUS)
+
+
+@lru_cache(maxsize=None)
+def power(n):
+    return pow(BASE, n, MODULUS)
+
+
+class StateHash:
+    def __init__(self, decks):
+        # each deck is hashed as a polynomial in its cards, bottom card first, and also with its cards the other way
+        # up. With both, a card can be added or taken away at either end of a deck, and a whole deck turned over,
+        # without going through the rest of it. The table's hash is the sum of the deck hashes, each with a weight
+        # for where it is on the table.
+        self.__forward = []
+        self.__reverse = []
+        self.__total = 0
+        self.reset(decks)
+
+    def value(self, turn, held, held_from):
+        # whose turn it is and what everyone is holding is only a few terms, so it is added on when asked for
+        h = self.__total + turn * key("turn")
+
+        for player, (card, deck_id) in enumerate(zip(held, held_from)):
+            if card is not None:
+                h += key("held", player, deck_id, *card)
+
+        return h % MODULUS
+
+    def reset(self, decks):
+        # for when the decks have been replaced wholesale
+        self.__forward = [0] * len(decks)
+        self.__reverse = [0] * len(decks)
+        self.__total = 0
+
+        for deck_id, deck in enumerate(decks):
+            self.rehash(deck_id, deck)
+
+    def rehash(self, deck_id, deck):
+        # for when a deck has been reordered in place
+        forward = reverse = 0
+
+        for i, card in enumerate(deck):
+            forward += key("card", *card) * power(i)
+            reverse = (reverse * BASE + key("card", *card)) % MODULUS
+
+        self.__set(deck_id, forward, reverse)
+
+    def pushed_top(self, deck_id, card, old_size):
+        k = key("card", *card)
+        self.__set(deck_id, self.__forward[deck_id] + k * power(old_size),
+                   self.__reverse[deck_id] * BASE + k)
+
+    def popped_top(self, deck_id, card, new_size):
+        k = key("card", *card)
+        self.__set(deck_id, self.__forward[deck_id] - k * power(new_size),
+                   (self.__reverse[deck_id] - k) * INVERSE_BASE)
+
+    def pushed_bottom(self, deck_id, card, old_size):
+        k = key("card", *card)
+        self.__set(deck_id, self.__forward[deck_id] * BASE + k,
+                   self.__reverse[deck_id] + k * power(old_size))
+
+    def popped_bottom(self, deck_id, card, new_size):
+        k = key("card", *card)
+        self.__set(deck_id, (self.__forward[deck_id] - k) * INVERSE_BASE,
+                   self.__reverse[deck_id] - k * power(new_size))
+
+    def turned_over(self, src_deck_id, dst_deck_id):
+        # the source deck is turned over onto the destination, replacing whatever was there, and left empty
+        forward, reverse = self.__reverse[src_deck_id], self.__forward[src_deck_id]
+        self.__set(src_deck_id, 0, 0)
+        self.__set(dst_deck_id, forward, reverse)
+
+    def __set(self, deck_id, forward, reverse):
+        forward %= MODULUS
+        self.__total += (forward - self.__forward[deck_id]) * key("deck", deck_id)
+        self.__total %= MODULUS
+
+        self.__forward[deck_id] = forward
+        self.__reverse[deck_id] = reverse % MODULUS
+
@@ -1,52 +1,62 @@
+import time
 import pygame
-import errno
 from player import Player
-from cards import Deck
-from math import sin, cos, pi
+from model import Deck, Card, GameState, CenterPiles
+from textures import CardTextures, TexturePyramid
+from layout import TableLayout
 from button import Button
 from text import Text, TextFeed
-from instructions import Instruction
-from message import Message
-
-
-def calc_nth_player_center(player, n_players, radius):
-    theta = player * 2 * pi / n_players
-    x_pos = sin(theta) * radius
-    y_pos = cos(theta) * radius
-
-    return (x_pos + 1) / 2, (y_pos + 1) / 2
+from instructions import Instruction, parse_instruction
+from frame_scheduler import FrameScheduler
+from frame_profiler import FrameProfiler
+from profiling import LoopProfiler
+from prediction import Prediction
 
 
 class Mongoose:
-    PLAYER_SPREAD_RADIUS = 0.7
-    PLAYER_REGION_SIZE = 0.15
-    CARD_SIZE = 0.07
-    CARD_ASPECT_RATIO = 500 / 726
-    CARD_STACK_SIZE = 0.02
+    CARD_SIZE = TableLayout.CARD_SIZE
+    CARD_STACK_SIZE = TableLayout.CARD_STACK_SIZE
+    # starts a CPU profile of the game loop, or stops one early; the report is printed when it finishes
+    PROFILE_KEY = pygame.K_F9
+    PROFILE_SECONDS = 10
+    # shows what has been allocated since the last press
+    MEMORY_KEY = pygame.K_F10
     HOVER_HIGHLIGHT_ALLOWED_COLOUR = (66, 245, 99, 128)
     HOVER_HIGHLIGHT_DISALLOWED_COLOUR = (245, 66, 81, 128)
 
     UPDATE_FREQUENCY = 1000
     SEND_RATE = 100
 
-    def __init__(self, client_socket, deck, screen_size=(1280, 720), title="Mongoose", clear_colour=(66, 135, 245)):
-        self.client_socket = client_socket
+    def __init__(self, connection, deck, screen_size=(1280, 720), title="Mongoose", clear_colour=(66, 135, 245),
+                 max_fps=FrameScheduler.DEFAULT_MAX_FPS, idle_fps=FrameScheduler.DEFAULT_IDLE_FPS):
+        self.connection = connection
 
         self.n_players = -1
         self.players = []
         self.deck = deck
 
         self.center_piles = []
+        # which cards each center pile will take
+        self.__center = None
 
         self.screen_size = screen_size
         self.clear_colour = clear_colour
 
-        pygame.init()
+        # only the parts of pygame the game uses are started
+        pygame.display.init()
+        pygame.font.init()
 
         self.screen = pygame.display.set_mode(screen_size, pygame.DOUBLEBUF | pygame.RESIZABLE)
         pygame.display.set_caption(title)
 
-        self.clock = pygame.time.Clock()
+        self.frame_scheduler = FrameScheduler(max_fps, idle_fps)
+        self.profiler = FrameProfiler()
+        self.loop_profiler = LoopProfiler("mongoose")
+
+        # cards are drawn on the center piles and when held at CARD_SIZE, and smaller in each hand, at a size which
+        # depends on how many hands there are
+        CardTextures.pyramid = TexturePyramid(CardTextures.texture, CardTextures.names(),
+                                              (Mongoose.CARD_SIZE, TableLayout.HAND_SIZE * TableLayout.CARD_SCALE))
 
         self.__turn = 0
         self.__active_player = -1
@@ -54,39 +64,40 @@ class Mongoose:
         self.__holding_card = None
         self.__flipped_card = None
 
-        self.__lmd_event_registered = False
+        # latest known mouse position and the time (in s) of the last input event that was handled
+        self.__mouse_pos = pygame.mouse.get_pos()
+        self.__last_input_time = time.perf_counter()
 
-        self.__mongoose_button = Button("Mongoose!", (0.9, 0.9), (0.1, 0.08), font_hierarchy=["Verdana"])
+        self.__mongoose_button = Button("Mongoose!", *TableLayout.MONGOOSE_BUTTON, font_hierarchy=["Verdana"])
         self.__mongoose_button.subscribe_event(self.call_mongoose)
 
         self.__which_players_turn_label = Text("", 40, font_hierarchy=["Verdana"], text_colour=(255, 255, 255))
 
         self.__feed = TextFeed((0.18, 0.82), (0.3, 0.3))
 
-        self.__flip_button = Button("Flip", (0.5, 0.7), (0.08, 0.06), "flip")
+        self.__flip_button = Button("Flip", *TableLayout.FLIP_BUTTON, "flip")
 
         self.__has_started_move = False
 
         self.__last_move = None
 
-        self.__connected_to_server = True
-
-        # self.__server_handling_thread = threading.Thread(target=self.handle_server_io, daemon=True)
-        # self.__server_handling_thread.start()
-
         self.__server_send_queue = []
 
         self.__inst_queue = []
 
         self.__win_place_count = 1
 
-    def setup_game(self, active_player, players):
+    def setup_game(self, active_player, players, n_center_piles=GameState.N_CENTER_PILES):
         self.__active_player = active_player
         self.n_players = len(players)
 
         # self.deck = Deck.full()
         # self.deck.shuffle()
 
+        # the table as the server has it, to roll the player's own moves back onto when someone else's get in first
+        self.__prediction = Prediction(GameState([(c.suit, c.value, c.deck) for c in self.deck.cards], self.n_players,
+                                                 n_center_piles))
+
         piles = self.deck.deal(self.n_players)
 
         for (i, pile), name in zip(enumerate(piles), map(lambda x: x[0], players)):
@@ -97,11 +108,13 @@ class Mongoose:
 
         self.__flip_button.subscribe_event(self.flip_deck)
 
-        for i in range(4):
+        for i in range(n_center_piles):
             p = Deck.empty()
             p.deck_id = len(players) * 2 + i
             self.center_piles.append(p)
 
+        self.__center = CenterPiles([p.deck_id for p in self.center_piles])
+
     def current_player(self):
         return self.players[self.__turn % self.n_players]
 
@@ -111,14 +124,25 @@ class Mongoose:
     def active_player(self):
         return self.players[self.__active_player]
 
+    def layout(self):
+        return TableLayout.get(self.n_players, len(self.center_piles), self.screen_size)
+
+    def seat(self, player_index, layout=None):
+        # rotate each player round such that the active player is at the bottom
+        layout = layout or self.layout()
+        return layout.seats[(player_index + self.n_players - self.__active_player) % self.n_players]
+
     def update_turn_label(self):
         self.__which_players_turn_label.text = f"{self.current_player().name}'s turn"
         self.__which_players_turn_label.update()
 
     def run(self):
         while True:
-            pygame.event.pump()
+            self.profiler.begin_frame()
+
             for event in pygame.event.get():
+                self.profiler.mark("events")
+
                 if event.type == pygame.VIDEORESIZE:
                     self.screen_size = (event.w, event.h)
                     self.screen = pygame.display.set_mode(self.screen_size, pygame.DOUBLEBUF | pygame.RESIZABLE)
@@ -126,126 +150,167 @@ class Mongoose:
                 if event.type == pygame.QUIT:
                     self.quit()
 
-            mouse_pos = pygame.mouse.get_pos()
-            mouse_pressed = pygame.mouse.get_pressed()
+                if event.type == pygame.KEYDOWN and event.key == FrameProfiler.TOGGLE_KEY:
+                    self.profiler.toggle()
+
+                if event.type == pygame.KEYDOWN and event.key == Mongoose.PROFILE_KEY:
+                    self.toggle_loop_profile()
+
+                if event.type == pygame.KEYDOWN and event.key == Mongoose.MEMORY_KEY:
+                    print(self.loop_profiler.snapshot())
 
-            self.current_turn()
+                if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION):
+                    self.handle_mouse_event(event)
+                else:
+                    self.frame_scheduler.request_redraw()
 
-            if not mouse_pressed[0]:
-                self.__lmd_event_registered = False
+            self.profiler.mark("events")
 
-            Button.update_all("main", self.screen_size, mouse_pos, mouse_pressed)
+            if self.frame_scheduler.should_render():
+                self.render()
 
-            if self.active_player().down_empty() and self.active_player() == self.current_player() and \
-                    self.__holding_card is None:
-                Button.update_all("flip", self.screen_size, mouse_pos, mouse_pressed)
+                self.profiler.render(self.screen)
+                self.profiler.mark("render.profiler")
 
-            self.render()
+                pygame.display.flip()
+                self.profiler.mark("display.flip")
 
             self.handle_instructions()
+            self.profiler.mark("handle_instructions")
+
             self.handle_server_io()
+            self.profiler.mark("handle_server_io")
+
+            self.frame_scheduler.tick([self.connection] if self.connection.connected else [])
+            self.profiler.mark("tick")
+
+            if self.loop_profiler.running():
+                report = self.loop_profiler.poll()
+                if report is not None:
+                    self.report_loop_profile(report)
+
+    def toggle_loop_profile(self):
+        if self.loop_profiler.running():
+            self.report_loop_profile(self.loop_profiler.stop())
+        else:
+            self.__feed.add_line(self.loop_profiler.start(Mongoose.PROFILE_SECONDS))
+
+    def report_loop_profile(self, report):
+        print(report)
+        self.__feed.add_line(report.split("\n", 1)[0])
+
+    def handle_mouse_event(self, event):
+        self.__mouse_pos = event.pos
+        self.__last_input_time = time.perf_counter()
+        self.frame_scheduler.mark_active()
 
-            self.clock.tick(60)
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            self.current_turn(event.pos)
+            self.profiler.mark("current_turn")
+
+        Button.update_all("main", self.screen_size, event)
+        self.profiler.mark("buttons.main")
+
+        if self.flip_available():
+            Button.update_all("flip", self.screen_size, event)
+            self.profiler.mark("buttons.flip")
+
+    def flip_available(self):
+        return self.active_player().down_empty() and self.active_player() == self.current_player() and \
+            self.__holding_card is None
 
     def render(self):
+        layout = self.layout()
+
+        CardTextures.pyramid.update(self.screen_size[0],
+                                    (Mongoose.CARD_SIZE, layout.center_card_size, layout.seats[0].card_size))
+
         self.screen.fill(self.clear_colour)
+        self.profiler.mark("render.clear")
 
         # render players' hands
         for i, player in enumerate(self.players):
-            # rotate each player round such that the active player is at the bottom
-            screen_index = (i + self.n_players - self.__active_player) % self.n_players
-            player.render_hand(self.screen,
-                               calc_nth_player_center(screen_index, self.n_players, Mongoose.PLAYER_SPREAD_RADIUS),
-                               i == self.__turn % self.n_players,
-                               Mongoose.PLAYER_REGION_SIZE)
+            player.render_hand(self.screen, self.seat(i, layout), i == self.__turn % self.n_players)
+
+        self.profiler.mark("render.hands")
 
         # render center piles
-        for i, cp in enumerate(self.center_piles):
-            cx = 0.5 - (i - 1.5) * 0.08
-            cy = 0.5
-            self.render_pile(cp, (cx, cy), Mongoose.CARD_SIZE)
+        for cp, center in zip(self.center_piles, layout.center_piles):
+            self.render_pile(cp, center, layout.center_card_size)
+
+        self.profiler.mark("render.center_piles")
 
         # display held card, if the current player is holding a card
         if self.__holding_card is not None:
             # draw hovering highlights
             for i, cp in enumerate(self.center_piles):
-                cx = 0.5 - (i - 1.5) * 0.08
-                cy = 0.5
-                h = Mongoose.CARD_SIZE * self.get_aspect_ratio() / Mongoose.CARD_ASPECT_RATIO + \
-                    Mongoose.CARD_STACK_SIZE * max(len(cp.cards) - 1, 0)
-                region = (cx, cy, Mongoose.CARD_SIZE, h)
-                if self.hovering_in_region(region):
-                    highlight_s = pygame.Surface((int(region[2] * self.screen_size[0]),
-                                                  int(region[3] * self.screen_size[1])))
-                    col = Mongoose.HOVER_HIGHLIGHT_ALLOWED_COLOUR if self.is_valid_center_move(cp) else \
-                        Mongoose.HOVER_HIGHLIGHT_DISALLOWED_COLOUR
+                region = layout.center_pile_region(i, len(cp.cards))
 
-                    highlight_s.set_alpha(col[3])
-                    highlight_s.fill(col[:3])
-                    self.screen.blit(highlight_s, (int((region[0] - region[2] / 2) * self.screen_size[0]),
-                                                   int((region[1] - region[3] / 2) * self.screen_size[1])))
+                if self.hovering_in_region(region):
+                    self.render_highlight(region, Mongoose.HOVER_HIGHLIGHT_ALLOWED_COLOUR
+                                          if self.is_valid_center_move(cp) else
+                                          Mongoose.HOVER_HIGHLIGHT_DISALLOWED_COLOUR)
 
             for i, player in enumerate(self.players):
-                screen_index = (i + self.n_players - self.__active_player) % self.n_players
-                region = player.get_face_up_region(calc_nth_player_center(screen_index,
-                                                                          self.n_players,
-                                                                          Mongoose.PLAYER_SPREAD_RADIUS),
-                                                   Mongoose.PLAYER_REGION_SIZE)
-
-                col = Mongoose.HOVER_HIGHLIGHT_ALLOWED_COLOUR \
-                    if len(player.face_up.cards) != 0 or player == self.current_player() else \
-                    Mongoose.HOVER_HIGHLIGHT_DISALLOWED_COLOUR
+                region = self.seat(i, layout).face_up
 
                 if self.hovering_in_region(region):
-                    highlight_s = pygame.Surface((int(region[2] * self.screen_size[0]),
-                                                  int(region[3] * self.screen_size[1])))
-                    highlight_s.set_alpha(col[3])
-                    highlight_s.fill(col[:3])
-                    self.screen.blit(highlight_s, (int((region[0] - region[2] / 2) * self.screen_size[0]),
-                                                   int((region[1] - region[3] / 2) * self.screen_size[1])))
+                    self.render_highlight(region, Mongoose.HOVER_HIGHLIGHT_ALLOWED_COLOUR
+                                          if len(player.face_up.cards) != 0 or player == self.current_player() else
+                                          Mongoose.HOVER_HIGHLIGHT_DISALLOWED_COLOUR)
+
+            self.profiler.mark("render.highlights")
 
             # draw this card
-            mouse_x, mouse_y = pygame.mouse.get_pos()
-            self.__holding_card.render(self.screen,
-                                       (mouse_x / self.screen_size[0], mouse_y / self.screen_size[1]),
-                                       Mongoose.CARD_SIZE)
+            mouse_x, mouse_y = self.__mouse_pos
+            CardTextures.render(self.__holding_card, self.screen,
+                                (mouse_x / self.screen_size[0], mouse_y / self.screen_size[1]), Mongoose.CARD_SIZE)
+
+            self.profiler.mark("render.held_card")
 
         self.__which_players_turn_label.render(self.screen, (0.1, 0.1))
         self.__feed.render(self.screen)
 
         Button.render_all("main", self.screen)
 
-        if self.active_player().down_empty() and self.active_player() == self.current_player() and \
-                self.__holding_card is None:
+        if self.flip_available():
             Button.render_all("flip", self.screen)
 
-        pygame.display.flip()
+        self.profiler.mark("render.ui")
+
+    def render_highlight(self, region, col):
+        highlight_s = pygame.Surface((int(region[2] * self.screen_size[0]), int(region[3] * self.screen_size[1])))
+        highlight_s.set_alpha(col[3])
+        highlight_s.fill(col[:3])
+        self.screen.blit(highlight_s, (int((region[0] - region[2] / 2) * self.screen_size[0]),
+                                       int((region[1] - region[3] / 2) * self.screen_size[1])))
 
     def render_pile(self, pile, center, size):
         for i, card in enumerate(pile.cards):
             cx = center[0]
             cy = center[1] + (i - (len(pile.cards) - 1) / 2) * Mongoose.CARD_STACK_SIZE
-            card.render(self.screen, (cx, cy), size)
+            CardTextures.render(card, self.screen, (cx, cy), size)
 
     def handle_instructions(self):
         while self.__inst_queue:
             self.__inst_queue.pop(0)()
 
-    def current_turn(self):
+    def current_turn(self, click_pos):
         current_player_index = self.__turn % self.n_players
 
         if current_player_index != self.__active_player:
             return
 
         current_player = self.players[current_player_index]
-
-        cp_screen_index = (current_player_index + self.n_players - self.__active_player) % self.n_players
+        layout = self.layout()
 
         if not self.is_holding_card():
-            card, source = current_player.choose_card(calc_nth_player_center(cp_screen_index,
-                                                                             self.n_players,
-                                                                             Mongoose.PLAYER_SPREAD_RADIUS),
-                                                      Mongoose.PLAYER_REGION_SIZE, self.left_clicked_in_region)
+            # too many moves are still waiting on the server; wait for it to catch up
+            if self.__prediction.full():
+                return
+
+            card, source = current_player.choose_card(self.seat(current_player_index, layout),
+                                                      lambda region: self.point_in_region(region, click_pos))
 
             if card is not None:
                 self.pick_up_card(card, source.deck_id)
@@ -255,47 +320,35 @@ class Mongoose:
             # check for placement
             # check centers
             for i, cp in enumerate(self.center_piles):
-                cx = 0.5 - (i - 1.5) * 0.08
-                cy = 0.5
-                h = Mongoose.CARD_SIZE * self.get_aspect_ratio() / Mongoose.CARD_ASPECT_RATIO + \
-                    Mongoose.CARD_STACK_SIZE * max(len(cp.cards) - 1, 0)
-                region = (cx, cy, Mongoose.CARD_SIZE, h)
+                region = layout.center_pile_region(i, len(cp.cards))
 
                 valid = self.is_valid_center_move(cp)
-                if self.left_clicked_in_region(region) and valid:
+                if self.point_in_region(region, click_pos) and valid:
                     self.place_card(cp)
                     return
 
             # check other piles
             for i, player in enumerate(self.players):
-                screen_index = (i + self.n_players - self.__active_player) % self.n_players
-                region = player.get_face_up_region(calc_nth_player_center(screen_index,
-                                                                          self.n_players,
-                                                                          Mongoose.PLAYER_SPREAD_RADIUS),
-                                                   Mongoose.PLAYER_REGION_SIZE)
-                if self.left_clicked_in_region(region) and (len(player.face_up.cards) != 0 or
-                                                            player == self.current_player()):
+                if self.point_in_region(self.seat(i, layout).face_up, click_pos) and (len(player.face_up.cards) != 0 or
+                                                                player == self.current_player()):
                     self.place_card(player.face_up)
                     return
 
     def is_valid_center_move(self, deck):
-        if len(deck.cards) == 0:
-            return self.__holding_card.value == 7
-
-        max_val = max(map(lambda x: x.value, deck.cards))
-        min_val = min(map(lambda x: x.value, deck.cards))
+        # only the value is checked here; a card of the wrong suit can be placed, and gets its player auto-mongoosed
+        ends = self.__center.ends(deck.deck_id)
 
-        valid = self.__holding_card.value == max_val + 1 or self.__holding_card.value == min_val - 1
+        if ends is None:
+            return self.__holding_card.value == CenterPiles.STARTING_VALUE
 
-        return valid
+        return self.__holding_card.value in (ends[1] - 1, ends[2] + 1)
 
     def pick_up_card(self, card, deck_id):
         if self.__holding_card is None:
             self.__holding_card = card
             self.__has_started_move = True
 
-            message = f"{Instruction.Game.PICKUP_CARD}:'{deck_id}'"
-            self.client_socket.sendall(Message.new_send_message(message.encode("utf-8")).encode())
+            self.send_move(Instruction.Game.PICKUP_CARD, deck_id)
 
     def place_card(self, target_deck):
 
@@ -305,8 +358,8 @@ class Mongoose:
         valid_move = self.check_for_auto_mongoose(self.__holding_card, target_deck)
 
         if not valid_move:
-            message = f"{Instruction.Game.PLACE_CARD}:'{self.__last_move[1].deck_id}':'{self.current_player().face_up.deck_id}'"
-            self.client_socket.sendall(Message.new_send_message(message.encode("utf-8")).encode())
+            self.send_move(Instruction.Game.PLACE_CARD, self.__last_move[1].deck_id,
+                           self.current_player().face_up.deck_id)
             self.current_player().face_up.add_card_to_top(self.__holding_card)
 
             self.__holding_card = None
@@ -316,50 +369,57 @@ class Mongoose:
 
         target_deck.add_card_to_top(self.__holding_card)
 
+        if target_deck.deck_id in self.__center:
+            self.__center.placed(target_deck.deck_id, self.__holding_card.suit, self.__holding_card.value)
+            self.settle_center_card(target_deck)
+
         self.__holding_card = None
 
         self.__last_move[2] = target_deck
 
-        message = f"{Instruction.Game.PLACE_CARD}:'{self.__last_move[1].deck_id}':'{target_deck.deck_id}'"
-        self.client_socket.sendall(Message.new_send_message(message.encode("utf-8")).encode())
+        self.send_move(Instruction.Game.PLACE_CARD, self.__last_move[1].deck_id, target_deck.deck_id)
 
         # if the target deck was the player's face up deck, that was the end of their turn.
         if target_deck == self.current_player().face_up:
             self.next_turn()
 
-            message = f"{Instruction.Game.MOVE_ENDED}"
-            self.client_socket.sendall(Message.new_send_message(message.encode("utf-8")).encode())
+            self.send_move(Instruction.Game.MOVE_ENDED)
+
+    def send_move(self, instruction, *operands):
+        # the move has already been made here; the sequence number is for the server to say whether it was made there,
+        # and the hash of the table after it for the server to check the two tables are still the same
+        operands = [str(o) for o in operands]
+
+        try:
+            seq = self.__prediction.predict(instruction, operands)
+        except (IndexError, ValueError):
+            # the table shown has drifted from the prediction; the server is left to decide
+            self.connection.send(instruction + "".join(f":'{o}'" for o in operands))
+            return
+
+        self.connection.send(self.__prediction.move_message(instruction, operands, seq))
 
-        self.sort_centers()
+    def show_prediction(self):
+        # redraws the table as the server has it with the player's own moves made again on top
+        self.sync_state(self.__prediction.view.sync_operands())
 
     def flip_deck(self):
         flip_message = f"{Instruction.Game.FLIP_DECK}:'{self.__active_player}'"
-        self.client_socket.sendall(Message.new_send_message(flip_message.encode("utf-8")).encode())
+        self.__prediction.expect_echo(Instruction.Game.FLIP_DECK, [self.__active_player])
+        self.connection.send(flip_message)
 
     def is_holding_card(self):
         return self.__holding_card is not None
 
-    def left_clicked_in_region(self, region):
-        if self.__lmd_event_registered:
-            return False
-
-        if pygame.mouse.get_pressed()[0]:
-            mouse_x, mouse_y = pygame.mouse.get_pos()
-            sx = (region[0] - region[2] / 2) * self.screen_size[0]
-            ex = (region[0] + region[2] / 2) * self.screen_size[0]
-            sy = (region[1] - region[3] / 2) * self.screen_size[1]
-            ey = (region[1] + region[3] / 2) * self.screen_size[1]
-            self.__lmd_event_registered = sx <= mouse_x <= ex and sy <= mouse_y <= ey
-            return self.__lmd_event_registered
-        return False
-
-    def hovering_in_region(self, region):
-        mouse_x, mouse_y = pygame.mouse.get_pos()
+    def point_in_region(self, region, pos):
         sx = (region[0] - region[2] / 2) * self.screen_size[0]
         ex = (region[0] + region[2] / 2) * self.screen_size[0]
         sy = (region[1] - region[3] / 2) * self.screen_size[1]
         ey = (region[1] + region[3] / 2) * self.screen_size[1]
-        return sx <= mouse_x <= ex and sy <= mouse_y <= ey
+        return sx <= pos[0] <= ex and sy <= pos[1] <= ey
+
+    def hovering_in_region(self, region):
+        return self.point_in_region(region, self.__mouse_pos)
 
     def call_mongoose(self):
         if self.__has_started_move:
@@ -389,13 +449,8 @@ class Mongoose:
                 if card.value == 7:
                     return True
 
-                for p in self.center_piles:
-                    if len(p.cards) != 0:
-                        max_val = max(map(lambda x: x.value, p.cards))
-                        min_val = min(map(lambda x: x.value, p.cards))
-                        suit = p.cards[0].suit
-                        if card.suit == suit and card.value in (max_val + 1, min_val - 1):
-                            return True
+                if self.__center.extends(card.suit, card.value):
+                    return True
 
                 for p in self.players:
                     if p == player or len(p.face_up.cards) == 0:
@@ -411,13 +466,8 @@ class Mongoose:
                     if top_card.value == 7:
                         return False
 
-                    for p in self.center_piles:
-                        if len(p.cards) != 0:
-                            max_val = max(map(lambda x: x.value, p.cards))
-                            min_val = min(map(lambda x: x.value, p.cards))
-                            suit = p.cards[0].suit
-                            if top_card.suit == suit and top_card.value in (max_val + 1, min_val - 1):
-                                return False
+                    if self.__center.extends(top_card.suit, top_card.value):
+                        return False
 
                     for p in self.players:
                         if p == player or len(p.face_up.cards) == 0:
@@ -431,16 +481,11 @@ class Mongoose:
 
         if src == player.face_up:
             # if we managed to put the card in the center without being auto mongoosed, that was the correct move
-            if dst in self.center_piles:
+            if dst.deck_id in self.__center:
                 return True
 
-        for p in self.center_piles:
-            if len(p.cards) != 0:
-                max_val = max(map(lambda x: x.value, p.cards))
-                min_val = min(map(lambda x: x.value, p.cards))
-                suit = p.cards[0].suit
-                if card.suit == suit and card.value in (max_val + 1, min_val - 1):
-                    return False
+        if self.__center.extends(card.suit, card.value):
+            return False
 
         for p_id in range(self.__turn + 1, self.__turn + self.n_players):
             up_pile = self.players[p_id % self.n_players].face_up
@@ -466,13 +511,8 @@ class Mongoose:
                 if top_card.value == 7:
                     return False
 
-                for p in self.center_piles:
-                    if len(p.cards) != 0:
-                        max_val = max(map(lambda x: x.value, p.cards))
-                        min_val = min(map(lambda x: x.value, p.cards))
-                        suit = p.cards[0].suit
-                        if top_card.suit == suit and top_card.value in (max_val + 1, min_val - 1):
-                            return False
+                if self.__center.extends(top_card.suit, top_card.value):
+                    return False
 
                 for p in self.players:
                     if p == player or len(p.face_up.cards) == 0:
@@ -488,28 +528,26 @@ class Mongoose:
         return True
 
     def sync_send_chat_message(self, message):
-        send_message = Message.new_send_message(f"{Instruction.Update.CHAT_MESSAGE}:'{message}'".encode("utf-8"))
-        self.client_socket.sendall(send_message.encode())
+        self.connection.send(f"{Instruction.Update.CHAT_MESSAGE}:'{message}'")
 
     def check_for_auto_mongoose(self, card, pile):
-        if pile in self.center_piles:
+        if pile.deck_id in self.__center:
             # if this move was invalid, we need to retract the card so as not to break the game.
-            if len(pile.cards) == 0:
+            ends = self.__center.ends(pile.deck_id)
+            if ends is None:
                 return True
-            for c in pile.cards:
-                if c.suit != card.suit:
-                    # the move was invalid (we already know that the card is adjacent)
-                    self.sync_send_chat_message(f"{self.current_player().name} was auto-mongoosed!")
-                    # self.current_player().face_up.add_card_to_top(card)
-                    # pile.cards.remove(card)
-                    self.mongoose_player(self.current_player(), True)
+            if ends[0] != card.suit:
+                # the move was invalid (we already know that the card is adjacent)
+                self.sync_send_chat_message(f"{self.current_player().name} was auto-mongoosed!")
+                self.mongoose_player(self.current_player(), True)
 
-                    return False
+                return False
         return True
 
     def mongoose_player(self, target, skip=True):
         message = f"{Instruction.Game.CALL_MONGOOSE}:'{target.player_id}':'{1 if skip else 0}'"
-        self.client_socket.sendall(Message.new_send_message(message.encode("utf-8")).encode())
+        self.__prediction.expect_echo(Instruction.Game.CALL_MONGOOSE, [target.player_id, 1 if skip else 0])
+        self.connection.send(message)
 
     def pass_cards_to_player(self, target_id, skip_turn):
         for i, player in enumerate(self.players):
@@ -520,56 +558,56 @@ class Mongoose:
             self.next_turn()
 
     def handle_server_io(self):
-        if not self.__connected_to_server:
-            return
+        messages = self.connection.receive_all()
 
-        try:
-            message = Message.new_recv_message()
+        for message in messages:
+            self.decode_instruction(message)
 
-            buffer = self.client_socket.recv(Message.BUFFER_SIZE)
+        if messages:
+            self.frame_scheduler.mark_active()
 
-            if not buffer:
-                self.client_socket.close()
-
-                self.__connected_to_server = False
+    def index_center(self):
+        # after the center piles have been replaced wholesale
+        for p in self.center_piles:
+            self.__center.reset(p.deck_id, ((card.suit, card.value) for card in p.cards))
 
-            while not message.decode(buffer):
-                buffer = self.client_socket.recv(Message.BUFFER_SIZE)
+    @staticmethod
+    def settle_center_card(pile):
+        # center piles are shown highest card on top. A valid move only ever extends the run, so the card just placed
+        # on top only has to move if it went below the bottom.
+        if len(pile.cards) < 2 or pile.cards[0].value >= pile.cards[1].value:
+            return
 
-            self.decode_instruction(message.message.decode("utf-8"))
+        card = pile.take_top()
 
-        except IOError as e:
-            if e.errno != errno.EAGAIN and e.errno != errno.EWOULDBLOCK:
-                self.client_socket.close()
+        if card.value <= pile.bottom().value:
+            pile.add_card_to_bottom(card)
+        else:
+            pile.add_card_to_top(card)
+            pile.sort(True)
 
-                self.__connected_to_server = False
+    def decode_instruction(self, message):
+        instruction, operands = parse_instruction(message)
 
-    def sort_centers(self):
-        for p in self.center_piles:
-            p.sort(True)
+        if instruction in (Instruction.Game.ACK, Instruction.Game.REJECT):
+            answer = self.__prediction.confirm if instruction == Instruction.Game.ACK else self.__prediction.reject
 
-    def decode_instruction(self, message):
-        operands = []
+            if answer(int(operands[0])):
+                self.show_prediction()
 
-        if ":" in message:
-            instruction, operand = message.split(":", 1)
+            return
 
-            in_string = False
-            cur_operand = ""
+        if instruction in GameState.MOVES or instruction == Instruction.Game.SYNC_STATE:
+            # while the player's own moves are waiting on the server, someone else's move has to go underneath them
+            if self.__prediction.apply_remote(instruction, operands):
+                self.show_prediction()
 
-            for c in operand:
-                if c == "'":
-                    in_string = not in_string
-                else:
-                    if in_string:
-                        cur_operand += c
-                    elif c == ":":
-                        operands.append(cur_operand)
-                        cur_operand = ""
+                if instruction == Instruction.Game.PICKUP_CARD:
+                    self.__has_started_move = True
+                elif instruction == Instruction.Game.MOVE_ENDED:
+                    self.__has_started_move = False
 
-            operands.append(cur_operand)
-        else:
-            instruction = message
+                return
 
         if instruction == Instruction.Game.PICKUP_CARD:
             assert len(operands) == 1
@@ -589,9 +627,11 @@ class Mongoose:
 
             src_player.place_flipped_card(dst_deck)
 
-            self.__last_move[2] = dst_deck
+            if dst_deck.deck_id in self.__center:
+                self.__center.placed(dst_deck.deck_id, dst_deck.top().suit, dst_deck.top().value)
+                self.settle_center_card(dst_deck)
 
-            self.sort_centers()
+            self.__last_move[2] = dst_deck
 
         if instruction == Instruction.Game.MOVE_ENDED:
             self.next_turn()
@@ -610,11 +650,46 @@ class Mongoose:
             flip_player = int(operands[0])
             self.players[flip_player].flip_deck()
 
+        if instruction == Instruction.Game.SYNC_STATE:
+            self.sync_state(operands)
+
         if instruction == Instruction.Update.CHAT_MESSAGE:
             assert len(operands) == 1
 
             self.__feed.add_line(operands[0])
 
+    def sync_state(self, operands):
+        # the server's copy of the whole table, sent when a player rejoins the game
+        n_decks = 2 * self.n_players + len(self.center_piles)
+        assert len(operands) == 1 + n_decks + self.n_players
+
+        self.__turn = int(operands[0])
+        self.update_turn_label()
+
+        # decks are sent from the bottom up
+        for deck_id, deck in enumerate(operands[1:n_decks + 1]):
+            self.get_deck_by_id(deck_id).cards = [Card(*card) for card in GameState.decode_deck(deck.split())][::-1]
+
+        self.index_center()
+
+        self.__holding_card = None
+
+        for player, held in zip(self.players, operands[n_decks + 1:]):
+            player.set_flipped_card(None)
+
+            if not held:
+                continue
+
+            deck_id, card = held.split()
+            card = Card(*GameState.decode_card(card))
+
+            if player == self.active_player():
+                self.__holding_card = card
+            else:
+                player.set_flipped_card(card, int(deck_id) % 2)
+
+            self.__last_move = [card, self.get_deck_by_id(int(deck_id)), None]
+
     def get_deck_by_id(self, deck_id):
         if deck_id < self.n_players * 2:
             p = self.players[deck_id // 2]
@@ -647,8 +722,8 @@ class Mongoose:
             self.next_turn(__c_esc + 1)
 
     def quit(self):
-        if self.__connected_to_server:
-            self.client_socket.sendall(Message.new_send_message(Instruction.Update.QUIT_GAME.encode("utf-8")).encode())
-        # self.__server_handling_thread.join(0.5)
+        if self.connection.connected:
+            self.connection.send(Instruction.Update.QUIT_GAME)
+            self.connection.close()
         pygame.quit()
         quit()
@@ -1,5 +1,6 @@
 import pygame
-from cards import Deck
+from model import Deck
+from textures import CardTextures
 from text import Text
 
 
@@ -10,8 +11,6 @@ class Pile:
 
 class Player:
     HAND_BOUND_COLOUR = (235, 213, 52)
-    HAND_BOUND_ASPECT_RATIO = 1.41
-    CARD_ASPECT_RATIO = 500 / 726
     HAND_BOUND_WIDTH = 3
     PICKUP_V_OFFSET = 0.02
 
@@ -30,35 +29,34 @@ class Player:
 
         self.__flipped_card = None
 
-    def render_hand(self, render_target, center, active_player, size=0.15):
+    def render_hand(self, render_target, seat, active_player):
         screen_size = render_target.get_size()
 
         # draw the bounding box of the player's hand
-        sc_w = int(screen_size[0] * size)
-        sc_h = int(sc_w / Player.HAND_BOUND_ASPECT_RATIO)
-        sc_s_x = screen_size[0] * center[0] - sc_w / 2
-        sc_s_y = screen_size[1] * center[1] - sc_h / 2
+        cx, cy, w, h = seat.bounds
+        sc_w = int(screen_size[0] * w)
+        sc_h = int(screen_size[1] * h)
+        sc_s_x = screen_size[0] * cx - sc_w / 2
+        sc_s_y = screen_size[1] * cy - sc_h / 2
 
         pygame.draw.rect(render_target, Player.HAND_BOUND_COLOUR, (sc_s_x, sc_s_y, sc_w, sc_h), Player.HAND_BOUND_WIDTH)
 
-        card_size = size * 0.46
-
         # draw the face down pile
         top_d_card = self.face_down.top()
 
         if top_d_card is not None:
-            top_d_card.render(render_target, (center[0] - size / 4, center[1]), card_size, False)
+            CardTextures.render(top_d_card, render_target, seat.pile_center(Pile.DOWN), seat.card_size, False)
 
         # draw the face up pile
         top_u_card = self.face_up.top()
 
         if top_u_card is not None:
-            top_u_card.render(render_target, (center[0] + size / 4, center[1]), card_size, True)
+            CardTextures.render(top_u_card, render_target, seat.pile_center(Pile.UP), seat.card_size, True)
 
         if self.__flipped_card is not None:
-            cx = center[0] + (-size if self.__flipped_card[1] == 0 else size) / 4
-            cy = center[1] - Player.PICKUP_V_OFFSET
-            self.__flipped_card[0].render(render_target, (cx, cy), card_size, True)
+            cx, cy = seat.pile_center(self.__flipped_card[1])
+            CardTextures.render(self.__flipped_card[0], render_target, (cx, cy - Player.PICKUP_V_OFFSET),
+                                seat.card_size, True)
 
         # draw the player's name
         if active_player:
@@ -66,18 +64,13 @@ class Player:
         else:
             self.__name_text.text_colour = (255, 255, 255)
         self.__name_text.update()
-        self.__name_text.render(render_target, (center[0], center[1] + (6 * size / Player.HAND_BOUND_ASPECT_RATIO) / 5))
-
-    def choose_card(self, active_center, active_size, click_test_fn):
-        region_down = [active_center[0] - active_size / 4, active_center[1],
-                       active_size * 0.46, active_size / Player.CARD_ASPECT_RATIO * 0.8]
-        region_up = [active_center[0] + active_size / 4, active_center[1],
-                     active_size * 0.46, active_size / Player.CARD_ASPECT_RATIO * 0.8]
+        self.__name_text.render(render_target, seat.name_center)
 
+    def choose_card(self, seat, click_test_fn):
         pickup_deck = None
-        if click_test_fn(region_down):
+        if click_test_fn(seat.face_down):
             pickup_deck = self.face_down
-        if click_test_fn(region_up):
+        if click_test_fn(seat.face_up):
             pickup_deck = self.face_up
 
         return None if pickup_deck is None else pickup_deck.take_top(), pickup_deck
@@ -96,6 +89,9 @@ class Player:
 
         return self.__flipped_card[0]
 
+    def set_flipped_card(self, card, pile=Pile.DOWN):
+        self.__flipped_card = None if card is None else (card, pile)
+
     def place_flipped_card(self, dst):
         dst.add_card_to_top(self.__flipped_card[0])
         self.__flipped_card = None
@@ -106,7 +102,3 @@ class Player:
     def has_finished(self):
         return len(self.face_up.cards) + len(self.face_down.cards) == 0
 
-    @staticmethod
-    def get_face_up_region(active_center, active_size):
-        return [active_center[0] + active_size / 4, active_center[1],
-                active_size * 0.46, active_size / Player.CARD_ASPECT_RATIO * 0.8]
@@ -0,0 +1,128 @@
+from collections import deque
+from model import GameState
+
+
+class Prediction:
+    # the most of the player's own moves which can be waiting on the server; past this, nothing more is predicted
+    # until some are confirmed
+    MAX_PENDING = 32
+
+    def __init__(self, state):
+        # the table as the server has confirmed it, and the player's own moves which have been sent but not yet
+        # confirmed, in the order they were made. The predicted table is the one with those moves made on top.
+        self.confirmed = state
+        self.__pending = deque()
+        # the predicted table, kept up to date move by move, and only rebuilt when a move has to be rolled back
+        self.view = GameState.from_dict(state.to_dict())
+        # moves sent without being predicted, which are only made once the server echoes them back (mongoose calls
+        # and deck flips), in the order they were sent. The view leaves them out until then.
+        self.__echoes = deque()
+        self.__next_seq = 0
+
+        self.rollbacks = 0
+        self.rejected = 0
+        # moves the server accepted which did not fit the confirmed table here, which should never happen
+        self.desyncs = 0
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def full(self):
+        return len(self.__pending) >= Prediction.MAX_PENDING
+
+    def predict(self, instruction, operands):
+        # returns the sequence number the move is sent with, which the server acknowledges it by. The move is made on
+        # the view straight away.
+        self.view.apply_instruction(instruction, operands)
+
+        seq = self.__next_seq
+        self.__next_seq += 1
+
+        self.__pending.append((seq, instruction, operands))
+
+        return seq
+
+    def expect_echo(self, instruction, operands):
+        self.__echoes.append((instruction, [str(o) for o in operands]))
+
+    def confirm(self, seq):
+        # the server has made the move, after everything it has sent before this. Returns whether the predicted table
+        # has changed, which it only does if the two copies of the table have drifted apart.
+        move = self.__take(seq)
+
+        if move is None:
+            return False
+
+        try:
+            self.confirmed.apply_instruction(move[1], move[2])
+        except (IndexError, ValueError):
+            self.desyncs += 1
+            self.view = self.predicted()
+            return True
+
+        return False
+
+    def reject(self, seq):
+        # the move did not fit the server's table, so it never happened. Returns whether the predicted table changed.
+        if self.__take(seq) is None:
+            return False
+
+        self.rejected += 1
+        self.view = self.predicted()
+        return True
+
+    def apply_remote(self, instruction, operands):
+        # a move made by someone else (or echoed back to everyone), in the order the server made it. Returns whether
+        # the player's own moves were shown ahead of it, in which case they have to be rolled back and made again on
+        # top of it.
+        self.confirmed.apply_instruction(instruction, operands)
+
+        if self.__echoes and self.__echoes[0] == (instruction, operands):
+            self.__echoes.popleft()
+
+        if self.__pending:
+            self.rollbacks += 1
+            self.view = self.predicted()
+            return True
+
+        self.view.apply_instruction(instruction, operands)
+        return False
+
+    def state_hash(self):
+        # the hash of the predicted table, sent with each move for the server to check against its own. There is
+        # none while a move of the player's own is still to be echoed, as the server's table already has it.
+        if self.__echoes:
+            return None
+
+        return format(self.view.state_hash(), "x")
+
+    def move_message(self, instruction, operands, seq):
+        # the move with its sequence number, and the hash of the table after it when there is one
+        state_hash = self.state_hash()
+        extra = [seq] if state_hash is None else [seq, state_hash]
+
+        return instruction + "".join(f":'{o}'" for o in list(operands) + extra)
+
+    def predicted(self):
+        # the confirmed table with the player's own moves made again on top of it. A move which no longer fits is
+        # left out, but kept until the server says what it made of it, since more moves from other players may yet
+        # come in ahead of it.
+        state = GameState.from_dict(self.confirmed.to_dict())
+
+        for _, instruction, operands in self.__pending:
+            try:
+                state.apply_instruction(instruction, operands)
+            except (IndexError, ValueError):
+                pass
+
+        return state
+
+    def __take(self, seq):
+        # the server answers every move in the order it was sent, so the answer is always for the oldest one
+        while self.__pending and self.__pending[0][0] < seq:
+            self.__pending.popleft()
+
+        if not self.__pending or self.__pending[0][0] != seq:
+            return None
+
+        return self.__pending.popleft()
@@ -0,0 +1,111 @@
+import cProfile
+import pstats
+import time
+import tracemalloc
+
+
+class LoopProfiler:
+    # allocation sites shown in each memory diff, and functions in each CPU summary
+    TOP_ALLOCATIONS = 10
+    TOP_FUNCTIONS = 15
+    # frames kept for each allocation; more tells allocation sites apart better, but costs more while tracing
+    TRACEBACK_DEPTH = 1
+
+    def __init__(self, name):
+        # name prefixes the .pstats files written when no path is given
+        self.name = name
+
+        self.__profile = None
+        self.__path = None
+        self.__until = None
+        self.__start_snapshot = None
+        # the last snapshot taken by snapshot(), for the next one to be compared with
+        self.__last_snapshot = None
+
+    def running(self):
+        return self.__profile is not None
+
+    def start(self, seconds, path=None):
+        # profiles whatever the calling thread does for the next few seconds, so this has to be called from the loop
+        # being profiled. poll() stops it once the time is up.
+        if self.running():
+            return f"Already profiling until {self.__path} is written."
+
+        self.__path = path or f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}.pstats"
+        self.__until = time.perf_counter() + seconds
+        self.__start_snapshot = self.__take_snapshot()
+
+        self.__profile = cProfile.Profile()
+        self.__profile.enable()
+
+        return f"Profiling for {seconds:g}s into {self.__path}..."
+
+    def poll(self):
+        # returns the report once the profile has finished, otherwise None
+        if self.__profile is None or time.perf_counter() < self.__until:
+            return None
+
+        return self.stop()
+
+    def stop(self):
+        self.__profile.disable()
+        # before the stats are gathered, so that what they allocate is not counted
+        end_snapshot = self.__take_snapshot()
+        self.__profile.dump_stats(self.__path)
+
+        stats = pstats.Stats(self.__profile)
+        self.__profile = None
+
+        lines = [f"Profile written to {self.__path}. Top functions by cumulative time:"]
+        lines.extend(LoopProfiler.top_functions(stats))
+        lines.append("Allocations over the profile:")
+        lines.extend(LoopProfiler.diff(self.__start_snapshot, end_snapshot))
+
+        self.__start_snapshot = None
+        self.__stop_tracing()
+
+        return "\n".join(lines)
+
+    def snapshot(self):
+        # compares memory now with the last time this was called. The first call only starts tracing.
+        snapshot = self.__take_snapshot()
+        last, self.__last_snapshot = self.__last_snapshot, snapshot
+
+        if last is None:
+            return "Tracing allocations; take another snapshot to see what has changed."
+
+        return "\n".join(["Allocations since the last snapshot:"] + LoopProfiler.diff(last, snapshot))
+
+    def stop_snapshots(self):
+        self.__last_snapshot = None
+        self.__stop_tracing()
+
+        return "Stopped tracing allocations."
+
+    @staticmethod
+    def top_functions(stats):
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+        lines = []
+
+        for func in stats.fcn_list[:LoopProfiler.TOP_FUNCTIONS]:
+            calls, _, own_time, cumulative, _ = stats.stats[func]
+            lines.append(f"  {cumulative * 1e3:9.1f}ms {own_time * 1e3:9.1f}ms own {calls:>8} calls  "
+                         f"{pstats.func_std_string(func)}")
+
+        return lines
+
+    @staticmethod
+    def diff(before, after):
+        return [f"  {stat}" for stat in after.compare_to(before, "lineno")[:LoopProfiler.TOP_ALLOCATIONS]]
+
+    def __take_snapshot(self):
+        # allocations are only seen from when tracing starts, so it is started with the first snapshot
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(LoopProfiler.TRACEBACK_DEPTH)
+
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    def __stop_tracing(self):
+        # tracing slows every allocation down, so it is only left on while something still needs it
+        if self.__profile is None and self.__start_snapshot is None and self.__last_snapshot is None:
+            tracemalloc.stop()
@@ -0,0 +1,36 @@
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        # rate is in messages per second; burst is how many can be sent at once after a quiet spell
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter:
+    def __init__(self, limits, default):
+        # limits maps an opcode to (rate, burst), or None to leave it unlimited; anything else gets the default.
+        # Each connection has its own limiter, with a bucket made the first time it sends an opcode.
+        self.__limits = limits
+        self.__default = default
+        self.__buckets = {}
+
+    def allow(self, opcode, now):
+        bucket = self.__buckets.get(opcode)
+
+        if bucket is None:
+            limit = self.__limits.get(opcode, self.__default)
+            # unlimited opcodes are remembered as False, so that the limits are only looked up once
+            bucket = self.__buckets[opcode] = False if limit is None else TokenBucket(*limit, now)
+
+        return bucket is False or bucket.take(now)
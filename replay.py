@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import struct
+import time
+from instructions import parse_instruction
+from model import GameState
+
+
+class Replay:
+    MAGIC = b"MGRP\x01"
+    # record type, wall clock timestamp, payload length
+    RECORD_HEADER = struct.Struct("<BdI")
+    # the player who sent a move
+    MOVE_HEADER = struct.Struct("<h")
+    # the number of moves a keyframe comes after
+    KEYFRAME_HEADER = struct.Struct("<Q")
+    # entries in the sidecar index: move number, offset of the keyframe in the log
+    INDEX_ENTRY = struct.Struct("<QQ")
+
+    INDEX_SUFFIX = ".idx"
+
+    class RecordType:
+        START = 0
+        MOVE = 1
+        KEYFRAME = 2
+        END = 3
+
+
+class ReplayWriter:
+    KEYFRAME_INTERVAL = 64
+
+    def __init__(self, path, cards, players, n_center_piles=GameState.N_CENTER_PILES,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+
+        self.moves = 0
+
+        # both files are only ever appended to, and the index is written after the keyframe it points at has been
+        # flushed, so a crash can lose at most the last few moves but never leaves an index pointing at nothing
+        self.__log = open(path, "ab")
+        self.__index = open(path + Replay.INDEX_SUFFIX, "ab")
+
+        if self.__log.tell() == 0:
+            self.__log.write(Replay.MAGIC)
+
+        start = {"cards": cards, "players": players, "center_piles": n_center_piles}
+        self.write_record(Replay.RecordType.START, json.dumps(start).encode("utf-8"))
+
+        self.write_keyframe(GameState(cards, len(players), n_center_piles))
+
+    def write_record(self, record_type, payload):
+        self.__log.write(Replay.RECORD_HEADER.pack(record_type, time.time(), len(payload)))
+        self.__log.write(payload)
+
+    def record_move(self, player, message, state):
+        # state is the table after the move has been applied
+        self.write_record(Replay.RecordType.MOVE, Replay.MOVE_HEADER.pack(player) + message.encode("utf-8"))
+        self.moves += 1
+
+        if self.moves % self.keyframe_interval == 0:
+            self.write_keyframe(state)
+
+    def write_keyframe(self, state):
+        offset = self.__log.tell()
+
+        payload = Replay.KEYFRAME_HEADER.pack(self.moves) + json.dumps(state.to_dict()).encode("utf-8")
+        self.write_record(Replay.RecordType.KEYFRAME, payload)
+        self.__log.flush()
+
+        self.__index.write(Replay.INDEX_ENTRY.pack(self.moves, offset))
+        self.__index.flush()
+
+    def close(self):
+        if self.__log.closed:
+            return
+
+        self.write_record(Replay.RecordType.END, b"")
+
+        self.__log.close()
+        self.__index.close()
+
+
+class ReplayReader:
+    def __init__(self, path):
+        self.path = path
+
+        self.__log = open(path, "rb")
+
+        if self.__log.read(len(Replay.MAGIC)) != Replay.MAGIC:
+            raise ValueError(f"{path} is not a replay log")
+
+        record_type, self.start_time, payload = self.read_record()
+
+        if record_type != Replay.RecordType.START:
+            raise ValueError(f"{path} does not start with a game")
+
+        start = json.loads(payload)
+        self.cards = [tuple(card) for card in start["cards"]]
+        self.players = start["players"]
+        self.n_center_piles = start.get("center_piles", GameState.N_CENTER_PILES)
+
+        # the first keyframe, used when the index is missing
+        self.__first_keyframe = self.__log.tell()
+
+        index_path = path + Replay.INDEX_SUFFIX
+        self.__index = open(index_path, "rb") if os.path.exists(index_path) else None
+
+    def close(self):
+        self.__log.close()
+        if self.__index is not None:
+            self.__index.close()
+
+    def read_record(self):
+        # returns None at the end of the log, including when the last record was cut short by a crash
+        header = self.__log.read(Replay.RECORD_HEADER.size)
+        if len(header) < Replay.RECORD_HEADER.size:
+            return None
+
+        record_type, timestamp, length = Replay.RECORD_HEADER.unpack(header)
+
+        payload = self.__log.read(length)
+        if len(payload) < length:
+            return None
+
+        return record_type, timestamp, payload
+
+    def index_entries(self):
+        if self.__index is None:
+            return 0
+
+        self.__index.seek(0, os.SEEK_END)
+        return self.__index.tell() // Replay.INDEX_ENTRY.size
+
+    def index_entry(self, i):
+        self.__index.seek(i * Replay.INDEX_ENTRY.size)
+        return Replay.INDEX_ENTRY.unpack(self.__index.read(Replay.INDEX_ENTRY.size))
+
+    def keyframe_offset(self, move):
+        # binary search of the index for the last keyframe at or before move; only O(log n) entries are read
+        lo, hi = 0, self.index_entries()
+
+        if hi == 0:
+            return self.__first_keyframe
+
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.index_entry(mid)[0] <= move:
+                lo = mid
+            else:
+                hi = mid
+
+        return self.index_entry(lo)[1]
+
+    def play(self, offset=None):
+        # yields (move number, timestamp, player, message, state) after each move, as fast as they can be applied
+        self.__log.seek(self.__first_keyframe if offset is None else offset)
+
+        moves = 0
+        state = None
+
+        while (record := self.read_record()) is not None:
+            record_type, timestamp, payload = record
+
+            if record_type == Replay.RecordType.KEYFRAME:
+                moves, state = ReplayReader.decode_keyframe(payload)
+
+            elif record_type == Replay.RecordType.MOVE:
+                player = Replay.MOVE_HEADER.unpack_from(payload)[0]
+                message = payload[Replay.MOVE_HEADER.size:].decode("utf-8")
+
+                state.apply_instruction(*parse_instruction(message))
+                moves += 1
+
+                yield moves, timestamp, player, message, state
+
+            elif record_type == Replay.RecordType.END:
+                return
+
+    @staticmethod
+    def decode_keyframe(payload):
+        moves = Replay.KEYFRAME_HEADER.unpack_from(payload)[0]
+        return moves, GameState.from_dict(json.loads(payload[Replay.KEYFRAME_HEADER.size:]))
+
+    def seek(self, move):
+        # the state of the table after the given number of moves (or at the end of the game, if it is shorter),
+        # replayed from the nearest keyframe
+        offset = self.keyframe_offset(move)
+
+        self.__log.seek(offset)
+        moves, state = ReplayReader.decode_keyframe(self.read_record()[2])
+
+        if moves < move:
+            for moves, _, _, _, state in self.play(offset):
+                if moves >= move:
+                    break
+
+        return moves, state
+
+
+def describe(state, players):
+    lines = [f"Turn {state.turn}, {players[state.current_player()]} to move"]
+
+    for p in range(state.n_players):
+        face_up = state.face_up(p)
+        top = f"{face_up[-1][1]} of {face_up[-1][0]}" if face_up else "nothing"
+
+        lines.append(f"  {players[p]:<16} {len(state.face_down(p)):3} face down, {len(face_up):3} face up "
+                     f"(showing {top})" + (", finished" if state.has_finished(p) else ""))
+
+    for deck_id in state.center_pile_ids():
+        pile = state.decks[deck_id]
+        lines.append(f"  center pile {deck_id - 2 * state.n_players}: " +
+                     (f"{pile[0][0]} {pile[0][1]}-{pile[-1][1]}" if pile else "empty"))
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded Mongoose game without a window.")
+    parser.add_argument("path", help="the replay log written by the server")
+    parser.add_argument("-s", "--seek", type=int, help="show the table after this many moves")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every move as it is replayed")
+    args = parser.parse_args()
+
+    replay = ReplayReader(args.path)
+    players = [name for name, _ in replay.players]
+
+    start = time.perf_counter()
+
+    if args.seek is not None:
+        moves, state = replay.seek(args.seek)
+        print(f"Sought to move {moves} in {(time.perf_counter() - start) * 1e3:.2f}ms")
+    else:
+        moves, state = 0, GameState(replay.cards, len(players), replay.n_center_piles)
+        timestamp = replay.start_time
+
+        for moves, timestamp, player, message, state in replay.play():
+            if args.verbose:
+                print(f"{moves:6} +{timestamp - replay.start_time:8.2f}s {players[player]:<16} {message}")
+
+        elapsed = time.perf_counter() - start
+        print(f"Replayed {moves} moves ({timestamp - replay.start_time:.1f}s of play) in {elapsed * 1e3:.2f}ms")
+
+    print(describe(state, players))
+
+    replay.close()
+
+
+if __name__ == "__main__":
+    main()
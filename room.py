@@ -0,0 +1,75 @@
+import time
+from instructions import Instruction
+from model import GameState
+from spectators import SpectatorFanout
+
+
+class Room:
+    CARDS_PER_DECK = 52
+
+    def __init__(self, room_id, players, cards, n_center_piles=GameState.N_CENTER_PILES):
+        self.room_id = room_id
+
+        # [name, seat] for each player and the deck as it was dealt, which rejoining players are sent again
+        self.players = players
+        self.dealt_cards = cards
+        self.n_center_piles = n_center_piles
+
+        self.state = GameState(cards, len(players), n_center_piles)
+
+        # addresses of the players at the table who are still connected
+        self.clients = []
+        # players who have dropped out, by name, and the seats they will get back
+        self.awaiting_rejoin = {}
+
+        self.replay = None
+        self.spectators = SpectatorFanout()
+
+    @staticmethod
+    def from_snapshot(data):
+        room = Room(data["room"], data["players"], [tuple(card) for card in data["cards"]],
+                    data.get("center_piles", GameState.N_CENTER_PILES))
+        room.state = GameState.from_dict(data["state"])
+
+        # nobody is connected any more, so whatever they were holding goes back where it came from
+        for seat in range(room.state.n_players):
+            room.state.return_held(seat)
+
+        room.awaiting_rejoin = {name: seat for name, seat in room.players}
+
+        return room
+
+    def snapshot(self):
+        return {
+            "room": self.room_id,
+            "time": time.time(),
+            "cards": self.dealt_cards,
+            "center_piles": self.n_center_piles,
+            "players": self.players,
+            "state": self.state.to_dict(),
+        }
+
+    def table_messages(self, seat):
+        # the size of the table, the dealt deck and the seating, which is what a client needs to set up the game
+        n_decks = len(self.dealt_cards) // Room.CARDS_PER_DECK
+        deck_str = ":".join(f"'{GameState.encode_card(card)}'" for card in self.dealt_cards)
+        p_names = ":".join(f"'{name}':'{player_seat}'" for name, player_seat in self.players)
+
+        return [f"{Instruction.Game.TABLE}:'{n_decks}':'{self.n_center_piles}'",
+                f"{Instruction.Game.SEND_DECK}:{deck_str}", f"{Instruction.START_GAME}:'{seat}':{p_names}"]
+
+    def sync_message(self):
+        return f"{Instruction.Game.SYNC_STATE}:" + ":".join(f"'{o}'" for o in self.state.sync_operands())
+
+    def spectator_snapshot(self):
+        # the public view of the table which spectators are sent when they join, and then kept up to date from
+        operands = [str(self.state.turn), str(self.state.n_players)]
+        operands.extend(name for name, _ in self.players)
+        operands.extend(self.state.public_operands())
+
+        return f"{Instruction.Spectate.SNAPSHOT}:" + ":".join(f"'{o}'" for o in operands)
+
+    def close(self):
+        if self.replay is not None:
+            self.replay.close()
+            self.replay = None
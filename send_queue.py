@@ -0,0 +1,46 @@
+from collections import deque
+from instructions import Instruction
+
+
+class SendQueue:
+    class Lane:
+        GAME = 0
+        CHAT = 1
+
+    # messages which are only for show, and so wait behind everything else. The order within each lane is kept.
+    CHAT_INSTRUCTIONS = frozenset((Instruction.Update.CHAT_MESSAGE, Instruction.Update.PLAYER_JOINED))
+    # past this much chat waiting for a client who is not keeping up, the oldest is dropped
+    MAX_CHAT_BACKLOG = 64
+
+    def __init__(self):
+        # (message, instruction, queued_at) in each lane
+        self.lanes = (deque(), deque())
+
+    def __len__(self):
+        return len(self.lanes[SendQueue.Lane.GAME]) + len(self.lanes[SendQueue.Lane.CHAT])
+
+    def append(self, item):
+        # returns whatever had to be dropped to make room, if anything
+        if item[1] not in SendQueue.CHAT_INSTRUCTIONS:
+            self.lanes[SendQueue.Lane.GAME].append(item)
+            return None
+
+        chat = self.lanes[SendQueue.Lane.CHAT]
+        dropped = chat.popleft() if len(chat) >= SendQueue.MAX_CHAT_BACKLOG else None
+        chat.append(item)
+
+        return dropped
+
+    def take(self, max_chat):
+        # everything in the game lane, then at most max_chat messages of chat, so that a burst of chat cannot hold up
+        # the next flush of moves
+        game, chat = self.lanes
+
+        while game:
+            yield game.popleft()
+
+        for _ in range(max_chat):
+            if game or not chat:
+                return
+
+            yield chat.popleft()
@@ -1,41 +1,172 @@
+import os
+import itertools
 import socket
 import threading
-import select
+import selectors
 import time
-from message import Message
-from instructions import Instruction
-from cards import Deck
+from collections import deque, OrderedDict
+from message import Message, MessageStream
+from instructions import Instruction, instruction_opcodes, parse_instruction
+from model import Deck, GameState
+from replay import ReplayWriter
+from snapshot import SnapshotWriter
+from spectators import SpectatorFanout
+from send_queue import SendQueue
+from matchmaking import MatchmakingQueue
+from room import Room
+from rate_limit import RateLimiter
+from loopback import LoopbackSocket
+from profiling import LoopProfiler
+from metrics import LatencyHistogram, MovingAverage, ServerMetrics, format_duration
 
 
 class Server:
     MAX_CONCURRENT_REQUESTS = 4
+    # connections the OS holds for the listen thread; when full, new clients stall for a second or more on retries
+    LISTEN_BACKLOG = 128
     UPDATE_FREQUENCY = 1000
     SEND_RATE = 50
+    PING_INTERVAL = 2.0
+    # how often the rooms which have changed are snapshotted; each is written at most once in this time
+    SNAPSHOT_INTERVAL = 1.0
+    REAP_INTERVAL = 1.0
+    # players answer every ping, so one who has been silent for a few of them has gone without closing the connection
+    IDLE_TIMEOUT = 10.0
+    # how long a restored game waits for its players to reconnect before it is given up on
+    REJOIN_TIMEOUT = 120.0
+    # a blocking send to a client who has stopped reading gives up after this long, rather than stalling the loop
+    SEND_TIMEOUT = 2.0
+    METRICS_REQUEST_TIMEOUT = 5.0
+    RECV_SIZE = 4096
+    METRICS_REQUEST_LIMIT = 8192
+    # chat sent to each client per pass of the loop, once all of its game messages have gone
+    MAX_CHAT_PER_FLUSH = 8
+
+    TIMING_PHASES = ("parse", "apply", "enqueue", "flush")
+
+    # (messages per second, burst) of each instruction a connection may send, checked before the message is parsed.
+    # Moves are only loosely limited, as each one is checked against the table anyway; None leaves an instruction
+    # unlimited.
+    RATE_LIMITS = {
+        Instruction.Update.CHAT_MESSAGE: (1.0, 5),
+        Instruction.SET_PROPERTY: (2.0, 10),
+        Instruction.Update.PONG: (2.0, 5),
+        Instruction.Update.QUIT_GAME: (1.0, 2),
+        **{move: (100.0, 200) for move in GameState.MOVES},
+    }
+    # for anything else, which clients have no reason to send
+    DEFAULT_RATE_LIMIT = (5.0, 10)
+    # instructions outside the protocol are counted and timed together under this, so that a client sending junk
+    # cannot grow the metrics without bound
+    UNKNOWN_INSTRUCTION = "unknown"
+    KNOWN_INSTRUCTIONS = instruction_opcodes()
+    # how many operands each instruction other than a move comes with; moves are checked against the table
+    OPERAND_COUNTS = {Instruction.SET_PROPERTY: 2, Instruction.Update.CHAT_MESSAGE: 1, Instruction.Update.PONG: 1}
 
     class Flags:
         SHUTDOWN_SERVER = 1
 
-    def __init__(self, address, verbose=True):
+    def __init__(self, address, verbose=True, metrics_port=None, replay_dir=None, snapshot_path=None,
+                 table_size=4, min_table_size=2, max_queue_wait=30.0, idle_timeout=IDLE_TIMEOUT,
+                 rejoin_timeout=REJOIN_TIMEOUT, decks=None, center_piles=None, rate_limits=None, unix_path=None):
         self.ip, self.port = address
 
         self.verbose = verbose
 
+        # the decks and center piles each game is played with; None picks them from the number of players
+        self.decks = decks
+        self.center_piles = center_piles
+
+        self.idle_timeout = idle_timeout
+        self.rejoin_timeout = rejoin_timeout
+
+        # overrides for any of RATE_LIMITS
+        self.rate_limits = {**Server.RATE_LIMITS, **(rate_limits or {})}
+
+        # a replay log of each game is written here, when given
+        self.replay_dir = replay_dir
+
         self.sock = self.setup_socket()
+        # clients on the same host can also connect through a Unix socket, when given, which skips the TCP stack
+        self.unix_path = unix_path
+        self.unix_sock = self.setup_unix_socket(unix_path) if unix_path is not None else None
+        # clients of a Unix socket or a loopback connection have no address of their own, so they are given one
+        self.__local_ids = itertools.count()
+        # loopback connections which have been written to since they were last read, appended to from the clients'
+        # threads
+        self.__loopback_ready = deque()
+
+        # select() cannot wait on more than 1024 sockets, so everything the loop reads from is registered here
+        self.__selector = selectors.DefaultSelector()
+
+        self.metrics = ServerMetrics()
+        self.metrics_sock = self.setup_metrics_socket(metrics_port) if metrics_port is not None else None
+        # partially read HTTP requests on the metrics endpoint, with when they were opened
+        self.__metrics_requests = {}
+
+        if self.metrics_sock is not None:
+            self.__selector.register(self.metrics_sock, selectors.EVENT_READ, "metrics")
 
         self.__flags = 0
 
         self.__inst_queue = []
 
-        self.__client_sockets = []
+        # the sockets of connected players by address; spectators are kept with their rooms
+        self.__client_sockets = {}
+        # remembered at accept time, since getpeername() fails once the other end has gone
+        self.__client_addresses = {}
         self.__client_info = {}
+        # when each player was last heard from, least recent first, so the reaper only looks at those who have
+        # timed out
+        self.__last_seen = OrderedDict()
 
         self.__client_send_queue = {}
-
-        self.__game_running = False
+        self.__client_streams = {}
+        self.__rate_limiters = {}
+        # players with something in their send queue, so that flushing does not visit every idle connection
+        self.__pending_sends = set()
 
         self.__curr_client_id = 0
 
-        self.__decks = []
+        # players waiting for a game, who are seated at new tables as the queue fills up
+        self.__lobby = MatchmakingQueue(table_size, min_table_size, max_queue_wait, self.metrics.queue_wait)
+
+        self.__rooms = {}
+        self.__client_rooms = {}
+        self.__next_room_id = 0
+        # players who have dropped out of a room, by name, so that they can reconnect into it
+        self.__rejoin_rooms = {}
+        # rooms with nobody connected to them, restored or left by everyone at once, with when that started. They are
+        # closed if nobody has reconnected within the rejoin timeout.
+        self.__unclaimed_rooms = {}
+
+        # spectators are served separately from the players, room by room. Those who arrive before any game has
+        # started wait here for the next one.
+        self.__spectator_rooms = {}
+        self.__waiting_spectators = SpectatorFanout()
+
+        # latency histograms keyed by instruction, then by phase
+        self.__timings = {}
+        self.__enqueue_time = 0.0
+        self.__rtt_histogram = LatencyHistogram()
+
+        # CPU and memory profiles of the live loop, started from the console
+        self.__profiler = LoopProfiler("server")
+
+        self.__ping_seq = 0
+        self.__last_ping_time = time.perf_counter()
+        self.__last_reap_time = time.perf_counter()
+
+        # running games are snapshotted to disk, so that a restarted server can pick them up again. Rooms are only
+        # marked as changed on each move, and snapshotted every so often, so that only the rooms which have changed
+        # are copied and written.
+        self.__snapshots = None
+        self.__changed_rooms = set()
+        self.__last_snapshot_time = time.perf_counter()
+
+        if snapshot_path is not None:
+            self.restore_snapshot(snapshot_path)
+            self.__snapshots = SnapshotWriter(snapshot_path)
 
     def setup_socket(self):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -48,17 +179,49 @@ class Server:
 
         return s
 
-    def start_server(self):
-        self.sock.listen(Server.MAX_CONCURRENT_REQUESTS)
+    def setup_unix_socket(self, path):
+        # a socket file left behind by a server which did not shut down cleanly would stop the bind
+        if os.path.exists(path):
+            os.unlink(path)
+
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(path)
+
+        if self.verbose:
+            print(f"Set up socket on {path}.")
+
+        return s
+
+    def setup_metrics_socket(self, metrics_port):
+        # only ever bound to loopback; the metrics are for the host's own monitoring
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        s.bind(("127.0.0.1", metrics_port))
+        s.listen(Server.MAX_CONCURRENT_REQUESTS)
+        s.setblocking(False)
+
+        if self.verbose:
+            print(f"Serving metrics on http://127.0.0.1:{s.getsockname()[1]}/metrics.")
+
+        return s
+
+    def start_server(self, console=True):
+        listeners = [self.sock] if self.unix_sock is None else [self.sock, self.unix_sock]
+
+        for s in listeners:
+            s.listen(Server.LISTEN_BACKLOG)
 
         if self.verbose:
             print("Starting server...")
             self.__inst_queue.append(lambda: print("Server started successfully."))
 
-        listen_t = threading.Thread(target=self.listen, daemon=True)
-        console_t = threading.Thread(target=self.console, daemon=True)
+        listen_threads = [threading.Thread(target=self.listen, args=(s,), daemon=True) for s in listeners]
+        # without a console, the server runs until stop_server() is called
+        console_t = threading.Thread(target=self.console if console else lambda: None, daemon=True)
 
-        listen_t.start()
+        for t in listen_threads:
+            t.start()
         console_t.start()
 
         self.run()
@@ -66,8 +229,23 @@ class Server:
         if self.verbose:
             print("Shutting down server...")
 
-        self.sock.close()
-        listen_t.join(1)
+        # the last moves of each game are kept for when the server comes back
+        self.write_snapshots()
+
+        for room in self.__rooms.values():
+            room.close()
+
+        if self.__snapshots is not None:
+            self.__snapshots.close()
+
+        for s in listeners:
+            s.close()
+        if self.unix_sock is not None:
+            os.unlink(self.unix_path)
+        if self.metrics_sock is not None:
+            self.metrics_sock.close()
+        for t in listen_threads:
+            t.join(1)
         console_t.join(0.1)
 
         if self.verbose:
@@ -75,231 +253,814 @@ class Server:
 
     def run(self):
         while not self.__flags & Server.Flags.SHUTDOWN_SERVER:
+            iteration_start = time.perf_counter()
+
             while self.__inst_queue:
                 self.__inst_queue.pop(0)()
 
             self.handle_client_channels()
 
-    def listen(self):
+            self.match_players()
+
+            if iteration_start - self.__last_ping_time >= Server.PING_INTERVAL:
+                self.send_pings()
+
+            if iteration_start - self.__last_reap_time >= Server.REAP_INTERVAL:
+                self.reap_connections()
+
+            if iteration_start - self.__last_snapshot_time >= Server.SNAPSHOT_INTERVAL:
+                self.write_snapshots()
+
+            if self.__profiler.running():
+                report = self.__profiler.poll()
+                if report is not None:
+                    print(report)
+
+            self.metrics.loop_time.record(time.perf_counter() - iteration_start)
+
+    def listen(self, sock):
         while not self.__flags & Server.Flags.SHUTDOWN_SERVER:
             try:
-                client_socket, address = self.sock.accept()
+                client_socket, address = sock.accept()
             except socket.timeout:
                 pass
             except Exception as e:
                 raise e
             else:
-                self.__inst_queue.append(lambda: self.accept_new_client(client_socket, address))
+                if sock.family == socket.AF_UNIX:
+                    address = ("unix", next(self.__local_ids))
+
+                self.__inst_queue.append(lambda c=client_socket, a=address: self.accept_new_client(c, a))
+
+    def connect_loopback(self, deliver):
+        # connects a client in this process with no socket in between. deliver is called with everything the server
+        # sends the client, from the server's thread; the client writes to the returned LoopbackSocket.
+        sock = LoopbackSocket(deliver, self.__loopback_ready)
+        address = ("loopback", next(self.__local_ids))
+
+        self.__inst_queue.append(lambda: self.accept_new_client(sock, address))
+
+        return sock
 
     def accept_new_client(self, client_socket, address):
+        self.metrics.accepted_connections += 1
+
         if self.verbose:
             print(f"Connection from {':'.join(map(str, address))}")
 
-        if self.__game_running:
-            print("Rejecting client; game already running.")
-            client_socket.sendall(Message.new_send_message(Instruction.Update.GAME_RUNNING.encode("utf-8")).encode())
-            client_socket.close()
+        client_socket.settimeout(Server.SEND_TIMEOUT)
 
-            return
+        # clients are put into the lobby, or back into their room, once they have said who they are
+        self.__client_sockets[address] = client_socket
+        self.__client_addresses[client_socket] = address
 
-        self.__client_sockets.append(client_socket)
+        self.__client_info[address] = {"id": self.__curr_client_id}
+        self.__last_seen[address] = time.perf_counter()
+        self.__client_send_queue[address] = SendQueue()
+        self.__client_streams[address] = MessageStream()
+        self.__rate_limiters[address] = RateLimiter(self.rate_limits, Server.DEFAULT_RATE_LIMIT)
 
-        self.__client_info[client_socket.getpeername()] = {"id": self.__curr_client_id}
-        self.__client_send_queue[client_socket.getpeername()] = []
+        # loopback connections are read from when they are written to, rather than through the selector. Anything
+        # written before now is read on the next pass.
+        if isinstance(client_socket, LoopbackSocket):
+            self.__loopback_ready.append(client_socket)
+        else:
+            self.__selector.register(client_socket, selectors.EVENT_READ)
 
         self.__curr_client_id += 1
 
     def handle_client_channels(self):
-        # read any incoming requests from the clients
-        read_sockets, _, _ = select.select(self.__client_sockets, [], [], 1 / Server.UPDATE_FREQUENCY)
+        # read any incoming requests from the clients. Nothing waits on the selector while a loopback connection has
+        # something to read.
+        timeout = 0 if self.__loopback_ready else 1 / Server.UPDATE_FREQUENCY
+        ready = [(key.fileobj, key.data) for key, _ in self.__selector.select(timeout)]
 
-        for s in read_sockets:
-            message = Message.new_recv_message()
+        while self.__loopback_ready:
+            ready.append((self.__loopback_ready.popleft(), None))
 
-            buffer = s.recv(Message.BUFFER_SIZE)
+        for s, data in ready:
+            if data is not None:
+                self.handle_metrics_request(s, data)
+                continue
 
-            if not buffer:
-                if self.verbose:
-                    print(f"{s.getpeername()[0]} disconnected.")
+            # the client may have been dropped while handling an earlier socket
+            if s not in self.__client_addresses:
+                continue
 
-                self.__client_sockets.remove(s)
-                del self.__client_send_queue[s.getpeername()]
+            try:
+                buffer = s.recv(Server.RECV_SIZE)
+            except BlockingIOError:
+                continue
+            except OSError:
+                buffer = b""
+
+            if not buffer:
+                self.disconnect_client(s)
                 continue
 
-            while not message.decode(buffer):
-                buffer = s.recv(Message.BUFFER_SIZE)
+            address = self.__client_addresses[s]
 
-            self.decode_instruction(s.getpeername(), message.message.decode("utf-8"))
+            if address in self.__last_seen:
+                self.__last_seen[address] = time.perf_counter()
+                self.__last_seen.move_to_end(address)
+
+            for message in self.__client_streams[address].feed(buffer):
+                self.decode_instruction(address, message.message.decode("utf-8"))
 
         # send any outgoing messages to the clients
-        for s in self.__client_sockets:
-            while self.__client_send_queue[s.getpeername()]:
-                message = self.__client_send_queue[s.getpeername()].pop(0)
+        pending_sends = self.__pending_sends
+        self.__pending_sends = set()
+
+        for address in pending_sends:
+            if address not in self.__client_sockets:
+                continue
+
+            s = self.__client_sockets[address]
+            send_queue = self.__client_send_queue[address]
 
-                s.sendall(message.encode())
+            for message, instruction, queued_at in send_queue.take(Server.MAX_CHAT_PER_FLUSH):
+                encoded = message.encode()
+
+                try:
+                    s.sendall(encoded)
+                except OSError:
+                    self.disconnect_client(s)
+                    break
+
+                self.metrics.count_out(instruction, len(encoded))
+
+                self.record_timing(instruction, "flush", time.perf_counter() - queued_at)
 
                 # if self.__client_send_queue[s.getpeername()]:
                 #     time.sleep(1.0 / Server.SEND_RATE)
 
+            # whatever chat is left over goes out on the next pass
+            if address in self.__client_sockets and send_queue:
+                self.__pending_sends.add(address)
+
+        for room in list(self.__rooms.values()):
+            if len(room.spectators):
+                for s in room.spectators.flush(room.spectator_snapshot):
+                    self.disconnect_client(s)
+
+        for s in self.__waiting_spectators.flush(lambda: None):
+            self.disconnect_client(s)
+
+    def disconnect_client(self, s):
+        address = self.__client_addresses.pop(s)
+
+        if not isinstance(s, LoopbackSocket):
+            self.__selector.unregister(s)
+        del self.__client_streams[address]
+        del self.__rate_limiters[address]
+        s.close()
+
+        if address in self.__spectator_rooms:
+            self.spectator_fanout(address).remove(address)
+            del self.__spectator_rooms[address]
+            return
+
+        info = self.__client_info.pop(address, None)
+
+        if self.verbose:
+            print(f"{address[0]} disconnected.")
+
+        del self.__client_sockets[address]
+        del self.__last_seen[address]
+        del self.__client_send_queue[address]
+        self.__pending_sends.discard(address)
+
+        self.__lobby.remove(address)
+
+        room = self.__client_rooms.pop(address, None)
+
+        if room is None:
+            return
+
+        room.clients.remove(address)
+
+        # a player who drops out without quitting can reconnect into the game under the same name
+        if info is not None and "name" in info:
+            room.awaiting_rejoin[info["name"]] = info["id"]
+            self.__rejoin_rooms[info["name"]] = room.room_id
+
+        # once everyone has left, the table is closed, unless there are players who can still reconnect to a game
+        # which is not over yet; then it waits for them until the rejoin timeout
+        if not room.clients:
+            if room.awaiting_rejoin and not room.state.game_over():
+                self.__unclaimed_rooms[room.room_id] = time.perf_counter()
+            else:
+                self.close_room(room)
+
     def decode_instruction(self, client, message):
-        operands = []
+        start_time = time.perf_counter()
 
-        if ":" in message:
-            instruction, operand = message.split(":", 1)
+        # only the opcode is looked at before the rate limit, so that a flood costs as little as possible
+        instruction = message.partition(":")[0]
 
-            in_string = False
-            cur_operand = ""
+        if instruction not in Server.KNOWN_INSTRUCTIONS:
+            instruction = Server.UNKNOWN_INSTRUCTION
 
-            for c in operand:
-                if c == "'":
-                    in_string = not in_string
-                else:
-                    if in_string:
-                        cur_operand += c
-                    elif c == ":":
-                        operands.append(cur_operand)
-                        cur_operand = ""
+        if not self.__rate_limiters[client].allow(instruction, start_time):
+            self.metrics.count_dropped(instruction)
 
-            operands.append(cur_operand)
-        else:
-            instruction = message
+            # a client predicting its own moves is still told that the move was turned down, so it can take it back
+            if instruction in GameState.MOVES:
+                self.reject_dropped_move(client, instruction, parse_instruction(message)[1])
+            return
+
+        if instruction == Server.UNKNOWN_INSTRUCTION:
+            self.metrics.count_in(instruction, Message.frame_size(len(message.encode("utf-8"))))
+            return
+
+        _, operands = parse_instruction(message)
+
+        parsed_time = time.perf_counter()
+        self.metrics.count_in(instruction, Message.frame_size(len(message.encode("utf-8"))))
+        self.__enqueue_time = 0.0
+
+        # a frame which makes no sense is dropped, and never stops the loop for everyone else
+        if not Server.well_formed(instruction, operands):
+            self.metrics.count_malformed(instruction)
+            return
+
+        try:
+            self.apply_instruction(client, message, instruction, operands)
+        except Exception as e:
+            self.metrics.count_malformed(instruction)
+            if self.verbose:
+                print(f"Failed to apply {message!r} from {client}: {e!r}")
+            return
+
+        apply_time = time.perf_counter() - parsed_time - self.__enqueue_time
+
+        self.record_timing(instruction, "parse", parsed_time - start_time)
+        self.record_timing(instruction, "apply", apply_time)
+        self.record_timing(instruction, "enqueue", self.__enqueue_time)
+
+    def apply_instruction(self, client, message, instruction, operands):
+        # spectators can only watch, and a client who has quit is only waiting to be disconnected
+        if client in self.__spectator_rooms or client not in self.__client_info:
+            return
+
+        room = self.__client_rooms.get(client)
+
+        if instruction in GameState.MOVES:
+            # moves only mean something at a table
+            if room is None:
+                return
+
+            # a move sent with a sequence number is answered, so that the client can tell when its own prediction of
+            # the move has been overtaken by someone else's. It can also carry the hash of the client's table after
+            # the move. Everyone else is sent the move without either.
+            n_operands = GameState.MOVE_OPERANDS[instruction]
+            seq = operands[n_operands] if len(operands) > n_operands else None
+            client_hash = operands[n_operands + 1] if len(operands) > n_operands + 1 else None
+
+            if seq is not None:
+                operands = operands[:n_operands]
+                message = instruction + "".join(f":'{o}'" for o in operands)
+
+            made = self.apply_move(room, client, message, instruction, operands)
+
+            if seq is not None:
+                answer = Instruction.Game.ACK if made else Instruction.Game.REJECT
+                self.enqueue(Message.new_send_message(f"{answer}:'{seq}'".encode("utf-8")), answer, [client])
+
+            # a client whose table has drifted from the server's is sent the whole table straight away, behind the
+            # answer to its move so that its prediction picks up from the right place
+            if made and client_hash is not None and client_hash != format(room.state.state_hash(), "x"):
+                self.metrics.resyncs += 1
+                sync_message = Message.new_send_message(room.sync_message().encode("utf-8"))
+                self.enqueue(sync_message, Instruction.Game.SYNC_STATE, [client])
+
+            # a move which does not fit the table never happened, as far as anyone else is concerned
+            if not made:
+                self.metrics.rejected_moves += 1
+                return
 
         if instruction == Instruction.SET_PROPERTY:
-            assert len(operands) == 2
             self.__client_info[client][operands[0]] = operands[1]
 
-            if operands[0] == "name":
-                player_joined_message = Message.new_send_message(
-                    f"{Instruction.Update.PLAYER_JOINED}:'{operands[1]}'".encode("utf-8")
-                )
+            if operands[0] == "role" and operands[1] == SpectatorFanout.ROLE:
+                self.add_spectator(client)
 
-                for c in self.__client_send_queue:
-                    if c == client:
-                        continue
-                    self.__client_send_queue[c].append(player_joined_message)
+            elif operands[0] == "name" and room is None:
+                if operands[1] in self.__rejoin_rooms:
+                    self.rejoin_room(client, operands[1])
+                else:
+                    self.__lobby.add(client)
 
         if instruction == Instruction.Game.PICKUP_CARD:
             assert len(operands) == 1
 
             pickup_message = Message.new_send_message(message.encode("utf-8"))
 
-            for c in self.__client_send_queue:
-                if c == client:
-                    continue
-                self.__client_send_queue[c].append(pickup_message)
+            self.broadcast(pickup_message, instruction, room.clients, exclude=client)
 
         if instruction == Instruction.Game.PLACE_CARD:
             assert len(operands) == 2
 
-            src_deck = self.__decks[int(operands[0])]
-            dst_deck = self.__decks[int(operands[1])]
-
-            dst_deck.add_card_to_top(src_deck.take_top())
-
             place_message = Message.new_send_message(message.encode("utf-8"))
 
-            for c in self.__client_send_queue:
-                if c == client:
-                    continue
-                self.__client_send_queue[c].append(place_message)
+            self.broadcast(place_message, instruction, room.clients, exclude=client)
 
         if instruction == Instruction.Game.MOVE_ENDED:
             ended_message = Message.new_send_message(Instruction.Game.MOVE_ENDED.encode("utf-8"))
 
-            for c in self.__client_send_queue:
-                if c == client:
-                    continue
-                self.__client_send_queue[c].append(ended_message)
+            self.broadcast(ended_message, instruction, room.clients, exclude=client)
 
         if instruction == Instruction.Game.CALL_MONGOOSE:
             mongoose_message = Message.new_send_message(message.encode("utf-8"))
 
-            for c in self.__client_send_queue:
-                self.__client_send_queue[c].append(mongoose_message)
+            self.broadcast(mongoose_message, instruction, room.clients)
 
         if instruction == Instruction.Update.CHAT_MESSAGE:
             chat_message = Message.new_send_message(message.encode("utf-8"))
 
-            for c in self.__client_send_queue:
-                self.__client_send_queue[c].append(chat_message)
+            # in the lobby, where there may be thousands waiting, chat only goes back to whoever sent it
+            if room is not None:
+                self.broadcast(chat_message, instruction, room.clients)
+                room.spectators.publish(message)
+            else:
+                self.enqueue(chat_message, instruction, [client])
 
         if instruction == Instruction.Game.FLIP_DECK:
             flip_message = Message.new_send_message(message.encode("utf-8"))
 
-            for c in self.__client_send_queue:
-                self.__client_send_queue[c].append(flip_message)
+            self.broadcast(flip_message, instruction, room.clients)
 
         if instruction == Instruction.Update.QUIT_GAME:
+            info = self.__client_info.pop(client, None)
+
+            if self.verbose and info is not None:
+                print(f"Player {info.get('name')} left the game.")
+
+            self.__lobby.remove(client)
+
+        if instruction == Instruction.Update.PONG:
+            self.receive_pong(client, int(operands[0]))
+
+    def reject_dropped_move(self, client, instruction, operands):
+        if len(operands) > GameState.MOVE_OPERANDS[instruction]:
+            seq = operands[GameState.MOVE_OPERANDS[instruction]]
+            self.enqueue(Message.new_send_message(f"{Instruction.Game.REJECT}:'{seq}'".encode("utf-8")),
+                         Instruction.Game.REJECT, [client])
+
+    @staticmethod
+    def well_formed(instruction, operands):
+        n_operands = Server.OPERAND_COUNTS.get(instruction)
+
+        if n_operands is not None and len(operands) != n_operands:
+            return False
+
+        return instruction != Instruction.Update.PONG or operands[0].isdecimal()
+
+    def apply_move(self, room, client, message, instruction, operands):
+        # the server keeps its own copy of each table, so that games can be recorded
+        try:
+            room.state.apply_instruction(instruction, operands)
+        except (IndexError, ValueError):
             if self.verbose:
-                print(f"Player {self.__client_info[client]['name']} left the game.")
-            del self.__client_info[client]
+                print(f"Move {message} does not fit the table in room {room.room_id}; it has been rejected.")
+            return False
 
-    def console(self):
-        while not self.__flags & Server.Flags.SHUTDOWN_SERVER:
-            i = input()
-            if i.lower() in ("q", "quit", "shutdown"):
-                self.__flags |= Server.Flags.SHUTDOWN_SERVER
-                self.__inst_queue.append(lambda: print(f"Shutting down server..."))
-            elif i.lower() in ("h", "help"):
-                self.__inst_queue.append(Server.help)
-            elif i.lower() in ("s", "start"):
-                self.__inst_queue.append(self.start_game)
+        if room.replay is not None:
+            player = self.__client_info.get(client, {}).get("id", -1)
+            room.replay.record_move(player, message, room.state)
 
-    def start_game(self):
-        curr_id = 0
-        for c in self.__client_info:
-            self.__client_info[c]["id"] = curr_id
-            curr_id += 1
+        # spectators cannot see face down cards, so they are told which card was picked up
+        if instruction == Instruction.Game.PICKUP_CARD:
+            card = room.state.held[int(operands[0]) // 2]
+            room.spectators.publish(f"{message}:'{GameState.encode_card(card)}'")
+        else:
+            room.spectators.publish(message)
+
+        self.save_snapshot(room)
+
+        return True
+
+    def match_players(self):
+        now = time.perf_counter()
 
-        p_names = [f"'{self.__client_info[c]['name']}':'{self.__client_info[c]['id']}'" for c in self.__client_info]
+        while n := self.__lobby.ready(now):
+            self.start_game(self.__lobby.take(n, now))
 
-        game_deck = Deck.full()
+    def start_game(self, clients):
+        if not clients:
+            return
+
+        n_decks = self.decks or GameState.decks_for(len(clients))
+        n_center_piles = self.center_piles or GameState.center_piles_for(n_decks)
+
+        game_deck = Deck.full(n_decks)
         game_deck.shuffle()
 
-        suit_map = {"Spades": "0", "Diamonds": "1", "Clubs": "2", "Hearts": "3"}
+        players = [[self.__client_info[c]["name"], seat] for seat, c in enumerate(clients)]
+
+        # the table is dealt from the deck exactly as each client deals it
+        room = Room(self.__next_room_id, players, [(card.suit, card.value, card.deck) for card in game_deck.cards],
+                    n_center_piles)
+        self.__next_room_id += 1
+
+        self.__rooms[room.room_id] = room
+
+        for seat, c in enumerate(clients):
+            self.__client_info[c]["id"] = seat
+            self.__client_rooms[c] = room
+            room.clients.append(c)
+
+            self.send_table(room, c)
+
+        if self.replay_dir is not None:
+            os.makedirs(self.replay_dir, exist_ok=True)
+
+            path = os.path.join(self.replay_dir, f"game-{time.strftime('%Y%m%d-%H%M%S')}-room{room.room_id}.mgr")
+            room.replay = ReplayWriter(path, room.dealt_cards, room.players, room.n_center_piles)
+
+            if self.verbose:
+                print(f"Recording room {room.room_id} to {path}.")
+
+        # anyone waiting to watch a game gets this one
+        for address in list(self.__spectator_rooms):
+            if self.__spectator_rooms[address] is None:
+                self.move_spectator(address, room)
+
+        if self.verbose:
+            print(f"Starting game in room {room.room_id} with: {', '.join(name for name, _ in players)}")
+
+        self.save_snapshot(room)
+
+    def close_room(self, room):
+        # its spectators wait for the next game instead
+        for address in list(self.__spectator_rooms):
+            if self.__spectator_rooms[address] == room.room_id:
+                self.move_spectator(address, None)
+
+        del self.__rooms[room.room_id]
+        self.__unclaimed_rooms.pop(room.room_id, None)
+
+        for name in room.awaiting_rejoin:
+            if self.__rejoin_rooms.get(name) == room.room_id:
+                del self.__rejoin_rooms[name]
+
+        room.close()
+
+        # a finished game is not worth restoring
+        self.__changed_rooms.discard(room.room_id)
+        if self.__snapshots is not None:
+            self.__snapshots.remove(room.room_id)
+
+        if self.verbose:
+            print(f"Room {room.room_id} closed.")
+
+    def rejoin_room(self, client, name):
+        room = self.__rooms[self.__rejoin_rooms.pop(name)]
+        seat = room.awaiting_rejoin.pop(name)
+        self.__unclaimed_rooms.pop(room.room_id, None)
+
+        self.__client_info[client]["id"] = seat
+        self.__client_rooms[client] = room
+        room.clients.append(client)
+
+        if self.verbose:
+            print(f"Player {name} rejoined room {room.room_id}.")
+
+        # whatever they were holding when they dropped out goes back where it came from
+        room.state.return_held(seat)
+
+        self.send_table(room, client)
+
+        # everyone is brought back in line with the server, since the table has changed outside of a move
+        sync_message = Message.new_send_message(room.sync_message().encode("utf-8"))
+        self.broadcast(sync_message, Instruction.Game.SYNC_STATE, room.clients)
+
+        if room.replay is not None:
+            room.replay.write_keyframe(room.state)
+
+        room.spectators.resync_all()
+
+        self.save_snapshot(room)
+
+    def send_table(self, room, client):
+        for text in room.table_messages(self.__client_info[client]["id"]):
+            self.enqueue(Message.new_send_message(text.encode("utf-8")), parse_instruction(text)[0], [client])
+
+    def add_spectator(self, client):
+        room_id = self.__client_info.pop(client).get("room")
+
+        s = self.__client_sockets.pop(client)
+        del self.__last_seen[client]
+        del self.__client_send_queue[client]
+        self.__pending_sends.discard(client)
+        self.__lobby.remove(client)
+
+        self.__spectator_rooms[client] = None
+        self.__waiting_spectators.add(client, s)
+
+        # they watch the room they asked for, or otherwise the newest game
+        if room_id is not None and room_id.isdigit() and int(room_id) in self.__rooms:
+            self.move_spectator(client, self.__rooms[int(room_id)])
+        elif self.__rooms:
+            self.move_spectator(client, self.__rooms[max(self.__rooms)])
+
+        if self.verbose:
+            print(f"{client[0]} is spectating.")
+
+    def spectator_fanout(self, address):
+        room_id = self.__spectator_rooms[address]
+        return self.__waiting_spectators if room_id is None else self.__rooms[room_id].spectators
+
+    def move_spectator(self, address, room):
+        s = self.spectator_fanout(address).remove(address)
+
+        if room is None:
+            self.__waiting_spectators.add(address, s)
+            self.__spectator_rooms[address] = None
+        else:
+            room.spectators.add(address, s)
+            self.__spectator_rooms[address] = room.room_id
+
+    def save_snapshot(self, room):
+        if self.__snapshots is None:
+            return
+
+        self.__changed_rooms.add(room.room_id)
+
+    def write_snapshots(self):
+        self.__last_snapshot_time = time.perf_counter()
+
+        if self.__snapshots is None:
+            return
+
+        # only a copy of each room's table is taken here; it is serialised and written on the snapshot thread
+        for room_id in self.__changed_rooms:
+            self.__snapshots.submit(room_id, self.__rooms[room_id].snapshot())
+
+        self.__changed_rooms.clear()
+
+    def restore_snapshot(self, path):
+        for data in SnapshotWriter.load(path):
+            room = Room.from_snapshot(data)
+
+            self.__rooms[room.room_id] = room
+            self.__unclaimed_rooms[room.room_id] = time.perf_counter()
+            self.__next_room_id = max(self.__next_room_id, room.room_id + 1)
+
+            for name in room.awaiting_rejoin:
+                self.__rejoin_rooms[name] = room.room_id
+
+            if self.verbose:
+                print(f"Restored room {room.room_id} from {path}; waiting for {', '.join(room.awaiting_rejoin)} to "
+                      f"reconnect.")
+
+    def handle_metrics_request(self, s, kind):
+        if kind == "metrics response":
+            self.send_metrics_response(s)
+            return
+
+        if s is self.metrics_sock:
+            try:
+                conn, _ = s.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            self.__metrics_requests[conn] = (b"", time.perf_counter())
+            self.__selector.register(conn, selectors.EVENT_READ, "metrics request")
+            return
+
+        try:
+            data = s.recv(Server.RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        request, opened_at = self.__metrics_requests[s]
+        request += data
+
+        # wait for the rest of the headers, unless the client gave up or is sending far too much
+        if data and b"\r\n\r\n" not in request and len(request) < Server.METRICS_REQUEST_LIMIT:
+            self.__metrics_requests[s] = (request, opened_at)
+            return
+
+        request_line = request.split(b"\r\n", 1)[0].split()
+
+        if len(request_line) >= 2 and request_line[0] == b"GET" and request_line[1] in (b"/", b"/metrics"):
+            status = "200 OK"
+            body = self.metrics.render(self.metrics_gauges()).encode("utf-8")
+        else:
+            status = "404 Not Found"
+            body = b"Not found\n"
+
+        header = f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n" \
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+
+        # the response goes out as fast as the scraper takes it, through the selector, so that a slow one never holds
+        # up the games. The request timeout covers it as well.
+        self.__metrics_requests[s] = (header.encode("utf-8") + body, opened_at)
+        self.__selector.modify(s, selectors.EVENT_WRITE, "metrics response")
+
+    def send_metrics_response(self, s):
+        response, opened_at = self.__metrics_requests[s]
+
+        try:
+            sent = s.send(response)
+        except BlockingIOError:
+            return
+        except OSError:
+            sent = len(response)
+
+        if sent < len(response):
+            self.__metrics_requests[s] = (response[sent:], opened_at)
+            return
+
+        del self.__metrics_requests[s]
+        self.__selector.unregister(s)
+        s.close()
+
+    def metrics_gauges(self):
+        queue_depths = [len(q) for q in self.__client_send_queue.values()]
+
+        return {
+            "mongoose_connected_clients": len(self.__client_sockets),
+            "mongoose_games_running": len(self.__rooms),
+            "mongoose_queue_length": len(self.__lobby),
+            "mongoose_queue_oldest_wait_seconds": self.__lobby.oldest_wait(),
+            "mongoose_send_queue_depth": sum(queue_depths),
+            "mongoose_send_queue_depth_max": max(queue_depths, default=0),
+            "mongoose_instruction_queue_depth": len(self.__inst_queue),
+            "mongoose_spectators": len(self.__spectator_rooms),
+            "mongoose_spectator_backlog_bytes": self.__waiting_spectators.backlog() +
+            sum(room.spectators.backlog() for room in self.__rooms.values()),
+        }
+
+    def broadcast(self, message, instruction, clients, exclude=None):
+        self.enqueue(message, instruction, [c for c in clients if c != exclude])
+
+    def enqueue(self, message, instruction, clients):
+        queued_at = time.perf_counter()
+
+        for c in clients:
+            dropped = self.__client_send_queue[c].append((message, instruction, queued_at))
+
+            if dropped is not None:
+                self.metrics.count_shed(dropped[1])
+            self.__pending_sends.add(c)
+
+        self.__enqueue_time += time.perf_counter() - queued_at
+
+    def record_timing(self, instruction, phase, seconds):
+        if instruction not in self.__timings:
+            self.__timings[instruction] = {p: LatencyHistogram() for p in Server.TIMING_PHASES}
+        self.__timings[instruction][phase].record(seconds)
+
+    def send_pings(self):
+        self.__last_ping_time = time.perf_counter()
+        self.__ping_seq += 1
 
-        deck_str = ":".join([f"'{suit_map[card.suit]}-{card.value}'" for card in game_deck.cards])
+        ping_message = Message.new_send_message(f"{Instruction.Update.PING}:'{self.__ping_seq}'".encode("utf-8"))
 
-        send_deck = f"{Instruction.Game.SEND_DECK}:{deck_str}"
+        for c in self.__client_info:
+            self.__client_info[c]["ping"] = (self.__ping_seq, self.__last_ping_time)
+
+        self.enqueue(ping_message, Instruction.Update.PING, list(self.__client_send_queue))
+
+    def reap_connections(self):
+        now = time.perf_counter()
+        self.__last_reap_time = now
+
+        # players who have not answered a ping in this long are treated as if they had disconnected, so anyone who
+        # was in a game can still reconnect to it
+        while self.__last_seen:
+            address, last_seen = next(iter(self.__last_seen.items()))
+
+            if now - last_seen < self.idle_timeout:
+                break
+
+            if self.verbose:
+                print(f"{address[0]} timed out.")
+
+            self.metrics.timed_out_connections += 1
+            self.disconnect_client(self.__client_sockets[address])
+
+        for room_id, unclaimed_at in list(self.__unclaimed_rooms.items()):
+            if now - unclaimed_at >= self.rejoin_timeout:
+                if self.verbose:
+                    print(f"Nobody reconnected to room {room_id}.")
+
+                self.close_room(self.__rooms[room_id])
+
+        for s, (_, opened_at) in list(self.__metrics_requests.items()):
+            if now - opened_at >= Server.METRICS_REQUEST_TIMEOUT:
+                del self.__metrics_requests[s]
+                self.__selector.unregister(s)
+                s.close()
+
+    def receive_pong(self, client, seq):
+        if client not in self.__client_info:
+            return
+
+        info = self.__client_info[client]
 
-        for c in self.__client_sockets:
-            self.__client_send_queue[c.getpeername()].append(Message.new_send_message(send_deck.encode("utf-8")))
+        # only the most recent ping is tracked; a late reply to an older one is ignored
+        if "ping" not in info or info["ping"][0] != seq:
+            return
+
+        rtt = time.perf_counter() - info["ping"][1]
+
+        if "rtt" not in info:
+            info["rtt"] = MovingAverage()
+        info["rtt"].update(rtt)
+
+        self.__rtt_histogram.record(rtt)
 
-            c_id = self.__client_info[c.getpeername()]["id"]
-            message_text = Instruction.START_GAME + f":'{c_id}':" + ":".join(p_names)
+    def timing_report(self):
+        lines = ["Instruction timings:"]
 
-            message = Message.new_send_message(message_text.encode("utf-8"))
-            self.__client_send_queue[c.getpeername()].append(message)
+        for instruction in sorted(self.__timings):
+            for phase, histogram in self.__timings[instruction].items():
+                if histogram.count:
+                    lines.append(f"  {instruction:<12} {phase:<8} {histogram.summary()}")
 
-        player_decks = game_deck.deal(len(self.__client_sockets))
+        lines.append(f"Matchmaking queue wait times: {self.metrics.queue_wait.summary()}")
+        lines.append(f"Client round trip times: {self.__rtt_histogram.summary()}")
 
-        # setup the decks in the order that each player will hold their IDs
-        for d in player_decks:
-            self.__decks.append(d)
-            self.__decks.append(Deck.empty())
+        for c, info in self.__client_info.items():
+            rtt = info.get("rtt")
+            average = "n/a" if rtt is None else format_duration(rtt.value)
+            lines.append(f"  {info.get('name', ':'.join(map(str, c)))}: {average}")
 
-        for i in range(4):
-            self.__decks.append(Deck.empty())
+        return "\n".join(lines)
 
-        self.__inst_queue.append(lambda: print(f"Starting game with: {', '.join(p_names)}"))
+    def dump_timings(self, path):
+        with open(path, "w") as f:
+            f.write(self.timing_report() + "\n")
 
-        self.__game_running = True
+        print(f"Timings written to {path}.")
+
+    def console(self):
+        while not self.__flags & Server.Flags.SHUTDOWN_SERVER:
+            i = input()
+            if i.lower() in ("q", "quit", "shutdown"):
+                self.__flags |= Server.Flags.SHUTDOWN_SERVER
+                self.__inst_queue.append(lambda: print(f"Shutting down server..."))
+            elif i.lower() in ("h", "help"):
+                self.__inst_queue.append(Server.help)
+            elif i.lower() in ("s", "start"):
+                self.__inst_queue.append(lambda: self.start_game(self.__lobby.take(self.__lobby.table_size)))
+            elif i.lower() in ("t", "timings"):
+                self.__inst_queue.append(lambda: print(self.timing_report()))
+            elif i.lower().startswith("dump "):
+                path = i.split(" ", 1)[1].strip()
+                self.__inst_queue.append(lambda: self.dump_timings(path))
+            elif i.lower().split()[:1] == ["profile"]:
+                args = i.split()[1:]
+                if args and args[0].replace(".", "", 1).isdigit():
+                    path = args[1] if len(args) > 1 else None
+                    # started from the loop, since cProfile only sees the thread it was started on
+                    self.__inst_queue.append(lambda: print(self.__profiler.start(float(args[0]), path)))
+                else:
+                    print("Usage: profile <seconds> [file]")
+            elif i.lower() == "mem":
+                self.__inst_queue.append(lambda: print(self.__profiler.snapshot()))
+            elif i.lower() == "mem off":
+                self.__inst_queue.append(lambda: print(self.__profiler.stop_snapshots()))
 
     @staticmethod
     def help():
         print("q, quit, shutdown - Shutdown the server")
-        print("s, start - Start the game")
+        print("s, start - Start a game now with the longest waiting players")
+        print("t, timings - Show per-instruction latencies and client round trip times")
+        print("dump <file> - Write the timings to a file")
+        print("profile <seconds> [file] - Profile the server loop and write the .pstats to a file")
+        print("mem - Show what has been allocated since the last mem, starting allocation tracing the first time")
+        print("mem off - Stop tracing allocations")
         print("h, help - Show the help message")
 
     def stop_server(self):
-        self.sock.close()
+        self.__flags |= Server.Flags.SHUTDOWN_SERVER
 
 
 def main():
     # this user has run the server script directly, so they are intending to host
     ip = input("Enter host IP> ")
     port = int(input("Enter host port> "))
-    server = Server((ip, port))
+    unix_path = input("Enter Unix socket path (blank for none)> ")
+    metrics_port = input("Enter metrics port (blank for none)> ")
+    replay_dir = input("Enter replay directory (blank for none)> ")
+    snapshot_path = input("Enter snapshot directory (blank for none)> ")
+    table_size = input("Enter players per table (blank for 4)> ")
+    decks = input(f"Enter decks per table (blank for one per {GameState.PLAYERS_PER_DECK} players)> ")
+    center_piles = input(f"Enter center piles (blank for {GameState.N_CENTER_PILES} per deck)> ")
+    chat_rate, chat_burst = Server.RATE_LIMITS[Instruction.Update.CHAT_MESSAGE]
+    chat_limit = input(f"Enter chat messages per second and burst (blank for {chat_rate:g} {chat_burst})> ").split()
+    server = Server((ip, port), metrics_port=int(metrics_port) if metrics_port else None, unix_path=unix_path or None,
+                    replay_dir=replay_dir or None, snapshot_path=snapshot_path or None,
+                    table_size=int(table_size) if table_size else 4, decks=int(decks) if decks else None,
+                    center_piles=int(center_piles) if center_piles else None,
+                    rate_limits={Instruction.Update.CHAT_MESSAGE: (float(chat_limit[0]), int(chat_limit[1]))}
+                    if chat_limit else None)
     server.start_server()
 
 
@@ -0,0 +1,148 @@
+import socket
+import select
+import threading
+import time
+from collections import deque
+from message import Message, MessageStream
+from instructions import Instruction
+
+
+class ServerConnection:
+    RECV_SIZE = 4096
+    # the server pings every couple of seconds, so hearing nothing for this long means it has gone
+    IDLE_TIMEOUT = 10.0
+
+    def __init__(self, client_socket, idle_timeout=IDLE_TIMEOUT):
+        # the socket belongs to the I/O thread from here on; everything else goes through the queues
+        self.client_socket = client_socket
+        self.client_socket.setblocking(True)
+
+        # None waits on the server forever
+        self.idle_timeout = idle_timeout
+
+        self.connected = True
+        self.error = None
+
+        # deque appends and pops are atomic, so the two threads share these without a lock
+        self.__inbound = deque()
+        self.__outbound = deque()
+
+        # wakes the I/O thread when there is something to send or the connection is closing
+        self.__wake_r, self.__wake_w = socket.socketpair()
+        # becomes readable when messages arrive, so the render loop can select() on this connection
+        self.__notify_r, self.__notify_w = socket.socketpair()
+
+        for s in (self.__wake_r, self.__wake_w, self.__notify_r, self.__notify_w):
+            s.setblocking(False)
+
+        self.__closing = False
+
+        self.__io_thread = threading.Thread(target=self.__io_loop, daemon=True)
+        self.__io_thread.start()
+
+    def fileno(self):
+        return self.__notify_r.fileno()
+
+    def send(self, message):
+        if not self.connected:
+            return
+
+        self.__outbound.append(Message.new_send_message(message.encode("utf-8")).encode())
+        self.__signal(self.__wake_w)
+
+    def receive(self):
+        self.__clear(self.__notify_r)
+
+        if self.__inbound:
+            return self.__inbound.popleft()
+        return None
+
+    def receive_all(self):
+        self.__clear(self.__notify_r)
+
+        messages = []
+        while self.__inbound:
+            messages.append(self.__inbound.popleft())
+
+        return messages
+
+    def close(self, timeout=0.5):
+        # anything already queued is flushed before the socket is closed
+        self.__closing = True
+        self.__signal(self.__wake_w)
+        self.__io_thread.join(timeout)
+
+        # the sockets used for waking the threads are only closed once nothing can be waiting on them
+        if not self.__io_thread.is_alive():
+            for s in (self.__wake_r, self.__wake_w, self.__notify_r, self.__notify_w):
+                s.close()
+
+    def __io_loop(self):
+        stream = MessageStream()
+        last_received = time.perf_counter()
+
+        try:
+            while True:
+                timeout = None
+
+                if self.idle_timeout is not None:
+                    timeout = self.idle_timeout - (time.perf_counter() - last_received)
+
+                    if timeout <= 0:
+                        raise TimeoutError("The server stopped responding")
+
+                readable, _, _ = select.select([self.client_socket, self.__wake_r], [], [], timeout)
+
+                if self.__wake_r in readable:
+                    self.__clear(self.__wake_r)
+
+                while self.__outbound:
+                    self.client_socket.sendall(self.__outbound.popleft())
+
+                if self.__closing:
+                    break
+
+                if self.client_socket in readable:
+                    buffer = self.client_socket.recv(ServerConnection.RECV_SIZE)
+
+                    if not buffer:
+                        break
+
+                    last_received = time.perf_counter()
+                    received = False
+
+                    for m in stream.feed(buffer):
+                        message = m.message.decode("utf-8")
+
+                        # answer pings straight away so the round trip doesn't include waiting for a frame
+                        if message.startswith(Instruction.Update.PING):
+                            pong = Instruction.Update.PONG + message[len(Instruction.Update.PING):]
+                            self.client_socket.sendall(Message.new_send_message(pong.encode("utf-8")).encode())
+                        else:
+                            self.__inbound.append(message)
+                            received = True
+
+                    if received:
+                        self.__signal(self.__notify_w)
+        except OSError as e:
+            self.error = e
+        finally:
+            self.connected = False
+            self.client_socket.close()
+            self.__signal(self.__notify_w)
+
+    @staticmethod
+    def __signal(s):
+        try:
+            s.send(b"\0")
+        except (BlockingIOError, OSError):
+            # either a wakeup is already pending, or the other end has gone away
+            pass
+
+    @staticmethod
+    def __clear(s):
+        try:
+            while s.recv(ServerConnection.RECV_SIZE):
+                pass
+        except (BlockingIOError, OSError):
+            pass
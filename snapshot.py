@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+
+class SnapshotWriter:
+    def __init__(self, path):
+        # path is a directory, with a file for each room, so that a move only rewrites the room it was made in
+        self.path = path
+
+        self.writes = 0
+        self.errors = 0
+
+        os.makedirs(path, exist_ok=True)
+
+        # only the latest snapshot of each room matters, so one that has not been written yet is simply replaced by
+        # the next. None means the room's file is to be removed.
+        self.__pending = {}
+        self.__closed = False
+
+        self.__condition = threading.Condition()
+
+        self.__thread = threading.Thread(target=self.__write_loop, daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def load(path):
+        # the snapshot of every room in the directory, leaving out any which cannot be read
+        try:
+            names = sorted(os.listdir(path))
+        except OSError:
+            return []
+
+        snapshots = []
+
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(path, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+
+        return snapshots
+
+    def room_path(self, room_id):
+        return os.path.join(self.path, f"room-{room_id}.json")
+
+    def submit(self, room_id, snapshot):
+        # called from the server loop, which never waits for the disk
+        with self.__condition:
+            self.__pending[room_id] = snapshot
+            self.__condition.notify()
+
+    def remove(self, room_id):
+        self.submit(room_id, None)
+
+    def close(self, timeout=2.0):
+        # anything still pending is written before the thread finishes
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+
+        self.__thread.join(timeout)
+
+    def __write_loop(self):
+        while True:
+            with self.__condition:
+                while not self.__pending and not self.__closed:
+                    self.__condition.wait()
+
+                if not self.__pending:
+                    return
+
+                pending, self.__pending = self.__pending, {}
+
+            for room_id, snapshot in pending.items():
+                try:
+                    self.write(room_id, snapshot)
+                except OSError as e:
+                    self.errors += 1
+                    print(f"Failed to write snapshot to {self.room_path(room_id)}: {e}")
+
+    def write(self, room_id, snapshot):
+        path = self.room_path(room_id)
+
+        if snapshot is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        # written to the side and then renamed over the old one, so the file on disk is always a whole snapshot
+        temp_path = path + ".tmp"
+
+        with open(temp_path, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, path)
+
+        self.writes += 1
@@ -0,0 +1,133 @@
+import time
+from message import Message
+
+
+class SpectatorFanout:
+    ROLE = "spectator"
+
+    # spectators are sent whatever has happened since the last batch this often, in a single frame with one
+    # instruction per line, so each batch is encoded once however many people are watching
+    BATCH_INTERVAL = 0.25
+    # bytes per second sent to each spectator, which is also the most that can be sent in one go
+    RATE_LIMIT = 64 * 1024
+    # a spectator this far behind is dropped back to a fresh snapshot rather than sent the whole backlog
+    MAX_BACKLOG = 256 * 1024
+    # spectators never send anything, so one who has not taken any of what they are owed for this long is assumed
+    # to have gone without closing the connection
+    STALL_TIMEOUT = 10.0
+
+    def __init__(self):
+        # address: {"socket", "buffer" of bytes still to send, "tokens" for the rate limit, "resync", "last_sent"}
+        self.__spectators = {}
+
+        # public deltas published since the last batch
+        self.__pending = []
+        self.__last_flush = time.perf_counter()
+
+        self.bytes_sent = 0
+        self.resyncs = 0
+        self.stalls = 0
+
+    def __contains__(self, address):
+        return address in self.__spectators
+
+    def __len__(self):
+        return len(self.__spectators)
+
+    @staticmethod
+    def encode(lines):
+        return Message.new_send_message("\n".join(lines).encode("utf-8")).encode()
+
+    def add(self, address, sock):
+        sock.setblocking(False)
+        self.__spectators[address] = {"socket": sock, "buffer": bytearray(), "tokens": SpectatorFanout.RATE_LIMIT,
+                                      "resync": True, "last_sent": time.perf_counter()}
+
+    def remove(self, address):
+        return self.__spectators.pop(address)["socket"]
+
+    def sockets(self):
+        return [spectator["socket"] for spectator in self.__spectators.values()]
+
+    def backlog(self):
+        return sum(len(spectator["buffer"]) for spectator in self.__spectators.values())
+
+    def publish(self, text):
+        if self.__spectators:
+            self.__pending.append(text)
+
+    def resync_all(self):
+        # used when the table changes outside of the delta stream, e.g. a new game
+        self.__pending = []
+
+        for spectator in self.__spectators.values():
+            spectator["resync"] = True
+
+    def flush(self, snapshot_fn):
+        # returns the sockets of any spectators that have gone away, or stopped reading
+        now = time.perf_counter()
+        elapsed = now - self.__last_flush
+
+        if elapsed < SpectatorFanout.BATCH_INTERVAL:
+            return []
+
+        self.__last_flush = now
+
+        batch = SpectatorFanout.encode(self.__pending) if self.__pending else b""
+        self.__pending = []
+
+        snapshot = None
+        dropped = []
+
+        for spectator in self.__spectators.values():
+            buffer = spectator["buffer"]
+
+            if spectator["resync"]:
+                # the snapshot is taken after this batch was applied, so the batch is not needed as well
+                if snapshot is None:
+                    text = snapshot_fn()
+                    snapshot = b"" if text is None else SpectatorFanout.encode([text])
+
+                buffer[:] = snapshot
+                spectator["resync"] = False
+
+            elif batch:
+                if len(buffer) + len(batch) > SpectatorFanout.MAX_BACKLOG:
+                    buffer.clear()
+                    spectator["resync"] = True
+                    self.resyncs += 1
+                    continue
+
+                buffer += batch
+
+            spectator["tokens"] = min(SpectatorFanout.RATE_LIMIT,
+                                      spectator["tokens"] + SpectatorFanout.RATE_LIMIT * elapsed)
+
+            if not buffer:
+                spectator["last_sent"] = now
+                continue
+
+            if now - spectator["last_sent"] >= SpectatorFanout.STALL_TIMEOUT:
+                self.stalls += 1
+                dropped.append(spectator["socket"])
+                continue
+
+            if spectator["tokens"] < 1:
+                continue
+
+            try:
+                sent = spectator["socket"].send(buffer[:int(spectator["tokens"])])
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                dropped.append(spectator["socket"])
+                continue
+
+            del buffer[:sent]
+            spectator["tokens"] -= sent
+
+            if sent:
+                spectator["last_sent"] = now
+            self.bytes_sent += sent
+
+        return dropped
@@ -0,0 +1,73 @@
+import threading
+import time
+from message import Message, MessageStream
+from instructions import Instruction, parse_instruction
+from model import GameState
+from prediction import Prediction
+
+
+class LoopbackClient:
+    # a player connected to an in-process server, predicting its own moves the way the game client does
+    def __init__(self, server, name):
+        self.messages = []
+        self.prediction = None
+        self.player = None
+
+        self.__stream = MessageStream()
+        self.__lock = threading.Lock()
+        self.__n_center_piles = GameState.N_CENTER_PILES
+        self.__deck = None
+
+        self.sock = server.connect_loopback(self.__deliver)
+        self.send(f"{Instruction.SET_PROPERTY}:'name':'{name}'")
+
+    def __deliver(self, data):
+        with self.__lock:
+            self.messages.extend(m.message.decode("utf-8") for m in self.__stream.feed(data))
+
+    def send(self, message):
+        self.sock.write(Message.new_send_message(message.encode("utf-8")).encode())
+
+    def send_move(self, instruction, *operands):
+        operands = [str(o) for o in operands]
+        seq = self.prediction.predict(instruction, operands)
+        self.send(self.prediction.move_message(instruction, operands, seq))
+        return seq
+
+    def send_echoed(self, instruction, *operands):
+        # mongoose calls and flips are only made once the server echoes them
+        self.prediction.expect_echo(instruction, operands)
+        self.send(instruction + "".join(f":'{o}'" for o in operands))
+
+    def handle(self, until, timeout=5.0):
+        # handles messages until one satisfies until, returning it
+        deadline = time.perf_counter() + timeout
+
+        while time.perf_counter() < deadline:
+            with self.__lock:
+                message = self.messages.pop(0) if self.messages else None
+
+            if message is None:
+                time.sleep(0.001)
+                continue
+
+            instruction, operands = parse_instruction(message)
+
+            if instruction == Instruction.Game.TABLE:
+                self.__n_center_piles = int(operands[1])
+            elif instruction == Instruction.Game.SEND_DECK:
+                self.__deck = GameState.decode_deck(operands)
+            elif instruction == Instruction.START_GAME:
+                self.player = int(operands[0])
+                self.prediction = Prediction(GameState(self.__deck, len(operands[1:]) // 2, self.__n_center_piles))
+            elif instruction == Instruction.Game.ACK:
+                self.prediction.confirm(int(operands[0]))
+            elif instruction == Instruction.Game.REJECT:
+                self.prediction.reject(int(operands[0]))
+            elif instruction in GameState.MOVES or instruction == Instruction.Game.SYNC_STATE:
+                self.prediction.apply_remote(instruction, operands)
+
+            if until(instruction, operands):
+                return instruction, operands
+
+        raise TimeoutError("Nothing the test was waiting for arrived")
@@ -0,0 +1,30 @@
+import pytest
+from instructions import Instruction
+from model import Deck, GameState
+
+
+def dealt_state(n_players=2):
+    cards = [(card.suit, card.value, card.deck) for card in Deck.full(1).cards]
+    return GameState(cards, n_players)
+
+
+@pytest.mark.parametrize("instruction, operands", [
+    (Instruction.Game.CALL_MONGOOSE, ["9", "1"]),
+    (Instruction.Game.CALL_MONGOOSE, ["-1", "0"]),
+    (Instruction.Game.PLACE_CARD, ["0", "-1"]),
+    (Instruction.Game.PLACE_CARD, ["-2", "4"]),
+    (Instruction.Game.PLACE_CARD, ["0", "99"]),
+    (Instruction.Game.FLIP_DECK, ["5"]),
+    (Instruction.Game.FLIP_DECK, ["-1"]),
+])
+def test_rejected_moves_change_nothing(instruction, operands):
+    state = dealt_state()
+    state.pickup(0)
+    before, before_hash = state.to_dict(), state.state_hash()
+
+    with pytest.raises((IndexError, ValueError)):
+        state.apply_instruction(instruction, operands)
+
+    assert state.to_dict() == before
+    assert state.state_hash() == before_hash
+    assert sum(map(len, state.decks)) + 1 == 52
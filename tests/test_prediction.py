@@ -0,0 +1,79 @@
+import threading
+from instructions import Instruction
+from loopback_client import LoopbackClient
+from server import Server
+
+
+def test_auto_mongoose_then_place_does_not_resync():
+    server = Server(("127.0.0.1", 0), verbose=False, table_size=2)
+    server_thread = threading.Thread(target=server.start_server, kwargs={"console": False}, daemon=True)
+    server_thread.start()
+
+    try:
+        clients = [LoopbackClient(server, f"player{i}") for i in range(2)]
+
+        for client in clients:
+            client.handle(lambda instruction, _: instruction == Instruction.START_GAME)
+
+        client = next(c for c in clients if c.player == 0)
+        seen = []
+
+        def answered(seq):
+            def until(instruction, operands):
+                seen.append(instruction)
+                return instruction in (Instruction.Game.ACK, Instruction.Game.REJECT) and int(operands[0]) == seq
+            return until
+
+        # a card placed on a center pile of the wrong suit: the player is auto-mongoosed, and the card goes back onto
+        # their own face up pile
+        client.send_move(Instruction.Game.PICKUP_CARD, 0)
+        client.send_echoed(Instruction.Game.CALL_MONGOOSE, 0, 1)
+        seq = client.send_move(Instruction.Game.PLACE_CARD, 0, 1)
+
+        # the server echoes the mongoose ahead of answering the place
+        assert client.handle(answered(seq))[0] == Instruction.Game.ACK
+        assert Instruction.Game.CALL_MONGOOSE in seen
+
+        # once the mongoose has come back, moves carry the hash again, and it matches
+        seq = client.send_move(Instruction.Game.PICKUP_CARD, 0)
+        assert client.handle(answered(seq))[0] == Instruction.Game.ACK
+
+        assert Instruction.Game.SYNC_STATE not in seen
+        assert server.metrics.resyncs == 0
+        assert client.prediction.state_hash() is not None
+    finally:
+        server.stop_server()
+        server_thread.join(5)
+
+
+def test_rate_limited_move_is_rejected():
+    # a single pickup and nothing more
+    server = Server(("127.0.0.1", 0), verbose=False, table_size=2,
+                    rate_limits={Instruction.Game.PICKUP_CARD: (0.0, 1)})
+    server_thread = threading.Thread(target=server.start_server, kwargs={"console": False}, daemon=True)
+    server_thread.start()
+
+    try:
+        clients = [LoopbackClient(server, f"player{i}") for i in range(2)]
+
+        for client in clients:
+            client.handle(lambda instruction, _: instruction == Instruction.START_GAME)
+
+        client = next(c for c in clients if c.player == 0)
+
+        def answered(seq):
+            return lambda instruction, operands: \
+                instruction in (Instruction.Game.ACK, Instruction.Game.REJECT) and int(operands[0]) == seq
+
+        assert client.handle(answered(client.send_move(Instruction.Game.PICKUP_CARD, 0)))[0] == Instruction.Game.ACK
+        assert client.handle(answered(client.send_move(Instruction.Game.PLACE_CARD, 0, 1)))[0] == Instruction.Game.ACK
+
+        # the second pickup goes over the limit, and is taken back rather than left shown as made
+        assert client.handle(answered(client.send_move(Instruction.Game.PICKUP_CARD, 0)))[0] == \
+            Instruction.Game.REJECT
+        assert len(client.prediction) == 0
+        assert client.prediction.view.to_dict() == client.prediction.confirmed.to_dict()
+        assert server.metrics.dropped_messages == {Instruction.Game.PICKUP_CARD: 1}
+    finally:
+        server.stop_server()
+        server_thread.join(5)
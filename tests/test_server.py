@@ -0,0 +1,95 @@
+import socket
+import threading
+import time
+import urllib.request
+from instructions import Instruction
+from loopback_client import LoopbackClient
+from server import Server
+
+
+def accepted_client(server):
+    # the server only decodes messages from clients it has accepted. Nothing is ever flushed to the socket.
+    client = ("127.0.0.1", 0)
+    server.accept_new_client(socket.socketpair()[0], client)
+    return client
+
+
+def test_malformed_frames_are_dropped():
+    server = Server(("127.0.0.1", 0), verbose=False)
+    client = accepted_client(server)
+
+    for message in ("u_pong", "u_pong:'x'", "u_pong:'1':'2'", "setp:'name'", "setp", "u_message"):
+        server.decode_instruction(client, message)
+
+    assert server.metrics.malformed_messages == {Instruction.Update.PONG: 3, Instruction.SET_PROPERTY: 2,
+                                                 Instruction.Update.CHAT_MESSAGE: 1}
+
+    # the client can carry on as normal afterwards
+    server.decode_instruction(client, f"{Instruction.SET_PROPERTY}:'name':'alice'")
+    server.decode_instruction(client, f"{Instruction.Update.PONG}:'1'")
+
+    assert sum(server.metrics.malformed_messages.values()) == 6
+
+
+def test_metrics_are_served_alongside_a_stalled_scraper():
+    server = Server(("127.0.0.1", 0), verbose=False, metrics_port=0)
+    server_thread = threading.Thread(target=server.start_server, kwargs={"console": False}, daemon=True)
+    server_thread.start()
+
+    port = server.metrics_sock.getsockname()[1]
+
+    try:
+        # a scraper which has not read its response yet is left waiting while another is answered
+        stalled = socket.create_connection(("127.0.0.1", port))
+        stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+        stalled.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+            assert b"mongoose_connected_clients" in response.read()
+
+        stalled.close()
+    finally:
+        server.stop_server()
+        server_thread.join(5)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+
+    while not condition():
+        assert time.perf_counter() < deadline, "The server never got there"
+        time.sleep(0.01)
+
+
+def test_room_waits_for_everyone_to_rejoin():
+    server = Server(("127.0.0.1", 0), verbose=False, table_size=2, rejoin_timeout=2.0)
+    server_thread = threading.Thread(target=server.start_server, kwargs={"console": False}, daemon=True)
+    server_thread.start()
+
+    def games_running():
+        return server.metrics_gauges()["mongoose_games_running"]
+
+    try:
+        clients = [LoopbackClient(server, f"player{i}") for i in range(2)]
+
+        for client in clients:
+            client.handle(lambda instruction, _: instruction == Instruction.START_GAME)
+
+        # everyone drops out at once, without quitting
+        for client in clients:
+            client.sock.hang_up()
+
+        wait_for(lambda: server.metrics_gauges()["mongoose_connected_clients"] == 0)
+        assert games_running() == 1
+
+        rejoined = LoopbackClient(server, "player1")
+        assert rejoined.handle(lambda instruction, _: instruction == Instruction.START_GAME)[1][0] == \
+            str(clients[1].player)
+
+        # once nobody is left to come back, the room is closed after the rejoin timeout
+        rejoined.send(Instruction.Update.QUIT_GAME)
+        rejoined.sock.hang_up()
+        wait_for(lambda: games_running() == 0, timeout=5.0)
+    finally:
+        server.stop_server()
+        server_thread.join(5)
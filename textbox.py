@@ -1,8 +1,6 @@
 import pygame
 from text import Text
 
-pygame.init()
-
 
 class TextBox:
     DEFAULT_ACTIVE_COLOUR = (255, 255, 255)
@@ -12,13 +10,15 @@ class TextBox:
 
     REGISTERED_TEXTBOXES = {}
 
-    def __init__(self, center, size, text=Text(), shadow_text=Text(), active_colour=None, inactive_colour=None, register_group="main"):
+    def __init__(self, center, size, text=None, shadow_text=None, active_colour=None, inactive_colour=None, register_group="main"):
         self.center = center
         self.size = size
         self.active_colour = active_colour if active_colour is not None else TextBox.DEFAULT_ACTIVE_COLOUR
         self.inactive_colour = inactive_colour if inactive_colour is not None else TextBox.DEFAULT_INACTIVE_COLOUR
+        # the default texts are made here rather than in the signature, so that importing this needs no fonts
+        text = Text() if text is None else text
         self.text = text.text
-        self.shadow_text = shadow_text
+        self.shadow_text = Text() if shadow_text is None else shadow_text
         self.__display_text = text
         self.active = False
 
@@ -0,0 +1,242 @@
+import argparse
+import os
+import threading
+import time
+import pygame
+from atlas import TextureAtlas
+from model import Deck
+
+
+def load_texture(tex_name, resource):
+    assert (os.path.exists(os.path.join(resource, tex_name)))
+    texture = pygame.image.load(os.path.join(resource, tex_name))
+
+    # blitting is several times faster once the pixels are in the display's format
+    if pygame.display.get_surface() is not None:
+        texture = texture.convert_alpha()
+
+    return texture
+
+
+def resize_texture(texture, target_width):
+    _, _, w, h = texture.get_rect()
+    s_factor = target_width / w
+
+    resized = pygame.transform.scale(texture, (int(w * s_factor), int(h * s_factor)))
+
+    return resized
+
+
+def rescale_back(texture):
+    _, _, w, h = texture.get_rect()
+    return pygame.transform.scale(texture, (w, int(w * 726 / 500)))
+
+
+class CardTextures:
+    RES_LOCATION = "./res/textures/cards"
+    # TODO: make this more flexible
+    BACK_TEXTURE_NAME = "card_back.png"
+
+    # every card and the back, pre-scaled and in the display's pixel format, built by running this file
+    ATLAS_PATH = "./res/textures/cards.atlas"
+    # cards are drawn at around 7% of the window width, so this is plenty for windows up to about 3600 pixels wide
+    ATLAS_CARD_WIDTH = 256
+
+    # textures are only loaded the first time they are drawn, so a card which is never seen face up is never loaded
+    __textures = {}
+    # False until the atlas has been looked for, then the atlas or None if there isn't one
+    __atlas = False
+
+    # copies of every texture at the sizes the layout draws cards at, once the game has said what those are
+    pyramid = None
+
+    @staticmethod
+    def atlas():
+        if CardTextures.__atlas is False:
+            CardTextures.__atlas = TextureAtlas.load(CardTextures.ATLAS_PATH)
+
+        return CardTextures.__atlas
+
+    @staticmethod
+    def texture_name(card):
+        return str(card).replace(" ", "_").lower() + ".png"
+
+    @staticmethod
+    def names():
+        return [CardTextures.texture_name(card) for card in Deck.get_all_cards()] + [CardTextures.BACK_TEXTURE_NAME]
+
+    @staticmethod
+    def texture(name):
+        if name not in CardTextures.__textures:
+            CardTextures.__textures[name] = CardTextures.load(name)
+
+        return CardTextures.__textures[name]
+
+    @staticmethod
+    def face(card):
+        return CardTextures.texture(CardTextures.texture_name(card))
+
+    @staticmethod
+    def back():
+        return CardTextures.texture(CardTextures.BACK_TEXTURE_NAME)
+
+    @staticmethod
+    def load(name):
+        atlas = CardTextures.atlas()
+
+        if atlas is not None and name in atlas:
+            return atlas.texture(name)
+
+        texture = load_texture(name, CardTextures.RES_LOCATION)
+
+        # the back is stored in the atlas already rescaled
+        return rescale_back(texture) if name == CardTextures.BACK_TEXTURE_NAME else texture
+
+    @staticmethod
+    def render(card, render_target, center, size, face=True):
+        name = CardTextures.texture_name(card) if face else CardTextures.BACK_TEXTURE_NAME
+
+        screen_size = render_target.get_size()
+        sc_w = int(screen_size[0] * size)
+
+        texture = None if CardTextures.pyramid is None else CardTextures.pyramid.get(name, sc_w)
+
+        if texture is None:
+            texture = resize_texture(CardTextures.texture(name), sc_w)
+
+        sc_s_x = screen_size[0] * center[0] - sc_w / 2
+        sc_s_y = screen_size[1] * center[1] - texture.get_height() / 2
+
+        render_target.blit(texture, (sc_s_x, sc_s_y))
+
+    @staticmethod
+    def build_atlas(path=ATLAS_PATH, card_width=ATLAS_CARD_WIDTH):
+        textures = {}
+
+        for name in CardTextures.names():
+            texture = load_texture(name, CardTextures.RES_LOCATION)
+
+            if name == CardTextures.BACK_TEXTURE_NAME:
+                texture = rescale_back(texture)
+
+            w, h = texture.get_size()
+            if w > card_width:
+                texture = pygame.transform.smoothscale(texture, (card_width, round(h * card_width / w)))
+
+            textures[name] = texture
+
+        TextureAtlas.write(path, textures)
+
+        return textures
+
+
+class TexturePyramid:
+    # how long the window has to stay the same width before the textures are rebuilt for it, so that dragging the
+    # edge of the window does not start a rebuild every frame
+    RESIZE_DEBOUNCE = 0.15
+
+    def __init__(self, load, names, sizes):
+        # load gives the full size texture for a name, and sizes are the fractions of the window width which
+        # textures are drawn at
+        self.__load = load
+        self.__names = names
+        self.sizes = tuple(sizes)
+
+        # (name, width in pixels): texture for the window width and sizes the set was built for. The whole set is
+        # replaced at once by the build thread, so the render loop never sees one half built.
+        self.__textures = {}
+        self.__built_for = None
+
+        self.__target = None
+        self.__target_since = 0.0
+
+        self.__build_thread = None
+        self.__built = None
+
+        self.builds = 0
+
+    def ready(self, window_width):
+        return self.__built_for == (window_width, self.sizes)
+
+    @staticmethod
+    def widths(window_width, sizes):
+        return sorted({int(window_width * size) for size in sizes})
+
+    def update(self, window_width, sizes=None):
+        # called once a frame with the current window width, and the sizes if the layout has changed them
+        now = time.perf_counter()
+
+        if sizes is not None:
+            self.sizes = tuple(sizes)
+
+        if (window_width, self.sizes) != self.__target:
+            self.__target = (window_width, self.sizes)
+            self.__target_since = now
+
+        if self.__built is not None:
+            self.__built_for, self.__textures = self.__built
+            self.__built = None
+
+        if self.__built_for == self.__target:
+            return
+
+        if self.__build_thread is not None and self.__build_thread.is_alive():
+            return
+
+        # the first set is built straight away; after that, only once the window has stopped changing
+        if self.__built_for is not None and now - self.__target_since < TexturePyramid.RESIZE_DEBOUNCE:
+            return
+
+        # the sources are loaded here, since loading goes through the shared texture cache and makes surfaces in the
+        # display's format, which is only safe on the main thread. The build thread gets copies of its own to scale.
+        sources = [(name, self.__load(name).copy()) for name in self.__names]
+
+        self.__build_thread = threading.Thread(target=self.__build, args=(self.__target, sources), daemon=True)
+        self.__build_thread.start()
+
+    def __build(self, target, sources):
+        textures = {}
+
+        for name, texture in sources:
+            w, h = texture.get_size()
+
+            for width in TexturePyramid.widths(*target):
+                textures[(name, width)] = pygame.transform.smoothscale(texture, (width, int(h * width / w)))
+
+        self.builds += 1
+        self.__built = (target, textures)
+
+    def get(self, name, width):
+        texture = self.__textures.get((name, width))
+
+        if texture is not None or self.__built_for is None:
+            return texture
+
+        # while the set for a new window size is being built, the closest texture from the last set is stretched,
+        # which is far cheaper than scaling down the full size one
+        nearest = min(TexturePyramid.widths(*self.__built_for), key=lambda w: abs(w - width))
+        texture = self.__textures.get((name, nearest))
+
+        if texture is None:
+            return None
+
+        return pygame.transform.scale(texture, (width, int(texture.get_height() * width / nearest)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the card textures into an atlas the game can map straight "
+                                                 "into memory, rather than decoding every PNG at startup.")
+    parser.add_argument("-o", "--output", default=CardTextures.ATLAS_PATH)
+    parser.add_argument("-w", "--width", type=int, default=CardTextures.ATLAS_CARD_WIDTH,
+                        help="the width in pixels each card is stored at")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    textures = CardTextures.build_atlas(args.output, args.width)
+
+    print(f"Packed {len(textures)} textures into {args.output} ({os.path.getsize(args.output) / 1024 / 1024:.1f}MiB) "
+          f"in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
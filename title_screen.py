@@ -1,29 +1,34 @@
 import pygame
 import socket
-import errno
 import threading
 from button import Button
 from text import Text, TextFeed
 from textbox import TextBox
-from message import Message
-from instructions import Instruction
-from cards import Deck, Card
+from server_connection import ServerConnection
+from instructions import Instruction, parse_instruction
+from model import Deck, Card, GameState
+from frame_scheduler import FrameScheduler
+from frame_profiler import FrameProfiler
 
 
 class TitleScreen:
     UPDATE_FREQUENCY = 1000
 
-    def __init__(self, screen_size=(1280, 720), title="Mongoose", clear_colour=(66, 135, 245)):
+    def __init__(self, screen_size=(1280, 720), title="Mongoose", clear_colour=(66, 135, 245),
+                 max_fps=FrameScheduler.DEFAULT_MAX_FPS, idle_fps=FrameScheduler.DEFAULT_IDLE_FPS):
         self.screen_size = screen_size
         self.title = title
         self.clear_colour = clear_colour
 
-        pygame.init()
+        # only the parts of pygame the game uses are started
+        pygame.display.init()
+        pygame.font.init()
 
         self.screen = pygame.display.set_mode(screen_size, pygame.DOUBLEBUF | pygame.RESIZABLE)
         pygame.display.set_caption(title)
 
-        self.clock = pygame.time.Clock()
+        self.frame_scheduler = FrameScheduler(max_fps, idle_fps)
+        self.profiler = FrameProfiler()
 
         self.__title_text = Text(title, 64, text_colour=(255, 255, 255))
 
@@ -49,23 +54,24 @@ class TitleScreen:
 
         self.__info_feed = TextFeed((0.85, 0.5), (0.3, 0.3))
 
-        self.client_socket = None
+        self.connection = None
 
         self.__connected_to_server = False
 
-        # self.__server_handling_thread = threading.Thread(target=self.handle_server_io, daemon=True)
-
-        # self.__server_handling_thread.start()
-
         self.__sync_deck = None
+        self.__n_center_piles = GameState.N_CENTER_PILES
         self.__game_package = []
 
         self.__join_game_thread = None
 
     def run(self):
         while not self.__game_package:
+            self.profiler.begin_frame()
+
             pygame.event.pump()
             for event in pygame.event.get():
+                self.profiler.mark("events")
+
                 if event.type == pygame.VIDEORESIZE:
                     self.screen_size = (event.w, event.h)
                     self.screen = pygame.display.set_mode(self.screen_size, pygame.DOUBLEBUF | pygame.RESIZABLE)
@@ -73,18 +79,36 @@ class TitleScreen:
                 if event.type == pygame.QUIT:
                     self.quit()
 
+                if event.type == pygame.KEYDOWN and event.key == FrameProfiler.TOGGLE_KEY:
+                    self.profiler.toggle()
+
                 TextBox.update_all("title_screen", self.screen_size, event)
+                self.profiler.mark("textboxes.title_screen")
+
+                Button.update_all("title_screen", self.screen_size, event)
+                self.profiler.mark("buttons.title_screen")
 
-            mouse_pos = pygame.mouse.get_pos()
-            mouse_pressed = pygame.mouse.get_pressed()
+                if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION, pygame.KEYDOWN):
+                    self.frame_scheduler.mark_active()
+                else:
+                    self.frame_scheduler.request_redraw()
+
+            self.profiler.mark("events")
+
+            if self.frame_scheduler.should_render():
+                self.render()
 
-            Button.update_all("title_screen", self.screen_size, mouse_pos, mouse_pressed)
+                self.profiler.render(self.screen)
+                self.profiler.mark("render.profiler")
 
-            self.render()
+                pygame.display.flip()
+                self.profiler.mark("display.flip")
 
             self.handle_server_io()
+            self.profiler.mark("handle_server_io")
 
-            self.clock.tick(60)
+            self.frame_scheduler.tick([self.connection] if self.__connected_to_server else [])
+            self.profiler.mark("tick")
 
         return self.__game_package
 
@@ -100,7 +124,7 @@ class TitleScreen:
 
         self.__info_feed.render(self.screen)
 
-        pygame.display.flip()
+        self.profiler.mark("render")
 
     def join_game(self):
         if self.__join_game_thread is not None:
@@ -122,21 +146,17 @@ class TitleScreen:
             self.__status_text.text_colour = (255, 170, 0)
             self.__status_text.update()
 
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.settimeout(10)
-            self.client_socket.connect((ip, port))
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.settimeout(10)
+            client_socket.connect((ip, port))
 
-            self.client_socket.setblocking(False)
+            self.connection = ServerConnection(client_socket)
 
             self.__status_text.text = f"Status: Connected to {ip}:{port}. Waiting for game..."
             self.__status_text.text_colour = (0, 255, 0)
             self.__status_text.update()
 
-            name_message = Message.new_send_message(
-                f"{Instruction.SET_PROPERTY}:'name':'{self.__name_input.text}'".encode("utf-8")
-            )
-
-            self.client_socket.sendall(name_message.encode())
+            self.connection.send(f"{Instruction.SET_PROPERTY}:'name':'{self.__name_input.text}'")
 
             self.__connected_to_server = True
 
@@ -154,60 +174,39 @@ class TitleScreen:
         if not self.__connected_to_server:
             return
 
-        try:
-            message = Message.new_recv_message()
+        handled = False
 
-            buffer = self.client_socket.recv(Message.BUFFER_SIZE)
+        # stop as soon as the game starts; anything after that belongs to the game itself
+        while not self.__game_package and self.__connected_to_server:
+            message = self.connection.receive()
 
-            if not buffer:
-                self.__status_text.text = f"Status: Lost connection to server."
-                self.__status_text.text_colour = (255, 0, 0)
-                self.__status_text.update()
-                self.client_socket.close()
+            if message is None:
+                break
 
-                self.__connected_to_server = False
+            self.decode_instruction(message)
+            handled = True
 
-            while not message.decode(buffer):
-                buffer = self.client_socket.recv(Message.BUFFER_SIZE)
+        if handled:
+            self.frame_scheduler.mark_active()
 
-            self.decode_instruction(message.message.decode("utf-8"))
-        except IOError as e:
-            if e.errno != errno.EAGAIN and e.errno != errno.EWOULDBLOCK:
-                self.__status_text.text = f"Error: {e}"
-                self.__status_text.text_colour = (255, 0, 0)
-                self.__status_text.update()
-                self.client_socket.close()
+        if self.__connected_to_server and not self.connection.connected:
+            if self.connection.error is not None:
+                self.__status_text.text = f"Error: {self.connection.error}"
+            else:
+                self.__status_text.text = f"Status: Lost connection to server."
+            self.__status_text.text_colour = (255, 0, 0)
+            self.__status_text.update()
 
-                self.__connected_to_server = False
+            self.__connected_to_server = False
 
     def decode_instruction(self, message):
-        operands = []
-
-        if ":" in message:
-            instruction, operand = message.split(":", 1)
-
-            in_string = False
-            cur_operand = ""
-
-            for c in operand:
-                if c == "'":
-                    in_string = not in_string
-                else:
-                    if in_string:
-                        cur_operand += c
-                    elif c == ":":
-                        operands.append(cur_operand)
-                        cur_operand = ""
-
-            operands.append(cur_operand)
-        else:
-            instruction = message
+        instruction, operands = parse_instruction(message)
 
         if instruction == Instruction.Update.GAME_RUNNING:
             self.__status_text.text = f"Status: Game already running on server."
             self.__status_text.text_colour = (255, 170, 0)
             self.__status_text.update()
-            self.client_socket.close()
+            self.connection.close()
 
             self.__connected_to_server = False
 
@@ -232,24 +231,22 @@ class TitleScreen:
             assert len(operands) == 1
             self.__info_feed.add_line(f"Player {operands[0]} joined the game.")
 
-        if instruction == Instruction.Game.SEND_DECK:
-            assert len(operands) == 52
-            suit_map = {"0": "Spades", "1": "Diamonds", "2": "Clubs", "3": "Hearts"}
-
-            cards = []
+        if instruction == Instruction.Game.TABLE:
+            assert len(operands) == 2
+            self.__n_center_piles = int(operands[1])
 
-            for card in operands:
-                s, v = card.split("-")
-                cards.append(Card(suit_map[s], int(v)))
+        if instruction == Instruction.Game.SEND_DECK:
+            # one or more whole decks shuffled together
+            assert operands and len(operands) % 52 == 0
 
-            self.__sync_deck = Deck(cards)
+            self.__sync_deck = Deck([Card(*card) for card in GameState.decode_deck(operands)])
 
     def start_game(self, active_id, players):
-        self.__game_package = [active_id, players, self.client_socket, self.__sync_deck]
+        self.__game_package = [active_id, players, self.connection, self.__sync_deck, self.__n_center_piles]
 
     def quit(self):
         if self.__connected_to_server:
-            self.client_socket.sendall(Message.new_send_message(Instruction.Update.QUIT_GAME.encode("utf-8")).encode())
-        # self.__server_handling_thread.join(0.5)
+            self.connection.send(Instruction.Update.QUIT_GAME)
+            self.connection.close()
         pygame.quit()
         quit()